@@ -3,9 +3,9 @@ Cloud Function - Activar Análisis para Transcripciones Existentes
 Procesa todas las transcripciones sin análisis
 """
 import functions_framework
-import requests
 import logging
 from google.cloud import bigquery
+from clients import get_client, http_pool_delta, http_pool_stats, post_json
 
 PROJECT_ID = "peak-emitter-350713"
 DATASET_ID = "Calidad_Llamadas"
@@ -14,6 +14,10 @@ ANALYSIS_URL = "https://us-central1-peak-emitter-350713.cloudfunctions.net/analy
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def get_bigquery_client():
+    """Cliente BigQuery compartido"""
+    return get_client('bigquery', lambda: bigquery.Client(project=PROJECT_ID))
+
 @functions_framework.http
 def trigger_batch_analysis(request):
     """
@@ -23,7 +27,7 @@ def trigger_batch_analysis(request):
         logger.info("🔄 Iniciando análisis en lote para transcripciones existentes...")
         
         # 1. Obtener todas las transcripciones sin análisis
-        client = bigquery.Client(project=PROJECT_ID)
+        client = get_bigquery_client()
         
         query = f"""
         SELECT t.dni, t.transcripcion_texto, t.audio_url
@@ -48,6 +52,7 @@ def trigger_batch_analysis(request):
         logger.info(f"📋 Encontradas {len(result)} transcripciones para analizar")
         
         # 2. Procesar cada transcripción
+        pool_before = http_pool_stats()
         processed = 0
         errors = 0
         
@@ -76,7 +81,8 @@ def trigger_batch_analysis(request):
             "message": f"Análisis en lote completado: {processed}/{len(result)}",
             "processed": processed,
             "errors": errors,
-            "total_found": len(result)
+            "total_found": len(result),
+            "http_pool": http_pool_delta(pool_before, http_pool_stats())
         }
         
     except Exception as e:
@@ -91,11 +97,7 @@ def trigger_single_analysis(dni, transcription_text):
             "transcription": transcription_text
         }
         
-        response = requests.post(
-            ANALYSIS_URL,
-            json=payload,
-            timeout=120  # 2 minutos timeout
-        )
+        response = post_json(ANALYSIS_URL, payload, read_timeout=120)  # 2 minutos timeout
         
         if response.status_code == 200:
             result = response.json()
@@ -3,256 +3,1901 @@ Cloud Function - Procesador Batch Diario
 Ejecuta una vez al día para procesar llamadas nuevas desde el CSV
 """
 import functions_framework
+import hashlib
+import numpy as np
 import pandas as pd
 import requests
 import logging
+import os
+import random
+import re
+import threading
 import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from google.cloud import bigquery, storage
-from datetime import datetime
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from io import BytesIO
 import json
+from registro_csv import CSV_COLUMNS, iter_csv_batches, parse_call_dates
+from clients import HTTP_CONNECT_TIMEOUT, get_client, get_http_session, http_pool_delta, http_pool_stats, post_json
+from pipeline_metrics import PipelineMetrics, write_pipeline_metrics
+from circuit_breaker import get_circuit_breaker
 
 PROJECT_ID = "peak-emitter-350713"
 DATASET_ID = "Calidad_Llamadas"
+METRICS_TABLE = f"{PROJECT_ID}.{DATASET_ID}.metricas_pipeline"
 CSV_PATH = "gs://buckets_llamadas/0000000000000000/registro_llamadas.csv"
+CSV_BUCKET = "buckets_llamadas"
+AUDIO_BUCKET = "buckets_llamadas"
+CSV_BLOB_PATH = "0000000000000000/registro_llamadas.csv"
+
+# Checkpoint de ingesta incremental (generación GCS, offset en bytes, filas)
+CHECKPOINT_BUCKET = "maqui-pipeline-transcripciones"
+CHECKPOINT_PATH = "batch-processor/registro_llamadas_checkpoint.json"
+CHECKPOINT_FINGERPRINT_BYTES = 64 * 1024
+
+# Cálculo de pendientes: 'bigquery' (anti-join en el servidor), 'manifest' (manifiesto GCS)
+# o 'python' (set en memoria)
+PENDING_MODE = os.environ.get('BATCH_PENDING_MODE', 'bigquery')
+STAGING_TABLE_PREFIX = "staging_registro_llamadas"
+STAGING_TABLE_EXPIRATION_HOURS = 24
+STAGING_LOAD_ROWS = int(os.environ.get('BATCH_STAGING_LOAD_ROWS', 500000))  # filas en memoria por load job
+
+# Presupuesto de tiempo por invocación y continuaciones
+TIME_BUDGET_SECONDS = float(os.environ.get('BATCH_TIME_BUDGET_SECONDS', 480))
+DRAIN_MARGIN_SECONDS = float(os.environ.get('BATCH_DRAIN_MARGIN_SECONDS', 120))
+MIN_ATTEMPT_SECONDS = 30.0  # no se inicia un intento con menos tiempo restante en la ejecución
+CURSOR_PREFIX = "batch-processor/cursors/"
+SELF_URL = os.environ.get('BATCH_SELF_URL', '')  # URL pública de esta misma función
+AUTO_CONTINUE = os.environ.get('BATCH_AUTO_CONTINUE', 'false').lower() == 'true'
+
+# Fan-out por shards: cola de Cloud Tasks para los workers (vacía = cola local en proceso)
+SHARD_COUNT = int(os.environ.get('BATCH_SHARD_COUNT', 4))
+TASK_QUEUE = os.environ.get('BATCH_TASK_QUEUE', '')  # projects/<p>/locations/<l>/queues/<q>
+TASKS_SERVICE_ACCOUNT = os.environ.get('BATCH_TASKS_SERVICE_ACCOUNT', '')  # cuenta con roles/cloudfunctions.invoker
+RUNS_PREFIX = "batch-processor/runs/"
+
+# Programación en dos carriles: llamadas recientes (fresh) y backlog histórico (backfill)
+FRESH_WINDOW_HOURS = float(os.environ.get('BATCH_FRESH_WINDOW_HOURS', 48))
+BACKFILL_SHARE = float(os.environ.get('BATCH_BACKFILL_SHARE', 0.3))
+
+# Dedup por contenido (md5/crc32c de GCS) antes de transcribir
+DEDUP_ENABLED = os.environ.get('BATCH_DEDUP', 'true').lower() == 'true'
+DEDUP_LIST_WORKERS = 8
+DEDUP_BACKFILL_ROWS = int(os.environ.get('BATCH_DEDUP_BACKFILL_ROWS', 20000))  # transcripciones antiguas sin hash por ejecución
+
+# Manifiesto compacto de audios procesados (hashes de 64 bits ordenados + filtro Bloom)
+MANIFEST_BUCKET = "maqui-pipeline-transcripciones"
+MANIFEST_PATH = "manifest/processed_audio_urls.npz"
+MANIFEST_DELTA_PREFIX = "manifest/deltas/"
+FAILED_TRANSCRIPTION_PREFIX = "manifest/failed/"  # fallas del callback de Deepgram (las escribe transcribe-audio)
+MANIFEST_BLOOM_BITS_PER_KEY = 10  # ~1% de falsos positivos con 7 funciones hash
+MANIFEST_BLOOM_HASHES = 7
 
 # URLs de las Cloud Functions existentes
 TRANSCRIPTION_URL = "https://us-central1-peak-emitter-350713.cloudfunctions.net/transcribe-audio"
 ANALYSIS_URL = "https://us-central1-peak-emitter-350713.cloudfunctions.net/analyze-quality"
 
+# Límites del despachador (sobrescribibles por variable de entorno o en el payload)
+MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+CALLS_PER_MINUTE = float(os.environ.get('BATCH_CALLS_PER_MINUTE', 60))
+
+# Pool de la sesión HTTP compartida: una conexión por llamada en vuelo
+DISPATCH_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', max(MAX_CONCURRENCY, 16)))
+
+# Política de reintentos hacia transcribe-audio
+RETRY_MAX_ATTEMPTS = int(os.environ.get('BATCH_RETRY_MAX_ATTEMPTS', 3))
+RETRY_BASE_DELAY_SECONDS = 2.0
+RETRY_MAX_DELAY_SECONDS = 60.0
+RETRY_BUDGET_RATIO = float(os.environ.get('BATCH_RETRY_BUDGET_RATIO', 0.1))  # máx. 10% de llamadas extra
+RETRY_MIN_BUDGET = 3
+
+# Planificador (dry run): tarifas y supuestos para estimar costo y duración
+DEEPGRAM_COST_PER_MINUTE = 0.005
+OPENAI_PROMPT_COST_PER_1K = 0.005
+OPENAI_COMPLETION_COST_PER_1K = 0.015
+PLANNER_SAMPLE_SIZE = 50
+PLANNER_PROBE_WORKERS = 8
+PLANNER_HEADER_BYTES = 4096
+PLANNER_HISTORY_DAYS = 30
+PLANNER_DEFAULT_CALL_SECONDS = 180.0
+PLANNER_DEFAULT_ANALYSIS_SECONDS = 20.0
+PLANNER_CALL_OVERHEAD_SECONDS = 5.0
+PLANNER_TRANSCRIPTION_SECONDS_PER_AUDIO_MINUTE = 3.0
+PLANNER_PROMPT_BASE_TOKENS = 1500
+PLANNER_TOKENS_PER_AUDIO_MINUTE = 200
+PLANNER_COMPLETION_TOKENS = 500
+
+# Control adaptativo (AIMD) de la ventana de concurrencia
+AIMD_INITIAL_WINDOW = int(os.environ.get('BATCH_AIMD_INITIAL_WINDOW', 2))
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_LATENCY_RISE_FACTOR = 1.5  # p95 actual vs p95 base que se considera congestión
+AIMD_LATENCY_SAMPLES = 50
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def get_bigquery_client():
+    """Cliente BigQuery compartido"""
+    return get_client('bigquery', lambda: bigquery.Client(project=PROJECT_ID))
+
+def get_storage_client():
+    """Cliente Cloud Storage compartido"""
+    return get_client('storage', lambda: storage.Client(project=PROJECT_ID))
+
 @functions_framework.http
 def process_daily_batch(request):
     """
     Función principal que se ejecuta diariamente
-    Lee el CSV y procesa llamadas no transcritas
+    Lee el CSV y procesa llamadas no transcritas dentro de un presupuesto de tiempo.
+    Si el presupuesto se agota, guarda un cursor y retorna un continuation_token;
+    enviando {"continuation_token": ...} se retoma donde quedó.
+    Con {"dry_run": true} solo estima minutos, costo y duración de las pendientes
     """
     try:
+        started = time.monotonic()
         logger.info("🔄 Iniciando procesamiento batch diario...")
-        
-        # 1. Leer el CSV desde Cloud Storage
-        df_calls = read_csv_from_storage()
-        if df_calls is None or df_calls.empty:
-            return {"error": "No se pudo leer el CSV o está vacío"}, 400
-            
-        logger.info(f"📋 CSV leído: {len(df_calls)} llamadas totales")
-        
-        # 2. Obtener llamadas ya procesadas desde BigQuery
-        processed_calls = get_processed_calls()
-        logger.info(f"✅ Llamadas ya procesadas: {len(processed_calls)}")
-        
-        # 3. Encontrar llamadas pendientes
-        pending_calls = find_pending_calls(df_calls, processed_calls)
-        logger.info(f"⏳ Llamadas pendientes: {len(pending_calls)}")
-        
-        if len(pending_calls) == 0:
+
+        # Parámetros opcionales del despachador
+        request_json = request.get_json(silent=True) if request else None
+        options = request_json or {}
+
+        # Modo coordinador: repartir el backlog en shards para workers paralelos
+        if options.get('mode') == 'coordinator':
+            return coordinate_shards(options, started)
+        if options.get('mode') == 'coordinator_status':
+            return get_coordinator_status(options.get('run_id'))
+
+        max_concurrency = int(options.get('max_concurrency', MAX_CONCURRENCY))
+        calls_per_minute = float(options.get('calls_per_minute', CALLS_PER_MINUTE))
+        time_budget = float(options.get('time_budget_seconds', TIME_BUDGET_SECONDS))
+        auto_continue = bool(options.get('auto_continue', AUTO_CONTINUE))
+        continuation_token = options.get('continuation_token')
+        fresh_window_hours = float(options.get('fresh_window_hours', FRESH_WINDOW_HOURS))
+        backfill_share = float(options.get('backfill_share', BACKFILL_SHARE))
+
+        # Dejar margen para que las llamadas en vuelo terminen antes del timeout de la función
+        dispatch_window = time_budget - DRAIN_MARGIN_SECONDS if time_budget > DRAIN_MARGIN_SECONDS else time_budget / 2
+        deadline = started + dispatch_window
+        # Límite para las llamadas en vuelo: ningún intento (timeout de lectura incluido) lo excede
+        call_deadline = started + time_budget
+
+        # Dry run: estimar sobre el CSV completo sin despachar ni escribir nada
+        if options.get('dry_run'):
+            collected = collect_pending_calls(options)
+            if 'error' in collected:
+                return {"error": collected['error']}, collected['status']
+            pending_calls = collected['pending']
+            lanes = schedule_lanes(pending_calls, fresh_window_hours, backfill_share)['lane'].value_counts()
+            plan = plan_batch(pending_calls, max_concurrency, calls_per_minute, dispatch_window,
+                              int(options.get('sample_size', PLANNER_SAMPLE_SIZE)))
             return {
                 "success": True,
-                "message": "No hay llamadas nuevas para procesar",
-                "total_calls": len(df_calls),
-                "processed_calls": len(processed_calls),
-                "pending_calls": 0
+                "dry_run": True,
+                **collected['summary'],
+                "pending_calls": len(pending_calls),
+                "lanes": {lane: int(lanes.get(lane, 0)) for lane in ('fresh', 'backfill')},
+                **plan
             }
+
+        if continuation_token:
+            # Retomar desde el cursor de una ejecución anterior
+            pending_calls = claim_cursor(continuation_token)
+            if pending_calls is None:
+                return {"error": f"Continuation token inválido o ya consumido: {continuation_token}"}, 404
+            logger.info(f"⏯️ Retomando {len(pending_calls)} llamadas desde {continuation_token}")
+            scan = None
+            summary = {"resumed_from": continuation_token}
+        else:
+            collected = collect_pending_calls(options)
+            if 'error' in collected:
+                return {"error": collected['error']}, collected['status']
+            scan = collected['scan']
+            pending_calls = collected['pending']
+            deferred = collected['deferred']
+            summary = collected['summary']
+
+            if len(pending_calls) == 0:
+                # Con carry_over leído se guarda igual, para descartar las que ya se procesaron
+                if scan['mode'] != 'unchanged' or scan['new_calls']:
+                    save_checkpoint(scan['checkpoint'], deferred)
+                delete_failed_transcriptions(collected.get('failed_markers'))
+                message = "El CSV no cambió desde la última ejecución" if scan['mode'] == 'unchanged' else "No hay llamadas nuevas para procesar"
+                return {"success": True, "message": message, **summary, "pending_calls": 0}
         
-        # 4. Procesar todas las llamadas pendientes en grupos de 500
-        batch_size = 500
-        total_pending = len(pending_calls)
-        calls_to_process = pending_calls  # REACTIVADO: Procesar todas las llamadas
+        # 4. Ordenar en carriles fresh/backfill y procesar con concurrencia acotada hasta agotar el presupuesto
+        calls_to_process = schedule_lanes(pending_calls, fresh_window_hours, backfill_share)
         
-        results = process_pending_calls(calls_to_process)
+        metrics = PipelineMetrics('batch-processor')
+        results = process_pending_calls(calls_to_process, max_concurrency, calls_per_minute, deadline, metrics, call_deadline)
+        run_id = batch_run_id(options, continuation_token, scan)
+        metrics_recorded = write_pipeline_metrics(get_bigquery_client, METRICS_TABLE, metrics, run_id) is not None
+
+        # Las fallidas se arrastran a la próxima ejecución diaria; las no despachadas van al cursor
+        # y también al carry_over, así no dependen de que alguien consuma el continuation_token
+        # (la próxima lectura descarta las que una continuación ya procesó)
+        remaining = calls_to_process.iloc[results['dispatched']:]
+        failed = calls_to_process[calls_to_process['gsutil_url'].isin(results['failed_urls'])]
+        carry_over = pd.concat([failed, remaining], ignore_index=True)
+        if scan:
+            # Los duplicados por contenido diferidos también pasan a la próxima ejecución
+            carry_over = pd.concat([carry_over, deferred], ignore_index=True)
+            save_checkpoint(scan['checkpoint'], carry_over)
+            delete_failed_transcriptions(collected.get('failed_markers'))
+        else:
+            append_carry_over(carry_over)
+
+        next_token = save_cursor(remaining) if not remaining.empty else None
+        lanes = summarize_lanes(calls_to_process, results)
+        continuation_enqueued = bool(next_token and auto_continue and enqueue_continuation(next_token, options))
         
-        return {
+        response = {
             "success": True,
             "message": f"Procesamiento completado: {results['processed']}/{len(calls_to_process)}",
-            "total_calls": len(df_calls),
-            "processed_calls": len(processed_calls),
+            **summary,
+            "carried_over": len(carry_over),
             "pending_calls": len(pending_calls),
             "processed_today": results['processed'],
             "errors_today": results['errors'],
-            "remaining_pending": 0  # Procesamos todas las llamadas
+            "remaining_pending": len(remaining),
+            "lanes": lanes,
+            "continuation_token": next_token,
+            "continuation_enqueued": continuation_enqueued,
+            "elapsed_seconds": results['elapsed_seconds'],
+            "throughput_calls_per_minute": results['throughput_calls_per_minute'],
+            "max_concurrency": results['max_concurrency'],
+            "calls_per_minute_limit": results['calls_per_minute_limit'],
+            "concurrency": results['concurrency'],
+            "http_pool": results['http_pool'],
+            "retries": results['retries'],
+            "circuit_breakers": results['circuit_breakers'],
+            "metrics": metrics.to_row(),
+            "metrics_recorded": metrics_recorded
         }
+
+        # Worker de un shard: dejar el resultado para el resumen del coordinador
+        if options.get('run_id'):
+            record_shard_result(options['run_id'], options.get('shard'), continuation_token, response)
+
+        return response
         
     except Exception as e:
         logger.error(f"❌ Error en procesamiento batch: {str(e)}")
         return {"error": str(e)}, 500
 
-def read_csv_from_storage():
-    """Leer el CSV desde Google Cloud Storage"""
+def batch_run_id(options, continuation_token, scan):
+    """
+    run_id determinístico de la ejecución para metricas_pipeline
+    Una continuación se identifica por su token y una lectura del CSV por generación y offset,
+    así un reintento de la misma ejecución reescribe su fila en vez de duplicarla
+    """
+    prefix = options.get('run_id') or 'batch'
+    if continuation_token:
+        key = continuation_token
+    else:
+        checkpoint = scan['checkpoint']
+        key = f"g{checkpoint['generation']}-o{checkpoint['byte_offset']}"
+    return f"{prefix}-{datetime.utcnow():%Y%m%d}-{key}"
+
+def collect_pending_calls(options):
+    """
+    Leer las llamadas nuevas del CSV y calcular las pendientes según pending_mode
+    Cada lote del CSV se filtra al llegar, así que solo las pendientes quedan en memoria
+    En dry run lee el CSV completo y no escribe nada (ni manifiesto, ni staging, ni dedup)
+    Retorna {"scan", "pending", "summary"} o {"error", "status"}
+    """
+    dry_run = bool(options.get('dry_run', False))
+    full_scan = dry_run or bool(options.get('full_scan', False))
+    pending_mode = options.get('pending_mode', PENDING_MODE)
+    rebuild_manifest = bool(options.get('rebuild_manifest', False))
+
+    # 1-3. Leer solo lo nuevo del CSV según el checkpoint y filtrar las ya procesadas por lote
+    checkpoint = None if full_scan else load_checkpoint()
+    failed_calls, failed_markers = load_failed_transcriptions()
+    pending_filter = make_pending_filter(pending_mode, rebuild_manifest, dry_run)
     try:
-        storage_client = storage.Client(project=PROJECT_ID)
-        bucket_name = "buckets_llamadas"
-        blob_path = "0000000000000000/registro_llamadas.csv"
-        
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_path)
-        
-        # Leer CSV directamente en pandas
-        csv_content = blob.download_as_text()
-        from io import StringIO
-        df = pd.read_csv(StringIO(csv_content))
-        
-        # Limpiar y validar datos
-        df = df.dropna(subset=['gsutil_url', 'N_Doc'])
-        df['N_Doc'] = df['N_Doc'].astype(str)
-        
-        return df
-        
+        if not failed_calls.empty:
+            # Las transcripciones que fallaron en modo callback vuelven como pendientes
+            pending_filter.add(failed_calls)
+        scan = read_new_calls(checkpoint, pending_filter.add)
+        if scan is None:
+            return {"error": "No se pudo leer el CSV o está vacío", "status": 400}
+        pending_calls = pending_filter.result()
+    except Exception as e:
+        logger.error(f"❌ Error calculando llamadas pendientes: {str(e)}")
+        return {"error": f"No se pudieron calcular las llamadas pendientes: {str(e)}", "status": 500}
+    finally:
+        pending_filter.close()
+
+    logger.info(f"📋 CSV leído ({scan['mode']}): {scan['new_calls']} llamadas nuevas de {scan['checkpoint']['row_count']} totales")
+    logger.info(f"⏳ Llamadas pendientes: {len(pending_calls)}")
+
+    summary = {
+        "scan_mode": scan['mode'],
+        "total_calls": scan['checkpoint']['row_count'],
+        "new_calls": scan['new_calls'],
+        "pending_mode": pending_mode,
+        "failed_transcriptions": len(failed_calls)
+    }
+    if scan['mode'] == 'unchanged' and not scan['new_calls'] and failed_calls.empty:
+        return {"scan": scan, "pending": pending_calls, "deferred": pending_calls, "summary": summary, "failed_markers": []}
+
+    summary["processed_calls"] = pending_filter.processed_count(len(pending_calls))
+    deferred = pending_calls.iloc[0:0]
+    if options.get('dedup', DEDUP_ENABLED):
+        # En dry run solo se estima el ahorro, sin copiar transcripciones
+        dedup = dedup_pending_calls(pending_calls, apply=not dry_run)
+        pending_calls, deferred = dedup['pending'], dedup['deferred']
+        summary["dedup"] = dedup['summary']
+    return {"scan": scan, "pending": pending_calls, "deferred": deferred, "summary": summary, "failed_markers": failed_markers}
+
+def load_failed_transcriptions():
+    """
+    Transcripciones fallidas en modo callback registradas por transcribe-audio
+    Retorna (DataFrame de llamadas, [(objeto, generación)]); los objetos se borran con
+    delete_failed_transcriptions después de guardar el checkpoint que las arrastra
+    """
+    calls, markers = [], []
+    try:
+        storage_client = get_storage_client()
+        for blob in storage_client.list_blobs(MANIFEST_BUCKET, prefix=FAILED_TRANSCRIPTION_PREFIX):
+            record = json.loads(blob.download_as_bytes())
+            # La fecha no viaja en el callback: sin Fecha_Llamada la llamada va al carril backfill
+            calls.append({"gsutil_url": record['gsutil_url'], "N_Doc": record['N_Doc'], "Fecha_Llamada": record.get('Fecha_Llamada', '')})
+            markers.append((blob.name, blob.generation))
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron leer las transcripciones fallidas: {str(e)}")
+        return records_to_calls([]), []
+    if calls:
+        logger.info(f"🔁 {len(calls)} transcripciones fallidas en modo callback vuelven a pendientes")
+    return records_to_calls(calls), markers
+
+def delete_failed_transcriptions(markers):
+    """Borrar los registros de transcripciones fallidas ya arrastrados al checkpoint"""
+    if not markers:
+        return
+    bucket = get_storage_client().bucket(MANIFEST_BUCKET)
+    for name, generation in markers:
+        try:
+            # Con la generación leída: una falla nueva del mismo audio no se borra sin haberla arrastrado
+            bucket.blob(name).delete(if_generation_match=generation)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo borrar {name}: {str(e)}")
+
+def get_checkpoint_blob():
+    """Blob de GCS donde se guarda el checkpoint de ingesta"""
+    storage_client = get_storage_client()
+    return storage_client.bucket(CHECKPOINT_BUCKET).blob(CHECKPOINT_PATH)
+
+def load_checkpoint():
+    """Cargar el checkpoint de la última ejecución (None si no existe o es ilegible)"""
+    try:
+        blob = get_checkpoint_blob()
+        if not blob.exists():
+            return None
+        return json.loads(blob.download_as_text())
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo leer el checkpoint, se hará lectura completa: {str(e)}")
+        return None
+
+def save_checkpoint(checkpoint, carry_over):
+    """Persistir el checkpoint junto con las llamadas pendientes que fallaron en esta ejecución"""
+    try:
+        checkpoint = dict(checkpoint)
+        checkpoint['carry_over'] = calls_to_records(carry_over)
+        checkpoint['updated_at'] = datetime.utcnow().isoformat()
+        get_checkpoint_blob().upload_from_string(json.dumps(checkpoint), content_type='application/json')
+        logger.info(f"💾 Checkpoint guardado: generación {checkpoint['generation']}, offset {checkpoint['byte_offset']}, {checkpoint['row_count']} filas")
+    except Exception as e:
+        logger.error(f"❌ Error guardando checkpoint: {str(e)}")
+
+def calls_to_records(calls_df):
+    """Serializar llamadas (gsutil_url, N_Doc, Fecha_Llamada) a registros JSON"""
+    return [
+        {column: (None if pd.isna(value) else str(value)) for column, value in row.items()}
+        for row in calls_df[list(CSV_COLUMNS)].to_dict('records')
+    ]
+
+def records_to_calls(records):
+    """Reconstruir el DataFrame de llamadas desde registros JSON"""
+    return pd.DataFrame(records or [], columns=list(CSV_COLUMNS)).astype(CSV_COLUMNS)
+
+def append_carry_over(carry_over, max_attempts=5):
+    """
+    Agregar llamadas fallidas al carry_over del checkpoint existente
+    Usa precondición de generación porque varios workers pueden escribir a la vez
+    """
+    if carry_over.empty:
+        return
+    blob = get_checkpoint_blob()
+    for attempt in range(max_attempts):
+        try:
+            blob.reload()
+            checkpoint = json.loads(blob.download_as_text(if_generation_match=blob.generation))
+        except Exception:
+            logger.warning(f"⚠️ Sin checkpoint: {len(carry_over)} llamadas fallidas quedan para la próxima lectura completa")
+            return
+        previous = records_to_calls(checkpoint.get('carry_over'))
+        merged = pd.concat([previous, carry_over[list(CSV_COLUMNS)]], ignore_index=True).drop_duplicates(subset=['gsutil_url'])
+        checkpoint['carry_over'] = calls_to_records(merged)
+        checkpoint['updated_at'] = datetime.utcnow().isoformat()
+        try:
+            blob.upload_from_string(json.dumps(checkpoint), content_type='application/json', if_generation_match=blob.generation)
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ Checkpoint modificado en paralelo (intento {attempt + 1}): {str(e)}")
+            time.sleep(random.uniform(0.1, 0.5))
+    logger.error(f"❌ No se pudo agregar {len(carry_over)} llamadas al carry_over")
+
+def save_cursor(remaining):
+    """Guardar las llamadas no despachadas y retornar el continuation_token"""
+    token = uuid.uuid4().hex
+    blob = get_checkpoint_blob().bucket.blob(f"{CURSOR_PREFIX}{token}.json")
+    blob.upload_from_string(json.dumps({
+        "created_at": datetime.utcnow().isoformat(),
+        "calls": calls_to_records(remaining)
+    }), content_type='application/json')
+    logger.info(f"🔖 Cursor guardado: {len(remaining)} llamadas pendientes (token {token})")
+    return token
+
+def claim_cursor(token):
+    """
+    Tomar un cursor y eliminarlo de forma atómica (precondición de generación)
+    Si dos invocaciones reciben el mismo token, solo una lo consume; retorna None si no existe
+    """
+    if not re.fullmatch(r'[0-9a-f]{32}', str(token)):
+        return None
+    bucket = get_checkpoint_blob().bucket
+    blob = bucket.get_blob(f"{CURSOR_PREFIX}{token}.json")
+    if blob is None:
+        return None
+    cursor = json.loads(blob.download_as_text())
+    try:
+        blob.delete(if_generation_match=blob.generation)
+    except Exception as e:
+        logger.warning(f"⚠️ Cursor {token} ya fue tomado por otra ejecución: {str(e)}")
+        return None
+    return records_to_calls(cursor.get('calls'))
+
+def enqueue_continuation(token, options):
+    """Re-invocar esta función con el continuation_token (dispara y no espera la respuesta)"""
+    if not SELF_URL:
+        logger.warning("⚠️ BATCH_SELF_URL no configurada: no se puede re-encolar la continuación")
+        return False
+    payload = {key: value for key, value in options.items() if key not in ('continuation_token', 'full_scan', 'rebuild_manifest')}
+    payload['continuation_token'] = token
+    try:
+        requests.post(SELF_URL, json=payload, timeout=(10, 1))
+    except requests.exceptions.ReadTimeout:
+        pass  # La continuación ya quedó en curso
+    except Exception as e:
+        logger.error(f"❌ No se pudo re-encolar la continuación {token}: {str(e)}")
+        return False
+    logger.info(f"📨 Continuación re-encolada: {token}")
+    return True
+
+def assign_shards(calls_df, shard_count, shard_by='hash'):
+    """
+    Asignar cada llamada a un shard
+    - hash: hash estable de gsutil_url módulo shard_count
+    - date: rangos contiguos de Fecha_Llamada con cantidades similares
+    """
+    if shard_by == 'date':
+        ranks = parse_call_dates(calls_df['Fecha_Llamada']).rank(method='first', na_option='bottom').to_numpy()
+        return ((ranks - 1) * shard_count // max(len(calls_df), 1)).astype(int)
+    hashes = np.fromiter((audio_url_hash(str(url)) for url in calls_df['gsutil_url']), dtype=np.uint64, count=len(calls_df))
+    return (hashes % np.uint64(shard_count)).astype(int)
+
+class LocalTaskQueue:
+    """
+    Cola en proceso: ejecuta cada worker en un hilo (pruebas y entornos sin Cloud Tasks)
+    Los workers corren dentro de la ejecución del coordinador, así que comparten su deadline
+    """
+
+    def __init__(self, max_workers=SHARD_COUNT, deadline=None):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self.futures = []
+        self.deadline = deadline
+
+    def time_left(self):
+        return float('inf') if self.deadline is None else self.deadline - time.monotonic()
+
+    def accepts_work(self):
+        """False cuando ya no queda tiempo para que un shard nuevo haga un intento"""
+        return self.time_left() >= MIN_ATTEMPT_SECONDS
+
+    def enqueue(self, payload):
+        self.futures.append(self.executor.submit(self._run, payload))
+
+    def _run(self, payload):
+        time_left = self.time_left()
+        if time_left < MIN_ATTEMPT_SECONDS:
+            # El cursor queda sin consumir y sus llamadas siguen en el carry_over
+            logger.warning(f"⏰ Shard {payload.get('shard')} sin tiempo para ejecutarse, queda para la próxima ejecución")
+            return None
+        if self.deadline is not None:
+            budget = float(payload.get('time_budget_seconds', TIME_BUDGET_SECONDS))
+            payload = {**payload, "time_budget_seconds": min(budget, time_left)}
+        return process_daily_batch(LocalRequest(payload))
+
+    def drain(self):
+        """Esperar a que terminen todos los workers encolados"""
+        self.executor.shutdown(wait=True)
+        return [future.result() for future in self.futures]
+
+class LocalRequest:
+    """Request mínimo compatible con functions_framework para invocaciones en proceso"""
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def get_json(self, silent=False):
+        return self.payload
+
+class CloudTasksQueue:
+    """Cola de Cloud Tasks que invoca esta misma función por HTTP para cada shard"""
+
+    def __init__(self, queue_path=TASK_QUEUE, target_url=SELF_URL, service_account=TASKS_SERVICE_ACCOUNT):
+        if not service_account:
+            raise ValueError("BATCH_TASKS_SERVICE_ACCOUNT es obligatoria para invocar la función desde Cloud Tasks")
+        from google.cloud import tasks_v2
+        self.tasks_v2 = tasks_v2
+        self.client = get_client('cloudtasks', tasks_v2.CloudTasksClient)
+        self.queue_path = queue_path
+        self.target_url = target_url
+        self.service_account = service_account
+
+    def enqueue(self, payload):
+        task = {
+            "http_request": {
+                "http_method": self.tasks_v2.HttpMethod.POST,
+                "url": self.target_url,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps(payload).encode(),
+                # Token OIDC firmado para la cuenta invocadora: la función no acepta llamadas anónimas
+                "oidc_token": {
+                    "service_account_email": self.service_account,
+                    "audience": self.target_url
+                }
+            }
+        }
+        self.client.create_task(request={"parent": self.queue_path, "task": task})
+
+    def accepts_work(self):
+        return True  # Cada worker tiene su propia ejecución y su propio time budget
+
+    def drain(self):
+        return None  # Los workers corren en otras instancias; ver coordinator_status
+
+def coordinate_shards(options, started=None):
+    """
+    Modo coordinador: calcular pendientes, repartirlas en N shards y encolar un worker por shard
+    Cada shard se guarda como cursor y el worker lo consume con su continuation_token
+    Con la cola local los shards corren dentro de esta ejecución y no se encolan más
+    cuando el tiempo restante baja de MIN_ATTEMPT_SECONDS
+    """
+    started = time.monotonic() if started is None else started
+    deadline = started + float(options.get('time_budget_seconds', TIME_BUDGET_SECONDS))
+    shard_count = max(1, int(options.get('shards', SHARD_COUNT)))
+    shard_by = options.get('shard_by', 'hash')
+    use_local = options.get('task_queue', 'cloudtasks' if TASK_QUEUE and SELF_URL and TASKS_SERVICE_ACCOUNT else 'local') == 'local'
+
+    collected = collect_pending_calls(options)
+    if 'error' in collected:
+        return {"error": collected['error']}, collected['status']
+    scan = collected['scan']
+    pending_calls = collected['pending']
+    if scan['mode'] != 'unchanged' or scan['new_calls'] or len(pending_calls):
+        # Todas las llamadas repartidas quedan también en el carry_over: si un worker no
+        # termina su shard (o nadie consume su continuación) la próxima lectura las retoma
+        carry_over = pd.concat([pending_calls, collected['deferred']], ignore_index=True)
+        save_checkpoint(scan['checkpoint'], carry_over)
+    delete_failed_transcriptions(collected.get('failed_markers'))
+
+    run_id = uuid.uuid4().hex
+    queue = LocalTaskQueue(shard_count, deadline) if use_local else CloudTasksQueue()
+    worker_options = {key: value for key, value in options.items()
+                      if key in ('max_concurrency', 'calls_per_minute', 'time_budget_seconds', 'auto_continue')}
+
+    shards = []
+    if len(pending_calls):
+        assignment = assign_shards(pending_calls, shard_count, shard_by)
+        for shard in range(shard_count):
+            shard_calls = pending_calls[assignment == shard]
+            if shard_calls.empty:
+                continue
+            if not queue.accepts_work():
+                logger.warning(f"⏰ Sin tiempo para más shards: desde el {shard} quedan en el carry_over")
+                break
+            token = save_cursor(shard_calls)
+            queue.enqueue({**worker_options, "continuation_token": token, "run_id": run_id, "shard": shard})
+            shards.append({"shard": shard, "calls": len(shard_calls), "continuation_token": token})
+
+    logger.info(f"🧩 Coordinador {run_id}: {len(pending_calls)} llamadas en {len(shards)} shards ({shard_by}, cola {'local' if use_local else 'Cloud Tasks'})")
+
+    queue.drain()
+    status = get_coordinator_status(run_id) if use_local else {"run_id": run_id, "shards_completed": 0}
+    return {
+        "success": True,
+        "message": f"{len(shards)} shards encolados",
+        **collected['summary'],
+        "pending_calls": len(pending_calls),
+        "run_id": run_id,
+        "shard_by": shard_by,
+        "task_queue": 'local' if use_local else 'cloudtasks',
+        "shards": shards,
+        "summary": status
+    }
+
+def record_shard_result(run_id, shard, token, response):
+    """Guardar el resultado de una invocación de worker para el resumen del coordinador"""
+    try:
+        if not re.fullmatch(r'[0-9a-f]{32}', str(run_id)):
+            return
+        blob = get_checkpoint_blob().bucket.blob(f"{RUNS_PREFIX}{run_id}/shard-{shard}-{token}.json")
+        blob.upload_from_string(json.dumps({"shard": shard, **response}), content_type='application/json')
     except Exception as e:
-        logger.error(f"Error leyendo CSV: {str(e)}")
+        logger.error(f"❌ Error guardando resultado del shard {shard}: {str(e)}")
+
+def get_coordinator_status(run_id):
+    """Agregar los resultados de todos los shards (y sus continuaciones) de una ejecución"""
+    if not re.fullmatch(r'[0-9a-f]{32}', str(run_id)):
+        return {"error": f"run_id inválido: {run_id}"}, 400
+
+    storage_client = get_storage_client()
+    per_shard = {}
+    for blob in storage_client.list_blobs(CHECKPOINT_BUCKET, prefix=f"{RUNS_PREFIX}{run_id}/"):
+        result = json.loads(blob.download_as_text())
+        shard = per_shard.setdefault(result.get('shard'), {
+            "shard": result.get('shard'), "invocations": 0, "processed": 0, "errors": 0,
+            "remaining_pending": 0, "elapsed_seconds": 0.0
+        })
+        shard['invocations'] += 1
+        shard['processed'] += result.get('processed_today', 0)
+        shard['errors'] += result.get('errors_today', 0)
+        shard['elapsed_seconds'] += result.get('elapsed_seconds', 0.0)
+        if not result.get('continuation_token'):
+            shard['remaining_pending'] = 0
+            shard['done'] = True
+        elif not shard.get('done'):
+            # Los objetos no vienen en orden cronológico: un shard terminado no vuelve a tener pendientes
+            shard['remaining_pending'] = max(shard['remaining_pending'], result.get('remaining_pending', 0))
+            shard['done'] = False
+
+    shards = sorted(per_shard.values(), key=lambda item: item['shard'])
+    return {
+        "run_id": run_id,
+        "shards_reported": len(shards),
+        "shards_completed": sum(1 for shard in shards if shard.get('done')),
+        "processed": sum(shard['processed'] for shard in shards),
+        "errors": sum(shard['errors'] for shard in shards),
+        "shards": shards
+    }
+
+def fingerprint_range(blob, end_offset):
+    """Hash de los últimos bytes antes de end_offset para verificar que el prefijo no cambió"""
+    start = max(0, end_offset - CHECKPOINT_FINGERPRINT_BYTES)
+    if end_offset <= 0:
         return None
+    data = blob.download_as_bytes(start=start, end=end_offset - 1)
+    return hashlib.sha256(data).hexdigest()
+
+def read_csv_header(blob):
+    """Leer la fila de cabecera del CSV con una lectura por rango"""
+    head = blob.download_as_bytes(start=0, end=CHECKPOINT_FINGERPRINT_BYTES - 1)
+    return head.split(b'\n', 1)[0].decode('utf-8').strip().lstrip('\ufeff').split(',')
+
+def read_new_calls(checkpoint, on_batch):
+    """
+    Leer del CSV solo las llamadas nuevas desde el checkpoint y entregarlas por lotes a on_batch
+    - unchanged: misma generación, no se lee nada
+    - incremental: el archivo creció y el prefijo es idéntico, se lee solo la cola
+    - full: primera ejecución o el archivo fue reescrito, se lee completo
+    Las llamadas arrastradas (carry_over) se entregan como primer lote.
+    Retorna {"mode", "new_calls", "checkpoint"} o None si el CSV no existe
+    """
+    storage_client = get_storage_client()
+    bucket = storage_client.bucket(CSV_BUCKET)
+    current = bucket.get_blob(CSV_BLOB_PATH)
+    if current is None:
+        return None
+
+    # Fijar la generación leída para que offset y contenido sean consistentes
+    blob = bucket.blob(CSV_BLOB_PATH, generation=current.generation)
+    size = current.size or 0
+    carry_over = records_to_calls((checkpoint or {}).get('carry_over'))
+
+    if checkpoint and checkpoint.get('generation') == current.generation:
+        if not carry_over.empty:
+            on_batch(carry_over)
+        return {"mode": "unchanged", "new_calls": len(carry_over), "checkpoint": checkpoint}
+
+    mode = "full"
+    start_offset = 0
+    row_count = 0
+    columns = None
+    if checkpoint and checkpoint.get('ends_with_newline') and size >= checkpoint.get('byte_offset', 0) > 0:
+        if fingerprint_range(blob, checkpoint['byte_offset']) == checkpoint.get('fingerprint'):
+            mode = "incremental"
+            start_offset = checkpoint['byte_offset']
+            row_count = checkpoint.get('row_count', 0)
+            columns = checkpoint.get('columns')
+    if mode == "full":
+        # Archivo reescrito: las llamadas arrastradas se vuelven a encontrar en la lectura completa
+        carry_over = carry_over.iloc[0:0]
+        columns = read_csv_header(blob)
+
+    new_calls = len(carry_over)
+    if new_calls:
+        on_batch(carry_over)
+    stats = {"rows": 0}
+    if size > start_offset:
+        for batch in iter_csv_batches(blob, start_offset=start_offset, columns=columns, stats=stats):
+            new_calls += len(batch)
+            on_batch(batch)
+
+    last_byte = blob.download_as_bytes(start=size - 1, end=size - 1) if size else b''
+    new_checkpoint = {
+        "generation": current.generation,
+        "byte_offset": size,
+        "row_count": row_count + stats['rows'],
+        "columns": columns,
+        "fingerprint": fingerprint_range(blob, size),
+        "ends_with_newline": last_byte == b'\n'
+    }
+    logger.info(f"🧭 Lectura {mode}: desde byte {start_offset} hasta {size} (generación {current.generation})")
+    return {"mode": mode, "new_calls": new_calls, "checkpoint": new_checkpoint}
 
 def get_processed_calls():
-    """Obtener URLs de audios ya procesados desde BigQuery"""
+    """
+    Obtener URLs de audios ya procesados desde BigQuery
+    Los errores se propagan: un set vacío marcaría todo el CSV como pendiente
+    """
+    client = get_bigquery_client()
+
+    query = f"""
+    SELECT DISTINCT audio_url
+    FROM `{PROJECT_ID}.{DATASET_ID}.transcripciones`
+    WHERE estado = 'procesado'
+    """
+
+    result = client.query(query).to_dataframe()
+    return set(result['audio_url'].tolist()) if not result.empty else set()
+
+def audio_url_hash(audio_url):
+    """Hash estable de 64 bits de un audio_url (mismo cálculo en transcription-function)"""
+    return int.from_bytes(hashlib.blake2b(audio_url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class ProcessedManifest:
+    """
+    Manifiesto de audios procesados guardado en GCS
+    Arreglo ordenado de hashes uint64 de audio_url con un filtro Bloom delante.
+    transcribe_audio registra cada éxito como un objeto delta vacío cuyo nombre es el hash;
+    load() compacta esos deltas en el archivo base
+    """
+
+    def __init__(self, hashes):
+        self.hashes = np.unique(np.asarray(hashes, dtype=np.uint64))
+        self.num_bits = max(1024, len(self.hashes) * MANIFEST_BLOOM_BITS_PER_KEY)
+        self.bloom = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        positions = self._bloom_positions(self.hashes)
+        np.bitwise_or.at(self.bloom, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _bloom_positions(self, hashes):
+        # Doble hashing: h1 + i*h2 sobre las dos mitades del hash de 64 bits
+        h1 = (hashes & np.uint64(0xFFFFFFFF)).astype(np.uint64)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        rounds = np.arange(MANIFEST_BLOOM_HASHES, dtype=np.uint64)[:, None]
+        return ((h1 + rounds * h2) % np.uint64(self.num_bits)).astype(np.int64).ravel()
+
+    def contains(self, audio_urls):
+        """
+        Máscara booleana: True si el audio_url ya fue procesado
+        El hash de cada URL se calcula en Python; Bloom y búsqueda binaria van en bloque con numpy
+        """
+        hashes = np.fromiter((audio_url_hash(str(url)) for url in audio_urls), dtype=np.uint64, count=len(audio_urls))
+        if len(hashes) == 0 or len(self.hashes) == 0:
+            return np.zeros(len(hashes), dtype=bool)
+
+        # Filtro Bloom: descarta en bloque los que seguro no están
+        positions = self._bloom_positions(hashes).reshape(MANIFEST_BLOOM_HASHES, len(hashes))
+        bits = (self.bloom[positions >> 3] >> (positions & 7)) & 1
+        maybe = bits.all(axis=0)
+
+        # Confirmar candidatos con búsqueda binaria en el arreglo ordenado
+        result = np.zeros(len(hashes), dtype=bool)
+        candidates = hashes[maybe]
+        idx = np.searchsorted(self.hashes, candidates)
+        idx[idx >= len(self.hashes)] = 0
+        result[maybe] = self.hashes[idx] == candidates
+        return result
+
+    def to_bytes(self):
+        buffer = BytesIO()
+        np.savez_compressed(buffer, hashes=self.hashes)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bigquery(cls):
+        """
+        Construir el manifiesto desde transcripciones (carga inicial o reconstrucción)
+        Si la consulta falla se propaga el error y load() no guarda ninguna base
+        """
+        hashes = [audio_url_hash(url) for url in get_processed_calls()]
+        logger.info(f"🧱 Manifiesto reconstruido desde BigQuery: {len(hashes)} audios")
+        return cls(hashes)
+
+    @classmethod
+    def load(cls, rebuild=False, compact=True):
+        """Cargar el manifiesto desde GCS y compactar los deltas pendientes (compact=False solo lee)"""
+        storage_client = get_storage_client()
+        bucket = storage_client.bucket(MANIFEST_BUCKET)
+        base_blob = bucket.get_blob(MANIFEST_PATH)
+
+        # Listar deltas antes de leer/reconstruir la base para no perder éxitos concurrentes
+        deltas = list(storage_client.list_blobs(MANIFEST_BUCKET, prefix=MANIFEST_DELTA_PREFIX))
+        delta_hashes = [int(blob.name[len(MANIFEST_DELTA_PREFIX):], 16) for blob in deltas]
+
+        if base_blob is None or rebuild:
+            base_hashes = cls.from_bigquery().hashes
+        else:
+            with np.load(BytesIO(base_blob.download_as_bytes())) as data:
+                base_hashes = data['hashes']
+
+        manifest = cls(np.concatenate([base_hashes, np.asarray(delta_hashes, dtype=np.uint64)]))
+
+        if compact and (deltas or base_blob is None or rebuild):
+            try:
+                # Precondición de generación: si otro proceso compactó antes, no se pisa su base
+                generation = base_blob.generation if base_blob is not None else 0
+                bucket.blob(MANIFEST_PATH).upload_from_string(
+                    manifest.to_bytes(),
+                    content_type='application/octet-stream',
+                    if_generation_match=generation
+                )
+                for start in range(0, len(deltas), 100):
+                    with storage_client.batch():
+                        for blob in deltas[start:start + 100]:
+                            blob.delete()
+                logger.info(f"🗜️ Manifiesto compactado: {len(manifest)} audios ({len(deltas)} deltas)")
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo compactar el manifiesto: {str(e)}")
+
+        return manifest
+
+def make_pending_filter(pending_mode, rebuild_manifest=False, read_only=False):
+    """
+    Filtro por lotes de llamadas pendientes para el pending_mode dado
+    Con read_only (dry run) no crea tablas de staging ni compacta o reconstruye el manifiesto
+    """
+    if pending_mode == 'bigquery' and not read_only:
+        # Anti-join en BigQuery: solo vuelven las filas pendientes
+        return StagingPendingFilter()
+    if pending_mode == 'manifest':
+        # Manifiesto en GCS: test de pertenencia sobre hashes, sin escanear BigQuery
+        return PendingCallsFilter(lambda: ProcessedManifest.load(rebuild=rebuild_manifest and not read_only, compact=not read_only))
+    return PendingCallsFilter(get_processed_calls)
+
+class PendingCallsFilter:
+    """
+    Anti-join por lotes contra las llamadas ya procesadas (set de URLs o ProcessedManifest)
+    Cada lote se filtra al llegar y solo se conservan las filas pendientes,
+    una por gsutil_url (la primera aparición en el CSV)
+    """
+
+    def __init__(self, load_processed):
+        self.load_processed = load_processed
+        self.processed = None
+        self.seen = set()
+        self.batches = []
+
+    def add(self, batch):
+        if self.processed is None:
+            # Se carga con el primer lote: un CSV sin cambios no consulta nada
+            self.processed = self.load_processed()
+            logger.info(f"✅ Llamadas ya procesadas: {len(self.processed)}")
+        batch = batch.drop_duplicates(subset=['gsutil_url'])
+        urls = batch['gsutil_url']
+        if isinstance(self.processed, ProcessedManifest):
+            processed_mask = self.processed.contains(urls)
+        else:
+            processed_mask = urls.isin(self.processed).to_numpy()
+        batch = batch[~processed_mask & ~urls.isin(self.seen).to_numpy()]
+        if not batch.empty:
+            self.seen.update(batch['gsutil_url'])
+            self.batches.append(batch[list(CSV_COLUMNS)])
+
+    def result(self):
+        """Llamadas pendientes, las más recientes primero"""
+        if not self.batches:
+            return records_to_calls([])
+        pending = pd.concat(self.batches, ignore_index=True)
+        return pending.sort_values('Fecha_Llamada', ascending=False)
+
+    def processed_count(self, pending_count):
+        return len(self.processed) if self.processed is not None else 0
+
+    def close(self):
+        self.batches = []
+
+class StagingPendingFilter:
+    """
+    Anti-join en BigQuery alimentado por lotes
+    Los lotes se acumulan hasta STAGING_LOAD_ROWS filas, se agregan a una tabla staging
+    con un load job y se descartan; al final una sola consulta devuelve las pendientes
+    """
+
+    def __init__(self, load_rows=STAGING_LOAD_ROWS):
+        self.load_rows = load_rows
+        self.client = None
+        self.staging_table = None
+        self.buffer = []
+        self.buffered_rows = 0
+        self.staged_rows = 0
+
+    def add(self, batch):
+        if batch.empty:
+            return
+        self.buffer.append(batch[list(CSV_COLUMNS)])
+        self.buffered_rows += len(batch)
+        if self.buffered_rows >= self.load_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.client = self.client or get_bigquery_client()
+        chunk = pd.concat(self.buffer, ignore_index=True)
+        self.buffer, self.buffered_rows = [], 0
+        self.staging_table = load_calls_to_staging(self.client, chunk, self.staging_table, self.staged_rows)
+        self.staged_rows += len(chunk)
+
+    def result(self):
+        """Llamadas pendientes calculadas en BigQuery, las más recientes primero"""
+        self.flush()
+        if self.staging_table is None:
+            return records_to_calls([])
+        query = f"""
+        SELECT s.gsutil_url, s.N_Doc, s.Fecha_Llamada
+        FROM `{self.staging_table}` s
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM `{PROJECT_ID}.{DATASET_ID}.transcripciones` t
+            WHERE t.audio_url = s.gsutil_url
+              AND t.estado = 'procesado'
+        )
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY s.gsutil_url ORDER BY s.fila) = 1
+        ORDER BY s.Fecha_Llamada DESC
+        """
+        pending = self.client.query(query).to_dataframe().astype(CSV_COLUMNS)
+        logger.info(f"🔍 Llamadas pendientes (anti-join BigQuery): {len(pending)}")
+        return pending
+
+    def processed_count(self, pending_count):
+        # Filas leídas que no quedaron pendientes (ya procesadas o repetidas en el CSV)
+        return self.staged_rows - pending_count
+
+    def close(self):
+        self.buffer = []
+        if self.staging_table is not None:
+            try:
+                self.client.delete_table(self.staging_table, not_found_ok=True)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo borrar la tabla staging {self.staging_table}: {str(e)}")
+            self.staging_table = None
+
+def load_calls_to_staging(client, df_calls, table_id=None, first_row=0):
+    """
+    Cargar llamadas leídas del CSV a una tabla staging con un load job
+    Sin table_id crea una tabla única por ejecución que expira sola; con table_id agrega filas
+    """
+    create = table_id is None
+    if create:
+        table_id = f"{PROJECT_ID}.{DATASET_ID}.{STAGING_TABLE_PREFIX}_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+
+    staging = df_calls[list(CSV_COLUMNS)].copy()
+    # Orden original para conservar la primera aparición de cada URL
+    staging['fila'] = range(first_row, first_row + len(staging))
+
+    job_config = bigquery.LoadJobConfig(
+        schema=[
+            bigquery.SchemaField("gsutil_url", "STRING"),
+            bigquery.SchemaField("N_Doc", "STRING"),
+            bigquery.SchemaField("Fecha_Llamada", "STRING"),
+            bigquery.SchemaField("fila", "INT64"),
+        ],
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE if create else bigquery.WriteDisposition.WRITE_APPEND
+    )
+    client.load_table_from_dataframe(staging, table_id, job_config=job_config).result()
+
+    if create:
+        table = client.get_table(table_id)
+        table.expires = datetime.utcnow() + timedelta(hours=STAGING_TABLE_EXPIRATION_HOURS)
+        client.update_table(table, ["expires"])
+
+    logger.info(f"📤 {len(staging)} llamadas cargadas en staging: {table_id}")
+    return table_id
+
+def object_content_key(md5_hash, crc32c, size):
+    """Clave de contenido de un objeto GCS: md5 o, en objetos compuestos sin md5, crc32c + tamaño"""
+    if md5_hash:
+        return f"md5:{md5_hash}"
+    if crc32c:
+        return f"crc32c:{crc32c}:{size}"
+    return None
+
+def list_content_keys(audio_urls):
+    """
+    Obtener la clave de contenido de cada audio con listados por prefijo (no una petición por objeto)
+    Retorna {gsutil_url: clave}
+    """
+    prefix_len = len(f"gs://{AUDIO_BUCKET}/")
+    wanted = {}
+    for url in set(audio_urls):
+        url = str(url)
+        if url.startswith(f"gs://{AUDIO_BUCKET}/"):
+            wanted[url[prefix_len:]] = url
+    prefixes = sorted({name.rsplit('/', 1)[0] + '/' if '/' in name else '' for name in wanted})
+    storage_client = get_storage_client()
+
+    def list_prefix(prefix):
+        blobs = storage_client.list_blobs(AUDIO_BUCKET, prefix=prefix, delimiter='/',
+                                          fields='items(name,md5Hash,crc32c,size),nextPageToken')
+        return [(blob.name, object_content_key(blob.md5_hash, blob.crc32c, blob.size))
+                for blob in blobs if blob.name in wanted]
+
+    keys = {}
+    with ThreadPoolExecutor(max_workers=DEDUP_LIST_WORKERS) as executor:
+        for listed in executor.map(list_prefix, prefixes):
+            keys.update((wanted[name], key) for name, key in listed if key)
+    logger.info(f"🧬 Hashes de contenido: {len(keys)}/{len(wanted)} audios en {len(prefixes)} listados")
+    return keys
+
+def load_dedup_staging(client, duplicates):
+    """
+    Cargar (gsutil_url, N_Doc, fecha_llamada, hash_contenido) de los duplicados a una tabla staging
+    fecha_llamada se calcula aquí con el mismo formato que escribe transcribe-audio
+    """
+    table_id = f"{PROJECT_ID}.{DATASET_ID}.{STAGING_TABLE_PREFIX}_dedup_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+    job_config = bigquery.LoadJobConfig(
+        schema=[
+            bigquery.SchemaField("gsutil_url", "STRING"),
+            bigquery.SchemaField("N_Doc", "STRING"),
+            bigquery.SchemaField("fecha_llamada", "TIMESTAMP"),
+            bigquery.SchemaField("hash_contenido", "STRING"),
+        ],
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+    )
+    staging = duplicates[['gsutil_url', 'N_Doc', 'hash_contenido']].assign(
+        fecha_llamada=transcription_call_dates(duplicates['gsutil_url'], duplicates['Fecha_Llamada'])
+    )
+    client.load_table_from_dataframe(staging, table_id, job_config=job_config).result()
+
+    table = client.get_table(table_id)
+    table.expires = datetime.utcnow() + timedelta(hours=STAGING_TABLE_EXPIRATION_HOURS)
+    client.update_table(table, ["expires"])
+    return table_id
+
+def transcription_call_dates(gsutil_urls, fechas):
+    """
+    fecha_llamada como la escribe transcribe-audio: la fecha DDMMYYYY al inicio de la ruta del
+    objeto, a medianoche (UTC). Sin fecha en la ruta, el día de Fecha_Llamada en CALL_TIMEZONE
+    Así las filas copiadas agrupan y cruzan por (dni, fecha) igual que las transcritas
+    """
+    paths = gsutil_urls.astype('string').str.replace(r'^gs://[^/]+/', '', regex=True)
+    from_name = pd.to_datetime(paths.str.extract(r'^(\d{8})', expand=False), format='%d%m%Y', errors='coerce')
+    from_csv = parse_call_dates(fechas).dt.tz_localize(None).dt.normalize()
+    return from_name.fillna(from_csv).dt.tz_localize('UTC')
+
+def reuse_transcriptions(client, staging_table):
+    """
+    Copiar la transcripción del audio original a cada duplicado, en una sola consulta multi-sentencia
+    El análisis solo se copia si el duplicado es del mismo DNI (con un transcripcion_id propio);
+    con otro DNI la validación cambia, así que queda pendiente y lo toma el barrido de análisis
+    """
+    # transcripcion_id del duplicado: mismo esquema que el barrido de análisis pendientes (dni-md5(audio_url)[:12])
+    originals = f"""
+        SELECT s.gsutil_url, s.N_Doc,
+               COALESCE(s.fecha_llamada, t.fecha_llamada) AS fecha_nueva,
+               CONCAT(s.N_Doc, '-', SUBSTR(TO_HEX(MD5(s.gsutil_url)), 1, 12)) AS transcripcion_id_nueva,
+               t.*
+        FROM `{staging_table}` s
+        JOIN `{PROJECT_ID}.{DATASET_ID}.transcripciones` t
+          ON t.hash_contenido = s.hash_contenido AND t.estado = 'procesado'
+        WHERE TRUE
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY s.gsutil_url ORDER BY t.created_at) = 1
+    """
+    query = f"""
+    CREATE TEMP TABLE originales AS {originals};
+
+    INSERT INTO `{PROJECT_ID}.{DATASET_ID}.transcripciones`
+      (dni, fecha_llamada, audio_url, transcripcion_texto, transcripcion_json, duracion_segundos,
+       confianza_promedio, proveedor, estado, tokens_deepgram, costo_deepgram_usd,
+       hash_contenido, reutilizada_de, created_at, updated_at)
+    SELECT N_Doc, fecha_nueva, gsutil_url, transcripcion_texto, transcripcion_json, duracion_segundos,
+           confianza_promedio, proveedor, 'procesado', 0, 0.0,
+           hash_contenido, audio_url, CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP()
+    FROM originales o
+    WHERE NOT EXISTS (
+      SELECT 1 FROM `{PROJECT_ID}.{DATASET_ID}.transcripciones` t
+      WHERE t.audio_url = o.gsutil_url AND t.estado = 'procesado'
+    );
+
+    INSERT INTO `{PROJECT_ID}.{DATASET_ID}.analisis_calidad`
+      (dni, fecha_llamada, transcripcion_id, categoria, puntuacion_total, puntuacion_identificacion,
+       puntuacion_verificacion, puntuacion_contextualizacion, puntuacion_sentimientos, conformidad,
+       comentarios, analisis_detallado, prompt_usado, modelo_openai, tokens_prompt, tokens_completion,
+       costo_openai_usd, tiempo_procesamiento_segundos, estado, created_at, updated_at)
+    SELECT o.N_Doc, o.fecha_nueva, o.transcripcion_id_nueva, a.categoria, a.puntuacion_total, a.puntuacion_identificacion,
+           a.puntuacion_verificacion, a.puntuacion_contextualizacion, a.puntuacion_sentimientos, a.conformidad,
+           a.comentarios, a.analisis_detallado, a.prompt_usado, a.modelo_openai, 0, 0,
+           0.0, 0.0, a.estado, CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP()
+    FROM originales o
+    JOIN `{PROJECT_ID}.{DATASET_ID}.analisis_calidad` a
+      ON a.dni = o.dni AND a.fecha_llamada = o.fecha_llamada AND a.estado = 'completado'
+    WHERE o.N_Doc = o.dni
+      AND NOT EXISTS (
+      SELECT 1 FROM `{PROJECT_ID}.{DATASET_ID}.analisis_calidad` x
+      WHERE x.dni = o.N_Doc AND x.fecha_llamada = o.fecha_nueva
+    )
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY o.gsutil_url ORDER BY a.created_at DESC) = 1;
+
+    SELECT o.gsutil_url, o.duracion_segundos, o.costo_deepgram_usd, o.N_Doc != o.dni AS reanalizar,
+           IF(o.N_Doc = o.dni,
+              (SELECT ANY_VALUE(a.costo_openai_usd) FROM `{PROJECT_ID}.{DATASET_ID}.analisis_calidad` a
+               WHERE a.dni = o.dni AND a.fecha_llamada = o.fecha_llamada AND a.estado = 'completado'),
+              NULL) AS costo_openai_usd
+    FROM originales o;
+    """
+    return client.query(query).to_dataframe()
+
+def backfill_content_keys(client, limit=DEDUP_BACKFILL_ROWS):
+    """
+    Completar hash_contenido en transcripciones antiguas (anteriores al dedup por contenido)
+    Sin hash el dedup nunca las encontraría como original. Se procesan hasta limit audios por
+    ejecución, así el histórico se completa de a poco sin alargar un batch. Retorna cuántos se completaron
+    """
+    if limit <= 0:
+        return 0
+    query = f"""
+    SELECT DISTINCT audio_url
+    FROM `{PROJECT_ID}.{DATASET_ID}.transcripciones`
+    WHERE estado = 'procesado' AND hash_contenido IS NULL AND reutilizada_de IS NULL
+    LIMIT {int(limit)}
+    """
+    legacy = client.query(query).to_dataframe()
+    if legacy.empty:
+        return 0
+    keys = list_content_keys(legacy['audio_url'])
+    if not keys:
+        return 0
+    urls = sorted(keys)
+    update = f"""
+    UPDATE `{PROJECT_ID}.{DATASET_ID}.transcripciones` t
+    SET hash_contenido = k.hash_contenido, updated_at = CURRENT_TIMESTAMP()
+    FROM UNNEST(ARRAY(
+      SELECT AS STRUCT url AS audio_url, @keys[OFFSET(i)] AS hash_contenido
+      FROM UNNEST(@urls) AS url WITH OFFSET i
+    )) k
+    WHERE t.audio_url = k.audio_url AND t.hash_contenido IS NULL
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter("urls", "STRING", urls),
+        bigquery.ArrayQueryParameter("keys", "STRING", [keys[url] for url in urls])
+    ])
+    client.query(update, job_config=job_config).result()
+    logger.info(f"🧬 hash_contenido completado en {len(urls)} transcripciones antiguas")
+    return len(urls)
+
+def find_reusable_transcriptions(client, content_keys):
+    """Audios ya transcritos con el mismo contenido (para el dry run, sin escribir nada)"""
+    query = f"""
+    SELECT hash_contenido, ANY_VALUE(duracion_segundos) AS duracion_segundos,
+           ANY_VALUE(costo_deepgram_usd) AS costo_deepgram_usd
+    FROM `{PROJECT_ID}.{DATASET_ID}.transcripciones`
+    WHERE estado = 'procesado' AND hash_contenido IN UNNEST(@keys)
+    GROUP BY hash_contenido
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ArrayQueryParameter("keys", "STRING", sorted(set(content_keys)))])
+    return client.query(query, job_config=job_config).to_dataframe()
+
+def record_processed_audios(audio_urls):
+    """Marcar audios reutilizados en el manifiesto con el mismo delta que escribe transcription-function"""
+    bucket = get_storage_client().bucket(MANIFEST_BUCKET)
+
+    def write_delta(audio_url):
+        try:
+            bucket.blob(f"{MANIFEST_DELTA_PREFIX}{audio_url_hash(audio_url):016x}").upload_from_string(b'')
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo registrar {audio_url} en el manifiesto: {str(e)}")
+
+    with ThreadPoolExecutor(max_workers=DEDUP_LIST_WORKERS) as executor:
+        list(executor.map(write_delta, audio_urls))
+
+def dedup_pending_calls(pending_calls, apply=True):
+    """
+    Detectar grabaciones byte a byte idénticas por md5/crc32c de GCS
+    - Duplicados de audios ya transcritos: se reutiliza la transcripción (apply=False solo estima)
+    - Duplicados dentro de las pendientes: se despacha el primero y el resto se difiere
+      a la próxima ejecución, donde ya encontrará la transcripción
+    Retorna {"pending", "deferred", "summary"}
+    """
+    empty = pending_calls.iloc[0:0]
+    summary = {"reused": 0, "reanalysis": 0, "deferred": 0, "minutes_saved": 0.0, "usd_saved": 0.0}
+    if pending_calls.empty:
+        return {"pending": pending_calls, "deferred": empty, "summary": summary}
+
     try:
-        client = bigquery.Client(project=PROJECT_ID)
-        
+        keys = list_content_keys(pending_calls['gsutil_url'])
+        if not keys:
+            return {"pending": pending_calls, "deferred": empty, "summary": summary}
+
+        calls = pending_calls.assign(hash_contenido=pending_calls['gsutil_url'].map(keys))
+        client = get_bigquery_client()
+
+        if apply:
+            try:
+                backfill_content_keys(client)
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo completar hash_contenido de transcripciones antiguas: {str(e)}")
+            hashed = calls[calls['hash_contenido'].notna()]
+            staging_table = load_dedup_staging(client, hashed)
+            try:
+                reused = reuse_transcriptions(client, staging_table)
+            finally:
+                client.delete_table(staging_table, not_found_ok=True)
+            reused_urls = set(reused['gsutil_url'])
+            if reused_urls:
+                record_processed_audios(sorted(reused_urls))
+        else:
+            known = find_reusable_transcriptions(client, calls['hash_contenido'].dropna())
+            reused = calls.merge(known, on='hash_contenido')
+            reused_urls = set(reused['gsutil_url'])
+
+        remaining = calls[~calls['gsutil_url'].isin(reused_urls)]
+        duplicated = remaining['hash_contenido'].notna() & remaining.duplicated(subset=['hash_contenido'], keep='first')
+        deferred = remaining[duplicated].drop(columns=['hash_contenido'])
+        remaining = remaining[~duplicated].drop(columns=['hash_contenido'])
+
+        minutes = float(reused['duracion_segundos'].fillna(0).sum()) / 60.0 if len(reused) else 0.0
+        usd = float(reused['costo_deepgram_usd'].fillna(0).sum()) if len(reused) else 0.0
+        if 'costo_openai_usd' in reused:
+            usd += float(reused['costo_openai_usd'].fillna(0).sum())
+        summary = {
+            "reused": len(reused_urls),
+            "reanalysis": int(reused['reanalizar'].fillna(False).sum()) if 'reanalizar' in reused else 0,
+            "deferred": len(deferred),
+            "minutes_saved": round(minutes, 1),
+            "usd_saved": round(usd, 4)
+        }
+        logger.info(f"🧬 Dedup por contenido: {summary['reused']} reutilizadas ({summary['reanalysis']} con otro DNI, a reanalizar), "
+                    f"{summary['deferred']} diferidas, "
+                    f"{summary['minutes_saved']} min y ${summary['usd_saved']:.2f} ahorrados")
+        return {"pending": remaining, "deferred": deferred, "summary": summary}
+
+    except Exception as e:
+        # Sin dedup se procesa todo como antes: cuesta más pero no se pierde ninguna llamada
+        logger.warning(f"⚠️ Dedup por contenido omitida: {str(e)}")
+        return {"pending": pending_calls, "deferred": empty, "summary": summary}
+
+def schedule_lanes(calls_df, fresh_window_hours=FRESH_WINDOW_HOURS, backfill_share=BACKFILL_SHARE, now=None):
+    """
+    Ordenar las llamadas pendientes en dos carriles intercalados
+    - fresh: Fecha_Llamada dentro de las últimas fresh_window_hours, la más antigua primero (FIFO)
+    - backfill: el resto, la más reciente primero
+    Mientras ambos carriles tienen llamadas, backfill recibe backfill_share de los despachos;
+    si uno se vacía, el otro usa toda la capacidad. Agrega la columna 'lane'
+    """
+    if calls_df.empty:
+        return calls_df.assign(lane=pd.Series(dtype='string'))
+
+    # Fechas locales de la central comparadas contra "ahora" en UTC, ambas con zona
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz='UTC')
+    if now.tzinfo is None:
+        now = now.tz_localize('UTC')
+    fechas = parse_call_dates(calls_df['Fecha_Llamada'])
+    unparsed = int(fechas.isna().sum())
+    if unparsed:
+        logger.warning(f"⚠️ {unparsed} llamadas con Fecha_Llamada ilegible van al final de backfill")
+    is_fresh = (fechas >= now - timedelta(hours=fresh_window_hours)).fillna(False).to_numpy(dtype=bool)
+
+    fresh = calls_df[is_fresh].assign(_fecha=fechas[is_fresh]).sort_values('_fecha', kind='stable')
+    backfill = calls_df[~is_fresh].assign(_fecha=fechas[~is_fresh]).sort_values('_fecha', ascending=False, kind='stable', na_position='last')
+
+    # Intercalado ponderado: cada llamada recibe un "turno virtual" según el peso de su carril
+    share = min(max(backfill_share, 0.0), 1.0)
+    fresh_turns = np.arange(1, len(fresh) + 1) / (1.0 - share) if share < 1.0 else np.full(len(fresh), np.inf)
+    backfill_turns = np.arange(1, len(backfill) + 1) / share if share > 0.0 else np.full(len(backfill), np.inf)
+
+    ordered = pd.concat([fresh.assign(lane='fresh', _turn=fresh_turns), backfill.assign(lane='backfill', _turn=backfill_turns)])
+    ordered = ordered.sort_values('_turn', kind='stable').drop(columns=['_fecha', '_turn'])
+    logger.info(f"🛣️ Carriles: {len(fresh)} fresh (últimas {fresh_window_hours:g}h), {len(backfill)} backfill ({share:.0%} de la capacidad)")
+    return ordered
+
+def summarize_lanes(calls_df, results):
+    """Resumen por carril de lo despachado, procesado y pendiente en esta invocación"""
+    dispatched = calls_df.iloc[:results['dispatched']]
+    failed = dispatched['gsutil_url'].isin(results['failed_urls'])
+    lanes = {}
+    for lane in ('fresh', 'backfill'):
+        in_lane = (dispatched['lane'] == lane).to_numpy()
+        lanes[lane] = {
+            "pending": int((calls_df['lane'] == lane).sum()),
+            "dispatched": int(in_lane.sum()),
+            "processed": int((in_lane & ~failed.to_numpy()).sum()),
+            "errors": int((in_lane & failed.to_numpy()).sum())
+        }
+    return lanes
+
+def get_historical_call_stats(days=PLANNER_HISTORY_DAYS):
+    """Promedios recientes de duración, costos y latencia de análisis desde BigQuery"""
+    try:
+        client = get_bigquery_client()
         query = f"""
-        SELECT DISTINCT audio_url
-        FROM `{PROJECT_ID}.{DATASET_ID}.transcripciones`
-        WHERE estado = 'procesado'
+        SELECT
+          (SELECT AVG(duracion_segundos) FROM `{PROJECT_ID}.{DATASET_ID}.transcripciones`
+           WHERE estado = 'procesado' AND created_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)) AS avg_duration_seconds,
+          (SELECT AVG(costo_openai_usd) FROM `{PROJECT_ID}.{DATASET_ID}.analisis_calidad`
+           WHERE estado = 'completado' AND created_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)) AS avg_openai_cost_usd,
+          (SELECT AVG(tiempo_procesamiento_segundos) FROM `{PROJECT_ID}.{DATASET_ID}.analisis_calidad`
+           WHERE estado = 'completado' AND created_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)) AS avg_analysis_seconds
         """
-        
-        result = client.query(query).to_dataframe()
-        return set(result['audio_url'].tolist()) if not result.empty else set()
-        
+        job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ScalarQueryParameter("days", "INT64", days)])
+        row = next(iter(client.query(query, job_config=job_config).result()), None)
+        if row is None:
+            return {}
+        return {key: float(value) for key, value in dict(row).items() if value is not None}
     except Exception as e:
-        logger.error(f"Error obteniendo llamadas procesadas: {str(e)}")
-        return set()
-
-def find_pending_calls(df_calls, processed_calls):
-    """Encontrar llamadas que no han sido procesadas basado en URL de audio"""
-    logger.info(f"🔍 Total llamadas en CSV: {len(df_calls)}")
-    logger.info(f"🔍 URLs ya procesadas: {len(processed_calls)}")
-    
-    # Remover duplicados del CSV primero
-    df_calls_unique = df_calls.drop_duplicates(subset=['gsutil_url'], keep='first')
-    logger.info(f"🔍 URLs únicas en CSV: {len(df_calls_unique)}")
-    
-    # Filtrar llamadas cuya URL no está en la lista de procesadas
-    pending = df_calls_unique[~df_calls_unique['gsutil_url'].isin(processed_calls)]
-    
-    logger.info(f"🔍 Llamadas pendientes después de filtrar: {len(pending)}")
-    
-    # Ordenar por fecha más reciente primero
-    if 'Fecha_Llamada' in pending.columns:
-        pending = pending.sort_values('Fecha_Llamada', ascending=False)
-    
-    return pending
-
-def process_pending_calls(calls_df):
-    """Procesar las llamadas pendientes en grupos de 500"""
+        logger.warning(f"⚠️ No se pudieron leer estadísticas históricas: {str(e)}")
+        return {}
+
+def parse_wav_duration(header, object_size):
+    """Duración en segundos a partir de la cabecera RIFF/WAVE (None si no es WAV)"""
+    if len(header) < 12 or header[0:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+    byte_rate = None
+    position = 12
+    while position + 8 <= len(header):
+        chunk_id = header[position:position + 4]
+        chunk_size = int.from_bytes(header[position + 4:position + 8], 'little')
+        if chunk_id == b'fmt ' and position + 20 <= len(header):
+            byte_rate = int.from_bytes(header[position + 16:position + 20], 'little')
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            # Grabaciones en streaming dejan el tamaño del chunk en 0 o 0xFFFFFFFF
+            data_size = chunk_size if 0 < chunk_size < 0xFFFFFFFF else object_size - position - 8
+            return max(data_size, 0) / byte_rate
+        position += 8 + chunk_size + (chunk_size % 2)
+    return None
+
+def sample_audio_durations(calls_df, sample_size=PLANNER_SAMPLE_SIZE):
+    """Leer tamaño y cabecera WAV de una muestra de audios pendientes (sin descargarlos)"""
+    urls = calls_df['gsutil_url'].drop_duplicates()
+    if urls.empty or sample_size <= 0:
+        return []
+    sample = urls.sample(n=min(sample_size, len(urls)), random_state=0).tolist()
+    bucket = get_storage_client().bucket(AUDIO_BUCKET)
+
+    def probe(gsutil_url):
+        blob_name = str(gsutil_url).replace(f'gs://{AUDIO_BUCKET}/', '')
+        try:
+            blob = bucket.get_blob(blob_name)
+            if blob is None:
+                return None
+            header = blob.download_as_bytes(start=0, end=PLANNER_HEADER_BYTES - 1)
+            return parse_wav_duration(header, blob.size)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo leer la cabecera de {gsutil_url}: {str(e)}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=PLANNER_PROBE_WORKERS) as executor:
+        return [duration for duration in executor.map(probe, sample) if duration is not None]
+
+def plan_batch(calls_df, max_concurrency, calls_per_minute, dispatch_window, sample_size=PLANNER_SAMPLE_SIZE):
+    """
+    Estimar minutos de audio, costo Deepgram/OpenAI y tiempo de reloj de un batch sin ejecutarlo
+    Minutos: cabeceras WAV de una muestra de pendientes; si no hay, duracion_segundos histórica
+    """
+    total_calls = len(calls_df)
+    history = get_historical_call_stats()
+    sampled = sample_audio_durations(calls_df, sample_size)
+
+    if sampled:
+        avg_seconds = float(np.mean(sampled))
+        duration_source = 'wav_headers'
+    elif 'avg_duration_seconds' in history:
+        avg_seconds = history['avg_duration_seconds']
+        duration_source = 'historical'
+    else:
+        avg_seconds = PLANNER_DEFAULT_CALL_SECONDS
+        duration_source = 'default'
+    audio_minutes = total_calls * avg_seconds / 60.0
+
+    # OpenAI: costo histórico por análisis, o tokens estimados con las tarifas de GPT-4o
+    if 'avg_openai_cost_usd' in history:
+        openai_per_call = history['avg_openai_cost_usd']
+        openai_source = 'historical'
+    else:
+        prompt_tokens = PLANNER_PROMPT_BASE_TOKENS + PLANNER_TOKENS_PER_AUDIO_MINUTE * avg_seconds / 60.0
+        openai_per_call = (prompt_tokens * OPENAI_PROMPT_COST_PER_1K + PLANNER_COMPLETION_TOKENS * OPENAI_COMPLETION_COST_PER_1K) / 1000
+        openai_source = 'estimated_tokens'
+
+    # Cada llamada a transcribe-audio incluye transcripción y análisis síncrono
+    analysis_seconds = history.get('avg_analysis_seconds', PLANNER_DEFAULT_ANALYSIS_SECONDS)
+    call_seconds = PLANNER_CALL_OVERHEAD_SECONDS + PLANNER_TRANSCRIPTION_SECONDS_PER_AUDIO_MINUTE * avg_seconds / 60.0 + analysis_seconds
+    concurrency_rate = max_concurrency / call_seconds * 60.0 if max_concurrency > 0 else 0.0
+    calls_rate = min(concurrency_rate, calls_per_minute) if calls_per_minute > 0 else concurrency_rate
+    wall_minutes = total_calls / calls_rate if calls_rate else None
+
+    return {
+        "audio": {
+            "total_minutes": round(audio_minutes, 1),
+            "avg_call_seconds": round(avg_seconds, 1),
+            "source": duration_source,
+            "sampled_files": len(sampled)
+        },
+        "cost_usd": {
+            "deepgram": round(audio_minutes * DEEPGRAM_COST_PER_MINUTE, 2),
+            "openai": round(total_calls * openai_per_call, 2),
+            "total": round(audio_minutes * DEEPGRAM_COST_PER_MINUTE + total_calls * openai_per_call, 2),
+            "openai_source": openai_source
+        },
+        "wall_clock": {
+            "estimated_call_seconds": round(call_seconds, 1),
+            "calls_per_minute": round(calls_rate, 2),
+            "bottleneck": 'rate_limit' if calls_per_minute > 0 and calls_per_minute < concurrency_rate else 'concurrency',
+            "estimated_minutes": round(wall_minutes, 1) if wall_minutes is not None else None,
+            # Invocaciones encadenadas con continuation tokens para cubrir todo el backlog
+            "estimated_invocations": int(np.ceil(wall_minutes * 60.0 / dispatch_window)) if wall_minutes and dispatch_window > 0 else None
+        },
+        "max_concurrency": max_concurrency,
+        "calls_per_minute_limit": calls_per_minute
+    }
+
+def parse_call_target(gsutil_url):
+    """Extraer (bucket_path, filename) desde gs://buckets_llamadas/000729143/filename.wav"""
+    url_parts = str(gsutil_url).replace('gs://buckets_llamadas/', '').split('/')
+    if len(url_parts) >= 2:
+        return url_parts[0], url_parts[1]
+    return None
+
+class RateLimiter:
+    """Limitador de ritmo thread-safe expresado en llamadas por minuto"""
+
+    def __init__(self, calls_per_minute):
+        self.interval = 60.0 / calls_per_minute if calls_per_minute and calls_per_minute > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquear hasta que haya un slot disponible según el ritmo configurado"""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+class AIMDController:
+    """
+    Ventana de concurrencia adaptativa (aumento aditivo, reducción multiplicativa)
+    Crece mientras las llamadas responden bien y se reduce ante 429/5xx, timeouts o p95 en alza
+    """
+
+    def __init__(self, max_window, initial_window=AIMD_INITIAL_WINDOW, min_window=1):
+        self.max_window = max(1, int(max_window))
+        self.min_window = max(1, min(int(min_window), self.max_window))
+        self.window = float(min(max(initial_window, self.min_window), self.max_window))
+        self.latencies = deque(maxlen=AIMD_LATENCY_SAMPLES)
+        self.baseline_p95 = None
+        self.last_decrease = 0.0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.history = [{"t": 0.0, "window": self.limit, "reason": "inicio"}]
+
+    @property
+    def limit(self):
+        """Número entero de llamadas permitidas en vuelo"""
+        return max(self.min_window, int(self.window))
+
+    def p95(self):
+        """Percentil 95 de las latencias recientes"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def record_success(self, latency):
+        """Registrar una respuesta sana y crecer la ventana si la latencia no sube"""
+        with self.lock:
+            self.latencies.append(latency)
+            current_p95 = self.p95()
+            if len(self.latencies) >= 10:
+                if self.baseline_p95 is None or current_p95 < self.baseline_p95:
+                    self.baseline_p95 = current_p95
+                elif current_p95 > self.baseline_p95 * AIMD_LATENCY_RISE_FACTOR:
+                    self._decrease(f"p95 {current_p95:.1f}s > {AIMD_LATENCY_RISE_FACTOR}x base {self.baseline_p95:.1f}s")
+                    return
+
+            previous = self.limit
+            # +1 por cada ventana completa de éxitos
+            self.window = min(self.max_window, self.window + 1.0 / self.window)
+            if self.limit != previous:
+                self._log_change("aumento")
+
+    def record_overload(self, reason, latency=None):
+        """Registrar una señal de sobrecarga (429, 5xx, timeout) y reducir la ventana"""
+        with self.lock:
+            if latency is not None:
+                self.latencies.append(latency)
+            self._decrease(reason)
+
+    def _decrease(self, reason):
+        # Una sola reducción por ronda: ignorar señales de llamadas lanzadas antes del último recorte
+        now = time.monotonic()
+        cooldown = self.p95() or 1.0
+        if now - self.last_decrease < cooldown:
+            return
+        self.last_decrease = now
+        self.window = max(float(self.min_window), self.window * AIMD_DECREASE_FACTOR)
+        # Tras un recorte, la latencia base se vuelve a aprender
+        self.latencies.clear()
+        self.baseline_p95 = None
+        self._log_change(reason)
+
+    def _log_change(self, reason):
+        self.history.append({
+            "t": round(time.monotonic() - self.started, 2),
+            "window": self.limit,
+            "reason": reason
+        })
+        logger.info(f"🎚️ Ventana de concurrencia: {self.limit} ({reason})")
+
+    def snapshot(self):
+        """Estado serializable del controlador para la respuesta del batch"""
+        with self.lock:
+            p95 = self.p95()
+            return {
+                "window": self.limit,
+                "max_window": self.max_window,
+                "p95_latency_seconds": round(p95, 2) if p95 is not None else None,
+                "history": list(self.history)
+            }
+
+class RetryPolicy:
+    """
+    Política de reintentos para llamadas entre funciones
+    - Clasifica cada intento como success / retryable / terminal
+    - Backoff exponencial con jitter completo, respetando Retry-After
+    - Presupuesto global: los reintentos no superan budget_ratio de las llamadas (+ un mínimo)
+    """
+
+    RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY_SECONDS,
+                 max_delay=RETRY_MAX_DELAY_SECONDS, budget_ratio=RETRY_BUDGET_RATIO, min_budget=RETRY_MIN_BUDGET):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.min_budget = min_budget
+        self.calls = 0
+        self.retries = 0
+        self.outcomes = {}
+        self.reasons = {}
+        self.lock = threading.Lock()
+
+    def classify(self, response, error):
+        """Retornar (outcome, reason) para un intento"""
+        if error is not None:
+            if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+                return 'retryable', type(error).__name__
+            return 'terminal', f"{type(error).__name__}: {error}"
+
+        status = response.status_code
+        if status == 200:
+            try:
+                result = response.json()
+            except ValueError:
+                return 'retryable', "HTTP 200 con cuerpo no JSON"
+            if result.get('success', False):
+                return 'success', "HTTP 200"
+            if str(result.get('message', '')).startswith('Skipping'):
+                return 'terminal', result['message']
+            # success: false sin causa definitiva suele ser un fallo transitorio aguas abajo
+            return 'retryable', f"success=false: {result.get('error', 'Unknown')}"
+
+        if status in self.RETRYABLE_STATUS:
+            return 'retryable', f"HTTP {status}"
+        return 'terminal', f"HTTP {status}"
+
+    def backoff(self, attempt, response=None):
+        """Espera antes del siguiente intento: jitter completo o Retry-After si es mayor"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def record_call(self):
+        with self.lock:
+            self.calls += 1
+
+    def try_spend_retry(self):
+        """Consumir un reintento del presupuesto global; False si ya no quedan"""
+        with self.lock:
+            if self.retries >= self.min_budget + self.calls * self.budget_ratio:
+                return False
+            self.retries += 1
+            return True
+
+    def record_outcome(self, outcome, reason):
+        with self.lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            if outcome != 'success':
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def summary(self):
+        """Resumen serializable para la respuesta del batch"""
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "retry_ratio": round(self.retries / self.calls, 3) if self.calls else 0.0,
+                "budget_ratio": self.budget_ratio,
+                "outcomes": dict(self.outcomes),
+                "failure_reasons": dict(self.reasons)
+            }
+
+def parse_retry_after(value):
+    """Interpretar Retry-After en segundos o como fecha HTTP"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def dispatch_call(gsutil_url, dni, limiter, controller=None, retry_policy=None, metrics=None, deadline=None):
+    """Despachar una llamada pendiente a la función de transcripción"""
+    target = parse_call_target(gsutil_url)
+    if not target:
+        logger.error(f"❌ URL inválida: {gsutil_url}")
+        if metrics:
+            metrics.record_transcription(False)
+        return False
+
+    limiter.acquire()
+    bucket_path, filename = target
+    return trigger_transcription(bucket_path, filename, dni, controller, retry_policy, metrics, deadline)
+
+def process_pending_calls(calls_df, max_concurrency=MAX_CONCURRENCY, calls_per_minute=CALLS_PER_MINUTE, deadline=None, metrics=None, call_deadline=None):
+    """
+    Procesar las llamadas pendientes con concurrencia acotada y adaptativa
+    La ventana AIMD decide cuántas llamadas van en vuelo (hasta max_concurrency)
+    y el limitador respeta calls_per_minute.
+    Con deadline (time.monotonic) deja de despachar al alcanzarlo; "dispatched" indica
+    cuántas filas de calls_df se enviaron, el resto queda para una continuación.
+    Con call_deadline cada intento en vuelo termina (o se corta) antes de ese instante
+    """
     processed = 0
     errors = 0
+    failed_urls = []
+    dispatched = 0
     total_calls = len(calls_df)
-    batch_size = 500
-    
-    logger.info(f"🚀 Iniciando procesamiento de {total_calls} llamadas en lotes de {batch_size}")
-    
-    # Procesar en lotes de 500
-    for batch_start in range(0, total_calls, batch_size):
-        batch_end = min(batch_start + batch_size, total_calls)
-        batch_df = calls_df.iloc[batch_start:batch_end]
-        
-        logger.info(f"📦 Procesando lote {batch_start//batch_size + 1}: llamadas {batch_start+1}-{batch_end} de {total_calls}")
-        
-        # Procesar cada llamada en el lote actual
-        for index, call in batch_df.iterrows():
-            try:
-                # Extraer información de la llamada
-                gsutil_url = call['gsutil_url']
-                dni = str(call['N_Doc'])
-                
-                # Extraer bucket y filename desde la URL
-                # gs://buckets_llamadas/000729143/filename.wav
-                url_parts = gsutil_url.replace('gs://buckets_llamadas/', '').split('/')
-                if len(url_parts) >= 2:
-                    bucket_path = url_parts[0]
-                    filename = url_parts[1]
-                    
-                    # Llamar a la función de transcripción
-                    success = trigger_transcription(bucket_path, filename, dni)
-                    
-                    if success:
-                        processed += 1
-                        if processed % 10 == 0:  # Log cada 10 llamadas
-                            logger.info(f"✅ Procesadas {processed}/{total_calls} llamadas")
-                    else:
-                        errors += 1
-                        logger.error(f"❌ Error procesando llamada {dni}")
-
-                    # Pausa para evitar sobrecarga
-                    time.sleep(3)  # 3 segundos entre llamadas
-                else:
-                    errors += 1
-                    logger.error(f"❌ URL inválida: {gsutil_url}")
+    max_concurrency = max(1, int(max_concurrency))
+    limiter = RateLimiter(calls_per_minute)
+    controller = AIMDController(max_concurrency)
+    retry_policy = RetryPolicy()
+    breaker = get_circuit_breaker('transcribe-audio')
 
-            except Exception as e:
-                errors += 1
-                logger.error(f"❌ Error procesando llamada {index}: {str(e)}")
+    get_http_session(pool_maxsize=DISPATCH_POOL_MAXSIZE)  # fija el tamaño del pool antes del primer POST
+    pool_before = http_pool_stats()
+    logger.info(f"🚀 Iniciando procesamiento de {total_calls} llamadas (concurrencia {max_concurrency}, {calls_per_minute} llamadas/min)")
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        in_flight = {}
+        calls = calls_df[['gsutil_url', 'N_Doc']].itertuples(index=False, name=None)
+
+        for gsutil_url, n_doc in calls:
+            # Siempre se despacha al menos una llamada para garantizar avance entre continuaciones
+            if deadline is not None and dispatched and time.monotonic() >= deadline:
+                logger.info(f"⏰ Presupuesto de tiempo agotado tras despachar {dispatched}/{total_calls} llamadas")
+                break
+
+            # Con el circuito abierto no se despacha: se espera la ventana de prueba o el deadline
+            if not wait_for_circuit(breaker, deadline):
+                logger.info(f"⚡ Circuito abierto hasta el deadline tras despachar {dispatched}/{total_calls} llamadas")
+                break
+
+            # Esperar a que se libere un slot antes de despachar la siguiente llamada
+            while len(in_flight) >= controller.limit:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    done_url, done_dni = in_flight.pop(future)
+                    ok = collect_result(future, done_dni)
+                    processed += ok
+                    errors += not ok
+                    if not ok:
+                        failed_urls.append(done_url)
+                    if ok and processed % 10 == 0:  # Log cada 10 llamadas
+                        logger.info(f"✅ Procesadas {processed}/{total_calls} llamadas")
+
+            dni = str(n_doc)
+            future = executor.submit(dispatch_call, gsutil_url, dni, limiter, controller, retry_policy, metrics, call_deadline)
+            in_flight[future] = (gsutil_url, dni)
+            dispatched += 1
+
+        for future in as_completed(list(in_flight)):
+            gsutil_url, dni = in_flight.pop(future)
+            ok = collect_result(future, dni)
+            processed += ok
+            errors += not ok
+            if not ok:
+                failed_urls.append(gsutil_url)
+
+    elapsed = time.monotonic() - started
+    throughput = (processed + errors) / elapsed * 60 if elapsed > 0 else 0.0
 
-            # Pausa adicional cada 5 llamadas
-            if (processed + errors) % 5 == 0:
-                logger.info("⏸️ Pausa de 5 segundos...")
-                time.sleep(5)
-        
-        # Log progreso del lote
-        logger.info(f"📊 Lote completado: {processed} exitosas, {errors} errores")
-    
     logger.info(f"🎉 Procesamiento completo: {processed} exitosas, {errors} errores de {total_calls} total")
-    return {"processed": processed, "errors": errors}
+    http_pool = http_pool_delta(pool_before, http_pool_stats())
+    logger.info(f"📈 Throughput: {throughput:.1f} llamadas/min en {elapsed:.1f}s")
+    logger.info(f"🔌 Conexiones HTTP: {http_pool['new_connections']} nuevas para {http_pool['requests']} peticiones")
+    return {
+        "processed": processed,
+        "errors": errors,
+        "failed_urls": failed_urls,
+        "dispatched": dispatched,
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_calls_per_minute": round(throughput, 2),
+        "max_concurrency": max_concurrency,
+        "calls_per_minute_limit": calls_per_minute,
+        "concurrency": controller.snapshot(),
+        "http_pool": http_pool,
+        "retries": retry_policy.summary(),
+        "circuit_breakers": {"transcribe-audio": breaker.snapshot()}
+    }
 
-def trigger_transcription(bucket_path, filename, dni):
-    """Llamar a la Cloud Function de transcripción con reintentos"""
-    max_retries = 3
-    retry_delay = 5  # segundos
+def wait_for_circuit(breaker, deadline, poll_seconds=0.5):
+    """Esperar a que el breaker acepte llamadas; False si antes se alcanza el deadline"""
+    while not breaker.ready():
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(poll_seconds)
+    return True
 
-    for attempt in range(max_retries):
-        try:
-            payload = {
-                "bucketName": "buckets_llamadas",
-                "fileName": f"{bucket_path}/{filename}"
-            }
+def collect_result(future, dni):
+    """Obtener el resultado de una llamada despachada sin propagar excepciones"""
+    try:
+        if future.result():
+            return True
+        logger.error(f"❌ Error procesando llamada {dni}")
+    except Exception as e:
+        logger.error(f"❌ Error procesando llamada {dni}: {str(e)}")
+    return False
 
-            logger.info(f"🎤 Intento {attempt + 1} transcripción para {dni}")
+def trigger_transcription(bucket_path, filename, dni, controller=None, retry_policy=None, metrics=None, deadline=None):
+    """
+    Llamar a la Cloud Function de transcripción con reintentos según RetryPolicy
+    Si se pasa un AIMDController, cada intento le informa latencia y señales de sobrecarga;
+    con PipelineMetrics se acumulan latencias y costos reportados por la función.
+    Con deadline (time.monotonic) el timeout de lectura y los reintentos no lo exceden
+    """
+    retry_policy = retry_policy or RetryPolicy()
+    retry_policy.record_call()
 
-            response = requests.post(
-                TRANSCRIPTION_URL,
-                json=payload,
-                timeout=300,  # 5 minutos timeout
-                headers={'Connection': 'close'}  # Evitar keep-alive
-            )
+    payload = {
+        "bucketName": "buckets_llamadas",
+        "fileName": f"{bucket_path}/{filename}"
+    }
 
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('success', False):
-                    logger.info(f"✅ Transcripción exitosa para {dni}")
-                    return True
-                else:
-                    logger.error(f"❌ Error en transcripción {dni}: {result.get('error', 'Unknown')}")
-                    return False
-            else:
-                logger.error(f"❌ HTTP {response.status_code} para {dni}")
-                if attempt < max_retries - 1:
-                    logger.info(f"⏳ Reintentando en {retry_delay} segundos...")
-                    time.sleep(retry_delay)
-                    continue
+    breaker = get_circuit_breaker('transcribe-audio')
+
+    for attempt in range(retry_policy.max_attempts):
+        response = None
+        error = None
+
+        # El deadline se revisa antes de pedir permiso: un intento que no se hace no reserva una prueba
+        read_timeout = 300  # 5 minutos timeout
+        if deadline is not None:
+            time_left = deadline - time.monotonic()
+            if time_left < MIN_ATTEMPT_SECONDS:
+                logger.warning(f"⏰ Sin tiempo para otro intento de {dni}, queda para la próxima ejecución")
+                retry_policy.record_outcome('deadline', 'deadline')
+                if metrics:
+                    metrics.record_transcription(False)
                 return False
+            read_timeout = min(read_timeout, time_left - HTTP_CONNECT_TIMEOUT)
 
-        except requests.exceptions.SSLError as ssl_error:
-            logger.error(f"❌ SSL Error para {dni} (intento {attempt + 1}): {str(ssl_error)}")
-            if attempt < max_retries - 1:
-                logger.info(f"⏳ Reintentando en {retry_delay} segundos...")
-                time.sleep(retry_delay)
-                continue
+        permit = breaker.allow()
+        if not permit:
+            logger.warning(f"⚡ Circuito abierto hacia transcribe-audio, se omite {dni}")
+            retry_policy.record_outcome('circuit_open', 'circuit_open')
+            if metrics:
+                metrics.record_transcription(False)
             return False
 
+        logger.info(f"🎤 Intento {attempt + 1} transcripción para {dni}")
+
+        attempt_started = time.monotonic()
+        try:
+            response = post_json(TRANSCRIPTION_URL, payload, read_timeout=read_timeout)
         except Exception as e:
-            logger.error(f"❌ Excepción llamando transcripción {dni} (intento {attempt + 1}): {str(e)}")
-            if attempt < max_retries - 1:
-                logger.info(f"⏳ Reintentando en {retry_delay} segundos...")
-                time.sleep(retry_delay)
-                continue
+            error = e
+        latency = time.monotonic() - attempt_started
+
+        if controller:
+            if isinstance(error, requests.exceptions.Timeout):
+                controller.record_overload("timeout")
+            elif response is not None and (response.status_code == 429 or response.status_code >= 500):
+                controller.record_overload(f"HTTP {response.status_code}", latency)
+            elif response is not None:
+                controller.record_success(latency)
+
+        outcome, reason = retry_policy.classify(response, error)
+        # Solo los fallos transitorios cuentan contra la salud del endpoint
+        if outcome == 'retryable':
+            breaker.record_failure(reason, permit)
+        else:
+            breaker.record_success(permit)
+
+        if outcome == 'success':
+            logger.info(f"✅ Transcripción exitosa para {dni}")
+            retry_policy.record_outcome('success', reason)
+            if metrics:
+                record_call_metrics(metrics, response.json())
+            return True
+
+        if outcome == 'terminal':
+            logger.error(f"❌ Error definitivo en transcripción {dni}: {reason}")
+            retry_policy.record_outcome('terminal', reason)
+            if metrics:
+                metrics.record_transcription(False)
             return False
 
-    return False
\ No newline at end of file
+        logger.error(f"❌ Error reintentable en transcripción {dni} (intento {attempt + 1}): {reason}")
+        if attempt == retry_policy.max_attempts - 1:
+            retry_policy.record_outcome('retries_exhausted', reason)
+            if metrics:
+                metrics.record_transcription(False)
+            return False
+        if not retry_policy.try_spend_retry():
+            logger.warning(f"⚠️ Presupuesto de reintentos agotado, no se reintenta {dni}")
+            retry_policy.record_outcome('budget_exhausted', reason)
+            if metrics:
+                metrics.record_transcription(False)
+            return False
+
+        delay = retry_policy.backoff(attempt, response)
+        if deadline is not None:
+            # La espera no consume el tiempo del último intento posible
+            delay = min(delay, max(0.0, deadline - time.monotonic() - MIN_ATTEMPT_SECONDS))
+        logger.info(f"⏳ Reintentando en {delay:.1f} segundos...")
+        time.sleep(delay)
+
+    return False
+
+def record_call_metrics(metrics, result):
+    """Acumular latencias y costos que transcribe-audio devuelve en su respuesta"""
+    if result.get('status') == 'submitted':
+        return  # Modo callback: el webhook de Deepgram completa la transcripción fuera de esta ejecución
+    metrics.record_transcription(True, result.get('transcription_seconds'), result.get('cost_usd', 0.0))
+    if result.get('analysis_queued'):
+        return  # El consumidor de la cola registra el análisis en sus propias métricas
+    metrics.record_analysis(bool(result.get('analysis_triggered')), result.get('analysis_seconds'), result.get('analysis_cost_usd', 0.0))
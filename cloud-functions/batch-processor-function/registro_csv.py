@@ -0,0 +1,68 @@
+"""
+Lectura en streaming de registro_llamadas.csv, compartida por las Cloud Functions
+Fuente: cloud-functions/shared/registro_csv.py. Cada función despliega una copia
+vendorizada en su carpeta; actualizarlas con `python cloud-functions/sync_shared.py`
+"""
+import os
+
+# Solo las columnas necesarias, con dtypes explícitos
+CSV_COLUMNS = {"gsutil_url": "string", "N_Doc": "string", "Fecha_Llamada": "string"}
+CSV_BATCH_ROWS = 50000
+CSV_READ_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Fecha_Llamada viene como DD/MM/YYYY (con hora opcional) en hora local de la central
+CSV_DATE_FORMATS = ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y')
+CALL_TIMEZONE = os.environ.get('CALL_TIMEZONE', 'America/Lima')
+
+def normalize_n_doc(n_doc):
+    """Normalizar N_Doc leído como texto al formato numérico histórico (sin ceros ni '.0')"""
+    n_doc = n_doc.str.strip().str.replace(r'\.0$', '', regex=True)
+    numeric = n_doc.str.fullmatch(r'\d+').fillna(False)
+    n_doc = n_doc.where(~numeric, n_doc.str.lstrip('0').replace('', '0'))
+    return n_doc
+
+def iter_csv_batches(blob, batch_rows=CSV_BATCH_ROWS, start_offset=0, columns=None, stats=None):
+    """
+    Leer registro_llamadas.csv en streaming desde Cloud Storage
+    Descarga por bloques con blob.open() y produce DataFrames de hasta batch_rows filas
+    con solo gsutil_url, N_Doc y Fecha_Llamada
+    Con start_offset > 0 lee solo la cola desde ese byte usando los nombres de columnas dados
+    """
+    import pandas as pd  # Diferido: transcription-function solo lo necesita sin índice de DNI
+
+    with blob.open('rb', chunk_size=CSV_READ_CHUNK_BYTES) as csv_file:
+        header_options = {}
+        if start_offset:
+            csv_file.seek(start_offset)
+            header_options = {"header": None, "names": columns}
+
+        reader = pd.read_csv(
+            csv_file,
+            usecols=lambda column: column in CSV_COLUMNS,
+            dtype=CSV_COLUMNS,
+            chunksize=batch_rows,
+            **header_options
+        )
+        for batch in reader:
+            if stats is not None:
+                stats['rows'] = stats.get('rows', 0) + len(batch)
+            # Limpiar y validar datos
+            batch = batch.dropna(subset=['gsutil_url', 'N_Doc'])
+            batch['N_Doc'] = normalize_n_doc(batch['N_Doc'])
+            yield batch
+
+def parse_call_dates(fechas):
+    """
+    Convertir Fecha_Llamada a timestamps con zona CALL_TIMEZONE usando los formatos explícitos
+    Las fechas que no calzan con ningún formato quedan en NaT
+    """
+    import pandas as pd
+
+    fechas = fechas.astype('string').str.strip()
+    parsed = pd.Series(pd.NaT, index=fechas.index, dtype='datetime64[ns]')
+    for date_format in CSV_DATE_FORMATS:
+        missing = parsed.isna() & fechas.notna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(fechas[missing], format=date_format, errors='coerce')
+    return parsed.dt.tz_localize(CALL_TIMEZONE)
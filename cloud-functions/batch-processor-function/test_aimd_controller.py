@@ -0,0 +1,78 @@
+"""Tests de la ventana de concurrencia adaptativa (AIMD)"""
+
+def freeze_clock(monkeypatch, module, start=100.0):
+    clock = {"now": start}
+    monkeypatch.setattr(module.time, 'monotonic', lambda: clock["now"])
+    return clock
+
+def test_window_grows_additively_up_to_max(batch_processor, monkeypatch):
+    freeze_clock(monkeypatch, batch_processor)
+    controller = batch_processor.AIMDController(max_window=4, initial_window=1)
+
+    limits = []
+    for _ in range(12):
+        controller.record_success(0.5)
+        limits.append(controller.limit)
+
+    # ~+1 por ventana completa de éxitos (window += 1/window), sin pasar de max_window
+    assert limits[:7] == [2, 2, 2, 3, 3, 3, 4]
+    assert set(limits[7:]) == {4}
+    assert [entry["reason"] for entry in controller.history] == ["inicio", "aumento", "aumento", "aumento"]
+
+def test_overload_halves_once_per_round(batch_processor, monkeypatch):
+    clock = freeze_clock(monkeypatch, batch_processor)
+    controller = batch_processor.AIMDController(max_window=16, initial_window=8)
+
+    controller.record_overload("HTTP 429")
+    assert controller.limit == 4
+
+    # Señales de llamadas lanzadas antes del recorte no vuelven a reducir
+    controller.record_overload("HTTP 503")
+    assert controller.limit == 4
+
+    clock["now"] += 1.5
+    controller.record_overload("timeout")
+    assert controller.limit == 2
+    assert [entry["reason"] for entry in controller.history[1:]] == ["HTTP 429", "timeout"]
+
+def test_window_never_drops_below_min(batch_processor, monkeypatch):
+    clock = freeze_clock(monkeypatch, batch_processor)
+    controller = batch_processor.AIMDController(max_window=8, initial_window=2, min_window=1)
+
+    for _ in range(5):
+        controller.record_overload("HTTP 500")
+        clock["now"] += 10
+
+    assert controller.limit == 1
+    assert controller.window == 1.0
+
+def test_latency_rise_is_treated_as_congestion(batch_processor, monkeypatch):
+    freeze_clock(monkeypatch, batch_processor)
+    controller = batch_processor.AIMDController(max_window=16, initial_window=8)
+
+    for _ in range(10):
+        controller.record_success(1.0)
+    grown = controller.limit
+    assert controller.baseline_p95 == 1.0
+
+    # p95 por encima de AIMD_LATENCY_RISE_FACTOR x la base provoca un recorte
+    for _ in range(10):
+        controller.record_success(5.0)
+        if controller.limit < grown:
+            break
+
+    assert controller.limit == grown // 2
+    assert controller.baseline_p95 is None  # la base se vuelve a aprender tras el recorte
+    assert controller.history[-1]["reason"].startswith("p95")
+
+def test_snapshot_is_serializable(batch_processor, monkeypatch):
+    freeze_clock(monkeypatch, batch_processor)
+    controller = batch_processor.AIMDController(max_window=3, initial_window=2)
+    controller.record_success(0.25)
+
+    snapshot = controller.snapshot()
+
+    assert snapshot["window"] == controller.limit
+    assert snapshot["max_window"] == 3
+    assert snapshot["p95_latency_seconds"] == 0.25
+    assert snapshot["history"][0] == {"t": 0.0, "window": 2, "reason": "inicio"}
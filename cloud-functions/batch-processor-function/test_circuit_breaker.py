@@ -0,0 +1,126 @@
+"""Tests del circuit breaker por endpoint (shared/circuit_breaker.py)"""
+import pytest
+
+import circuit_breaker
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', lambda: now[0])
+    return now
+
+def make_breaker(**overrides):
+    options = {"failure_threshold": 3, "error_rate": 1.0, "window": 20, "open_seconds": 30, "half_open_probes": 2}
+    options.update(overrides)
+    return circuit_breaker.CircuitBreaker('test', **options)
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure('HTTP 503', breaker.allow())
+
+def test_consecutive_failures_open_the_circuit(clock):
+    breaker = make_breaker()
+
+    breaker.record_failure('HTTP 503', breaker.allow())
+    breaker.record_failure('HTTP 503', breaker.allow())
+    assert breaker.state == 'closed'
+    breaker.record_failure('HTTP 503', breaker.allow())
+
+    assert breaker.state == 'open'
+    assert breaker.allow() is None
+    assert breaker.snapshot()['rejected'] == 1
+
+def test_error_rate_opens_the_circuit(clock):
+    breaker = make_breaker(failure_threshold=100, error_rate=0.5, window=10)
+
+    for ok in [True, False, True, False, False]:
+        permit = breaker.allow()
+        breaker.record_success(permit) if ok else breaker.record_failure('timeout', permit)
+
+    assert breaker.state == 'open'
+
+def test_half_open_closes_after_all_probes_succeed(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+    clock[0] += 30
+
+    first, second = breaker.allow(), breaker.allow()
+    assert breaker.state == 'half_open'
+    assert breaker.allow() is None  # sin más slots de prueba
+    breaker.record_success(first)
+    assert breaker.state == 'half_open'
+    breaker.record_success(second)
+
+    assert breaker.state == 'closed'
+    assert breaker.snapshot()['transitions'] == {"closed->open": 1, "open->half_open": 1, "half_open->closed": 1}
+
+def test_failed_probe_reopens_the_circuit(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+    clock[0] += 30
+
+    breaker.record_failure('HTTP 503', breaker.allow())
+
+    assert breaker.state == 'open'
+    assert not breaker.ready()
+    clock[0] += 30
+    assert breaker.ready()
+
+def test_late_results_do_not_consume_probe_slots(clock):
+    breaker = make_breaker(failure_threshold=1)
+    late = breaker.allow()  # llamada aceptada con el circuito cerrado, aún en vuelo
+    breaker.record_failure('HTTP 503', breaker.allow())
+    clock[0] += 30
+    probe = breaker.allow()
+
+    # El resultado tardío no libera ni cuenta como prueba, ni reabre el circuito
+    breaker.record_success(late)
+    breaker.record_failure('timeout', late)
+    assert breaker.state == 'half_open'
+    assert breaker.probes_in_flight == 1
+    assert breaker.probe_successes == 0
+
+    breaker.record_success(probe)
+    breaker.record_success(breaker.allow())
+    assert breaker.state == 'closed'
+
+def test_probe_from_previous_half_open_is_ignored(clock):
+    breaker = make_breaker(failure_threshold=1)
+    breaker.record_failure('HTTP 503', breaker.allow())
+    clock[0] += 30
+    stale_probe = breaker.allow()
+    breaker.record_failure('HTTP 503', breaker.allow())  # otra prueba falla: se reabre
+    clock[0] += 30
+    current = breaker.allow()
+
+    breaker.record_success(stale_probe)
+
+    assert breaker.probes_in_flight == 1
+    assert breaker.probe_successes == 0
+    breaker.record_failure('HTTP 503', current)
+    assert breaker.state == 'open'
+
+def test_released_permits_free_their_probe_slot(clock):
+    breaker = make_breaker()
+    open_breaker(breaker)
+    clock[0] += 30
+
+    first, second = breaker.allow(), breaker.allow()
+    breaker.release(first)
+
+    assert breaker.ready()
+    assert breaker.state == 'half_open'  # liberar no cuenta como resultado
+    breaker.release(second)
+    assert breaker.probes_in_flight == 0
+
+def test_calls_skipped_on_the_deadline_do_not_hold_probes(clock, batch_processor, monkeypatch):
+    breaker = make_breaker()
+    open_breaker(breaker)
+    clock[0] += 30
+    monkeypatch.setattr(batch_processor, 'get_circuit_breaker', lambda name: breaker)
+    monkeypatch.setattr(batch_processor, 'post_json', lambda *args, **kwargs: pytest.fail("no debe llamar"))
+
+    for n in range(breaker.half_open_probes + 1):
+        assert batch_processor.trigger_transcription("000", f"{n}.wav", str(n), deadline=clock[0]) is False
+
+    assert breaker.ready()
@@ -0,0 +1,56 @@
+"""Tests de los clientes y la sesión HTTP compartidos (shared/clients.py)"""
+import gzip
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import clients
+
+def test_get_client_creates_one_client_per_name_across_threads():
+    created = []
+    barrier = threading.Barrier(8)
+
+    def factory():
+        created.append(object())
+        return created[-1]
+
+    def get(_):
+        barrier.wait()
+        return clients.get_client('test-shared-client', factory)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(get, range(8)))
+
+    assert len(created) == 1
+    assert all(result is created[0] for result in results)
+
+def test_named_sessions_keep_their_own_pool_size():
+    default = clients.get_http_session('test-default')
+    sized = clients.get_http_session('test-sized', pool_maxsize=8)
+
+    assert clients.get_http_session('test-sized', pool_maxsize=2) is sized  # el tamaño se fija al crearla
+    assert default is not sized
+    assert default.get_adapter('https://').poolmanager.connection_pool_kw['maxsize'] == clients.HTTP_POOL_MAXSIZE
+    assert sized.get_adapter('https://').poolmanager.connection_pool_kw['maxsize'] == 8
+    assert clients.http_pool_stats('test-missing') == {"requests": 0, "new_connections": 0}
+
+def test_post_json_compresses_and_sets_timeouts():
+    sent = {}
+
+    class RecordingSession:
+        def post(self, url, data, headers, timeout):
+            sent.update(url=url, data=data, headers=headers, timeout=timeout)
+
+    clients.post_json("https://example.test/x", {"a": 1}, read_timeout=30, gzip_body=True, session=RecordingSession())
+
+    assert json.loads(gzip.decompress(sent['data'])) == {"a": 1}
+    assert sent['headers']['Content-Encoding'] == 'gzip'
+    assert sent['timeout'] == (clients.HTTP_CONNECT_TIMEOUT, 30)
+
+def test_batch_processor_uses_the_shared_helpers(batch_processor):
+    assert batch_processor.get_client is clients.get_client
+    assert batch_processor.post_json is clients.post_json
+
+def test_transcription_uses_the_shared_post_json():
+    from conftest import load_function
+    assert load_function('transcription-function').post_json is clients.post_json
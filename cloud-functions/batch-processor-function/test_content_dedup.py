@@ -0,0 +1,73 @@
+"""Tests del dedup por contenido: reutilización de transcripciones de audios idénticos"""
+import pandas as pd
+import pytest
+
+from fakes import FakeBigQueryClient
+
+PENDING = pd.DataFrame({
+    "gsutil_url": ["gs://buckets_llamadas/010/copia.wav", "gs://buckets_llamadas/011/nueva.wav"],
+    "N_Doc": ["10", "11"],
+    "Fecha_Llamada": ["10/04/2025 09:30:00", "11/04/2025"],
+}).astype("string")
+
+@pytest.fixture
+def bigquery_client(batch_processor, monkeypatch):
+    def results(sql):
+        if "hash_contenido IS NULL AND reutilizada_de IS NULL" in sql:
+            return pd.DataFrame({"audio_url": ["gs://buckets_llamadas/001/original.wav"]})
+        if "CREATE TEMP TABLE originales" in sql:
+            return pd.DataFrame({
+                "gsutil_url": ["gs://buckets_llamadas/010/copia.wav"], "duracion_segundos": [120],
+                "costo_deepgram_usd": [0.01], "reanalizar": [True], "costo_openai_usd": [None]
+            })
+        return None
+    client = FakeBigQueryClient(results)
+    monkeypatch.setattr(batch_processor, 'get_bigquery_client', lambda: client)
+    monkeypatch.setattr(batch_processor, 'record_processed_audios', lambda urls: None)
+    monkeypatch.setattr(batch_processor, 'list_content_keys', lambda urls: {
+        "gs://buckets_llamadas/001/original.wav": "md5:aaa",
+        "gs://buckets_llamadas/010/copia.wav": "md5:aaa",
+        "gs://buckets_llamadas/011/nueva.wav": "md5:bbb",
+    })
+    return client
+
+def test_staging_carries_parsed_call_dates(batch_processor, bigquery_client):
+    batch_processor.dedup_pending_calls(PENDING)
+
+    _, staging, job_config = bigquery_client.loads[0]
+    # Sin fecha en la ruta: el día de Fecha_Llamada (día primero) a medianoche, como transcribe-audio
+    assert staging['fecha_llamada'].tolist() == [
+        pd.Timestamp("2025-04-10", tz="UTC"),
+        pd.Timestamp("2025-04-11", tz="UTC"),
+    ]
+    assert {field.name: field.field_type for field in job_config.schema}['fecha_llamada'] == "TIMESTAMP"
+
+def test_copied_call_dates_match_the_filename_date(batch_processor):
+    fechas = batch_processor.transcription_call_dates(
+        pd.Series(["gs://buckets_llamadas/10042025_203015/a.wav", "gs://buckets_llamadas/sin_fecha/b.wav"], dtype="string"),
+        pd.Series(["10/04/2025 21:00:00", "10/04/2025 23:30:00"], dtype="string"),
+    )
+
+    # Las 21:00 y 23:30 en Lima ya son el 11/04 en UTC; la fila copiada queda en el 10/04 igual que las transcritas
+    assert fechas.tolist() == [pd.Timestamp("2025-04-10", tz="UTC"), pd.Timestamp("2025-04-10", tz="UTC")]
+
+def test_copies_get_their_own_id_and_other_dnis_are_reanalyzed(batch_processor, bigquery_client):
+    dedup = batch_processor.dedup_pending_calls(PENDING)
+
+    script = next(sql for sql in bigquery_client.queries if "CREATE TEMP TABLE originales" in sql)
+    assert "SAFE_CAST" not in script
+    assert "WHERE TRUE\n        QUALIFY" in script
+    assert "o.transcripcion_id_nueva, a.categoria" in script
+    assert "WHERE o.N_Doc = o.dni" in script
+    assert dedup['summary']['reused'] == 1
+    assert dedup['summary']['reanalysis'] == 1
+    assert list(dedup['pending']['gsutil_url']) == ["gs://buckets_llamadas/011/nueva.wav"]
+
+def test_legacy_transcriptions_get_a_content_hash(batch_processor, bigquery_client):
+    batch_processor.dedup_pending_calls(PENDING)
+
+    update = next(sql for sql in bigquery_client.queries if sql.lstrip().startswith("UPDATE"))
+    assert "t.hash_contenido IS NULL" in update
+    # El backfill corre antes de buscar originales, así la consulta de reutilización ya los encuentra
+    assert bigquery_client.queries.index(update) < next(
+        i for i, sql in enumerate(bigquery_client.queries) if "CREATE TEMP TABLE originales" in sql)
@@ -0,0 +1,61 @@
+"""Tests del planificador (dry run): estima sobre el CSV completo sin escribir nada"""
+import copy
+
+import pandas as pd
+import pytest
+
+from fakes import FakeBigQueryClient, FakeStorageClient
+
+CALLS = [
+    ("01/05/2025", "gs://buckets_llamadas/001/a.wav", "1"),
+    ("02/05/2025", "gs://buckets_llamadas/002/b.wav", "2"),
+    ("03/05/2025", "gs://buckets_llamadas/003/c.wav", "3"),
+]
+
+@pytest.fixture
+def storage(batch_processor, monkeypatch):
+    client = FakeStorageClient()
+    client.put(batch_processor.CSV_BUCKET, batch_processor.CSV_BLOB_PATH,
+               "Fecha_Llamada,gsutil_url,N_Doc\n" + "".join(f"{fecha},{url},{dni}\n" for fecha, url, dni in CALLS))
+    monkeypatch.setattr(batch_processor, 'get_storage_client', lambda: client)
+    monkeypatch.setattr(batch_processor, 'plan_batch', lambda calls, *args: {"estimated_calls": len(calls)})
+    return client
+
+@pytest.fixture
+def bigquery_client(batch_processor, monkeypatch):
+    client = FakeBigQueryClient(lambda sql: pd.DataFrame({"audio_url": ["gs://buckets_llamadas/001/a.wav"]}))
+    monkeypatch.setattr(batch_processor, 'get_bigquery_client', lambda: client)
+    return client
+
+def snapshot(storage):
+    return {name: copy.deepcopy(bucket.objects) for name, bucket in storage.buckets.items()}
+
+def dry_run(batch_processor, **options):
+    return batch_processor.process_daily_batch(batch_processor.LocalRequest({"dry_run": True, "dedup": False, **options}))
+
+def test_dry_run_scans_the_whole_csv_despite_the_checkpoint(batch_processor, storage, bigquery_client, monkeypatch):
+    generation = storage.bucket(batch_processor.CSV_BUCKET).get_blob(batch_processor.CSV_BLOB_PATH).generation
+    monkeypatch.setattr(batch_processor, 'load_checkpoint', lambda: {"generation": generation, "row_count": 3, "carry_over": []})
+
+    response = dry_run(batch_processor, pending_mode="python")
+
+    assert response['scan_mode'] == 'full'
+    assert response['pending_calls'] == 2
+    assert response['estimated_calls'] == 2
+
+def test_dry_run_does_not_compact_or_seed_the_manifest(batch_processor, storage, bigquery_client):
+    delta = batch_processor.audio_url_hash("gs://buckets_llamadas/002/b.wav")
+    storage.put(batch_processor.MANIFEST_BUCKET, f"{batch_processor.MANIFEST_DELTA_PREFIX}{delta:016x}", b'')
+    before = snapshot(storage)
+
+    response = dry_run(batch_processor, pending_mode="manifest", rebuild_manifest=True)
+
+    assert response['pending_calls'] == 1  # semilla de BigQuery + delta, solo en memoria
+    assert snapshot(storage) == before
+
+def test_dry_run_bigquery_mode_skips_the_staging_table(batch_processor, storage, bigquery_client):
+    response = dry_run(batch_processor, pending_mode="bigquery")
+
+    assert response['pending_calls'] == 2
+    assert bigquery_client.loads == []
+    assert bigquery_client.deleted == []
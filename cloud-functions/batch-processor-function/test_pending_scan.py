@@ -0,0 +1,95 @@
+"""Tests del escaneo del CSV con filtrado de pendientes por lote"""
+import functools
+
+import pandas as pd
+import pytest
+
+from fakes import FakeBigQueryClient, FakeStorageClient
+
+CSV_HEADER = "Fecha_Llamada,gsutil_url,N_Doc,Duracion\n"
+
+def csv_rows(rows):
+    return CSV_HEADER + "".join(f"{fecha},{url},{dni},60\n" for fecha, url, dni in rows)
+
+@pytest.fixture
+def storage(batch_processor, monkeypatch):
+    client = FakeStorageClient()
+    monkeypatch.setattr(batch_processor, 'get_storage_client', lambda: client)
+    # Lotes de 2 filas para ejercitar el filtrado entre lotes
+    monkeypatch.setattr(batch_processor, 'iter_csv_batches', functools.partial(batch_processor.iter_csv_batches, batch_rows=2))
+    return client
+
+def put_csv(batch_processor, storage, rows):
+    storage.put(batch_processor.CSV_BUCKET, batch_processor.CSV_BLOB_PATH, csv_rows(rows))
+
+def test_only_pending_rows_are_kept(batch_processor, storage, monkeypatch):
+    put_csv(batch_processor, storage, [
+        ("01/05/2025", "gs://buckets_llamadas/001/a.wav", "0001"),
+        ("02/05/2025", "gs://buckets_llamadas/002/b.wav", "2"),
+        ("03/05/2025", "gs://buckets_llamadas/001/a.wav", "1"),  # repetida en otro lote
+        ("04/05/2025", "gs://buckets_llamadas/003/c.wav", "3"),
+        ("05/05/2025", "gs://buckets_llamadas/004/d.wav", "4.0"),
+    ])
+    monkeypatch.setattr(batch_processor, 'get_processed_calls', lambda: {"gs://buckets_llamadas/002/b.wav"})
+    added = []
+    pending_filter = batch_processor.PendingCallsFilter(batch_processor.get_processed_calls)
+    original_add = pending_filter.add
+    monkeypatch.setattr(pending_filter, 'add', lambda batch: added.append(len(batch)) or original_add(batch))
+    monkeypatch.setattr(batch_processor, 'make_pending_filter', lambda mode, *args: pending_filter)
+
+    collected = batch_processor.collect_pending_calls({"full_scan": True, "pending_mode": "python", "dedup": False})
+
+    pending = collected['pending']
+    assert added == [2, 2, 1]
+    assert sorted(pending['gsutil_url']) == [
+        "gs://buckets_llamadas/001/a.wav", "gs://buckets_llamadas/003/c.wav", "gs://buckets_llamadas/004/d.wav"
+    ]
+    # Primera aparición de cada URL, N_Doc normalizado
+    assert pending.set_index('gsutil_url').loc["gs://buckets_llamadas/001/a.wav", 'Fecha_Llamada'] == "01/05/2025"
+    assert set(pending['N_Doc']) == {"1", "3", "4"}
+    assert collected['summary']['new_calls'] == 5
+    assert collected['scan']['checkpoint']['row_count'] == 5
+
+def test_unchanged_csv_does_not_query_processed(batch_processor, storage, monkeypatch):
+    put_csv(batch_processor, storage, [("01/05/2025", "gs://buckets_llamadas/001/a.wav", "1")])
+    generation = storage.bucket(batch_processor.CSV_BUCKET).get_blob(batch_processor.CSV_BLOB_PATH).generation
+    monkeypatch.setattr(batch_processor, 'load_checkpoint', lambda: {"generation": generation, "row_count": 1, "carry_over": []})
+    monkeypatch.setattr(batch_processor, 'get_processed_calls', lambda: pytest.fail("no debe consultar BigQuery"))
+
+    collected = batch_processor.collect_pending_calls({"pending_mode": "python"})
+
+    assert collected['summary']['scan_mode'] == 'unchanged'
+    assert collected['pending'].empty
+
+def test_staging_filter_loads_in_chunks_and_drops_table(batch_processor, storage, monkeypatch):
+    put_csv(batch_processor, storage, [
+        (f"0{day}/05/2025", f"gs://buckets_llamadas/00{day}/{day}.wav", str(day)) for day in range(1, 6)
+    ])
+    client = FakeBigQueryClient(lambda sql: pd.DataFrame({
+        "gsutil_url": ["gs://buckets_llamadas/005/5.wav"], "N_Doc": ["5"], "Fecha_Llamada": ["05/05/2025"]
+    }))
+    monkeypatch.setattr(batch_processor, 'get_bigquery_client', lambda: client)
+    monkeypatch.setattr(batch_processor, 'make_pending_filter', lambda mode, *args: batch_processor.StagingPendingFilter(load_rows=3))
+
+    collected = batch_processor.collect_pending_calls({"full_scan": True, "pending_mode": "bigquery", "dedup": False})
+
+    # 5 filas con load_rows=3: un load al superar el umbral y otro con el resto
+    assert [len(frame) for _, frame, _ in client.loads] == [4, 1]
+    tables = {table_id for table_id, _, _ in client.loads}
+    assert len(tables) == 1
+    assert list(client.loads[1][1]['fila']) == [4]
+    assert client.deleted == list(tables)
+    assert list(collected['pending']['gsutil_url']) == ["gs://buckets_llamadas/005/5.wav"]
+    assert collected['summary']['processed_calls'] == 4
+
+def test_failed_lookup_is_an_error_not_an_empty_set(batch_processor, storage, monkeypatch):
+    put_csv(batch_processor, storage, [("01/05/2025", "gs://buckets_llamadas/001/a.wav", "1")])
+
+    def broken():
+        raise RuntimeError("BigQuery no disponible")
+    monkeypatch.setattr(batch_processor, 'make_pending_filter', lambda mode, *args: batch_processor.PendingCallsFilter(broken))
+
+    collected = batch_processor.collect_pending_calls({"full_scan": True, "pending_mode": "python"})
+
+    assert collected['status'] == 500
+    assert "BigQuery no disponible" in collected['error']
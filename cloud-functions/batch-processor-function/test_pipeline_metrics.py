@@ -0,0 +1,51 @@
+"""Tests de las métricas por ejecución (shared/pipeline_metrics.py) y del run_id del batch"""
+from fakes import FakeBigQueryClient
+
+import pipeline_metrics
+
+def test_percentile_uses_nearest_rank():
+    values = [5, 1, 4, 2, 3]
+
+    assert pipeline_metrics.percentile(values, 50) == 3.0
+    assert pipeline_metrics.percentile(values, 95) == 5.0
+    assert pipeline_metrics.percentile([], 50) is None
+
+def test_metrics_row_aggregates_calls():
+    metrics = pipeline_metrics.PipelineMetrics('test')
+    metrics.record_transcription(True, 10.0, 0.02)
+    metrics.record_transcription(True, 20.0, 0.03)
+    metrics.record_transcription(False)
+    metrics.record_analysis(True, 4.0, 0.01)
+
+    row = metrics.to_row()
+
+    assert row['audios_procesados'] == 3
+    assert row['transcripciones_exitosas'] == 2
+    assert row['errores_transcripcion'] == 1
+    assert row['tiempo_promedio_transcripcion'] == 15.0
+    assert row['costo_total_deepgram'] == 0.05
+    assert row['analisis_completados'] == 1
+
+def test_write_merges_into_the_given_table_and_skips_empty_runs():
+    client = FakeBigQueryClient()
+    metrics = pipeline_metrics.PipelineMetrics('test')
+
+    assert pipeline_metrics.write_pipeline_metrics(lambda: client, "p.d.metricas_pipeline", metrics, "run-1") is None
+    assert client.queries == []
+
+    metrics.record_transcription(True, 1.0)
+    row = pipeline_metrics.write_pipeline_metrics(lambda: client, "p.d.metricas_pipeline", metrics, "run-1")
+
+    assert row['audios_procesados'] == 1
+    assert "MERGE `p.d.metricas_pipeline` T" in client.queries[0]
+
+def test_batch_run_id_is_deterministic(batch_processor):
+    scan = {"checkpoint": {"generation": 17, "byte_offset": 2048, "row_count": 10}}
+
+    first = batch_processor.batch_run_id({}, None, scan)
+    retry = batch_processor.batch_run_id({}, None, scan)
+    continuation = batch_processor.batch_run_id({"run_id": "a" * 32}, "b" * 32, None)
+
+    assert first == retry
+    assert first.startswith("batch-") and first.endswith("-g17-o2048")
+    assert continuation.startswith("a" * 32 + "-") and continuation.endswith("-" + "b" * 32)
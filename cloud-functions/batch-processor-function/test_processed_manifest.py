@@ -0,0 +1,42 @@
+"""Tests del manifiesto de audios procesados en GCS"""
+import pytest
+
+from fakes import FakeStorageClient
+
+@pytest.fixture
+def storage(batch_processor, monkeypatch):
+    client = FakeStorageClient()
+    monkeypatch.setattr(batch_processor, 'get_storage_client', lambda: client)
+    return client
+
+def test_contains_matches_membership(batch_processor):
+    processed = [f"gs://buckets_llamadas/{n:03d}/audio.wav" for n in range(500)]
+    manifest = batch_processor.ProcessedManifest([batch_processor.audio_url_hash(url) for url in processed])
+    queries = processed[:50] + [f"gs://buckets_llamadas/{n:03d}/otro.wav" for n in range(50)]
+
+    mask = manifest.contains(queries)
+
+    assert mask.tolist() == [True] * 50 + [False] * 50
+    assert batch_processor.ProcessedManifest([]).contains(queries[:3]).tolist() == [False] * 3
+
+def test_load_seeds_from_bigquery_and_compacts_deltas(batch_processor, storage, monkeypatch):
+    monkeypatch.setattr(batch_processor, 'get_processed_calls', lambda: {"gs://buckets_llamadas/001/a.wav"})
+    delta = batch_processor.audio_url_hash("gs://buckets_llamadas/002/b.wav")
+    storage.put(batch_processor.MANIFEST_BUCKET, f"{batch_processor.MANIFEST_DELTA_PREFIX}{delta:016x}", b'')
+
+    manifest = batch_processor.ProcessedManifest.load()
+
+    assert manifest.contains(["gs://buckets_llamadas/001/a.wav", "gs://buckets_llamadas/002/b.wav"]).all()
+    bucket = storage.bucket(batch_processor.MANIFEST_BUCKET)
+    assert list(bucket.objects) == [batch_processor.MANIFEST_PATH]
+
+def test_failed_seed_query_raises_and_saves_nothing(batch_processor, storage, monkeypatch):
+    class FailingClient:
+        def query(self, sql):
+            raise RuntimeError("quota exceeded")
+    monkeypatch.setattr(batch_processor, 'get_bigquery_client', lambda: FailingClient())
+
+    with pytest.raises(RuntimeError):
+        batch_processor.ProcessedManifest.load()
+
+    assert batch_processor.MANIFEST_PATH not in storage.bucket(batch_processor.MANIFEST_BUCKET).objects
@@ -0,0 +1,76 @@
+"""Tests del limitador de ritmo del dispatcher"""
+import threading
+
+class FakeClock:
+    """Reloj monotónico controlado: sleep avanza el tiempo en vez de bloquear"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+        self.lock = threading.Lock()
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+def install_clock(monkeypatch, module):
+    clock = FakeClock()
+    monkeypatch.setattr(module.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(module.time, 'sleep', clock.sleep)
+    return clock
+
+def test_spaces_calls_at_configured_rate(batch_processor, monkeypatch):
+    clock = install_clock(monkeypatch, batch_processor)
+    limiter = batch_processor.RateLimiter(calls_per_minute=120)
+
+    for _ in range(5):
+        limiter.acquire()
+
+    # La primera llamada sale de inmediato; las siguientes cada 0.5 s
+    assert clock.sleeps == [0.5, 0.5, 0.5, 0.5]
+    assert clock.now == 1002.0
+
+def test_idle_time_is_not_banked(batch_processor, monkeypatch):
+    clock = install_clock(monkeypatch, batch_processor)
+    limiter = batch_processor.RateLimiter(calls_per_minute=60)
+
+    limiter.acquire()
+    clock.now += 10  # Un rato sin llamadas no acumula ráfaga
+    limiter.acquire()
+    limiter.acquire()
+
+    assert clock.sleeps == [1.0]
+
+def test_zero_rate_disables_limit(batch_processor, monkeypatch):
+    clock = install_clock(monkeypatch, batch_processor)
+    for calls_per_minute in (0, None, -5):
+        limiter = batch_processor.RateLimiter(calls_per_minute)
+        for _ in range(3):
+            limiter.acquire()
+    assert clock.sleeps == []
+
+def test_concurrent_callers_get_distinct_slots(batch_processor, monkeypatch):
+    sleeps = []
+    lock = threading.Lock()
+
+    def record_sleep(seconds):
+        with lock:
+            sleeps.append(round(seconds, 6))
+
+    # Reloj detenido: cada hilo debe reservar un slot propio, sin repetir esperas
+    monkeypatch.setattr(batch_processor.time, 'monotonic', lambda: 50.0)
+    monkeypatch.setattr(batch_processor.time, 'sleep', record_sleep)
+    limiter = batch_processor.RateLimiter(calls_per_minute=600)
+
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(sleeps) == [round(0.1 * n, 6) for n in range(1, 20)]
+    assert round(limiter.next_slot - 50.0, 6) == 2.0
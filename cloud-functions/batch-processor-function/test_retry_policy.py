@@ -0,0 +1,109 @@
+"""Tests de la política de reintentos hacia transcribe-audio"""
+import pytest
+import requests
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        if self.body is None:
+            raise ValueError("sin JSON")
+        return self.body
+
+class OpenBreaker:
+    """Breaker que siempre acepta llamadas, para aislar la política de reintentos"""
+
+    def allow(self):
+        return True
+
+    def record_success(self, permit=None):
+        pass
+
+    def record_failure(self, reason=None, permit=None):
+        pass
+
+@pytest.mark.parametrize("response, error, expected", [
+    (FakeResponse(200, {"success": True}), None, 'success'),
+    (FakeResponse(200), None, 'retryable'),
+    (FakeResponse(200, {"success": False, "error": "deepgram"}), None, 'retryable'),
+    (FakeResponse(200, {"success": False, "message": "Skipping: ya procesado"}), None, 'terminal'),
+    (FakeResponse(429), None, 'retryable'),
+    (FakeResponse(503), None, 'retryable'),
+    (FakeResponse(400), None, 'terminal'),
+    (FakeResponse(404), None, 'terminal'),
+    (None, requests.exceptions.ReadTimeout("lento"), 'retryable'),
+    (None, requests.exceptions.ConnectionError("reset"), 'retryable'),
+    (None, ValueError("payload"), 'terminal'),
+])
+def test_classify(batch_processor, response, error, expected):
+    outcome, reason = batch_processor.RetryPolicy().classify(response, error)
+    assert outcome == expected
+    assert reason
+
+def test_backoff_uses_full_jitter_with_cap(batch_processor, monkeypatch):
+    policy = batch_processor.RetryPolicy(base_delay=2.0, max_delay=10.0)
+    bounds = []
+    monkeypatch.setattr(batch_processor.random, 'uniform', lambda low, high: bounds.append((low, high)) or high)
+
+    delays = [policy.backoff(attempt) for attempt in range(4)]
+
+    assert bounds == [(0, 2.0), (0, 4.0), (0, 8.0), (0, 10.0)]
+    assert delays == [2.0, 4.0, 8.0, 10.0]
+
+def test_backoff_honours_retry_after(batch_processor, monkeypatch):
+    policy = batch_processor.RetryPolicy(base_delay=1.0, max_delay=30.0)
+    monkeypatch.setattr(batch_processor.random, 'uniform', lambda low, high: 0.0)
+
+    assert policy.backoff(0, FakeResponse(429, headers={'Retry-After': '7'})) == 7.0
+    # Retry-After nunca supera max_delay
+    assert policy.backoff(0, FakeResponse(429, headers={'Retry-After': '600'})) == 30.0
+    assert policy.backoff(0, FakeResponse(503, headers={'Retry-After': 'pronto'})) == 0.0
+
+def test_parse_retry_after(batch_processor):
+    assert batch_processor.parse_retry_after('12') == 12.0
+    assert batch_processor.parse_retry_after('-3') == 0.0
+    assert batch_processor.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0  # fecha pasada
+    assert batch_processor.parse_retry_after(None) is None
+    assert batch_processor.parse_retry_after('pronto') is None
+
+def test_retry_budget_scales_with_calls(batch_processor):
+    policy = batch_processor.RetryPolicy(budget_ratio=0.1, min_budget=2)
+
+    spent = [policy.try_spend_retry() for _ in range(3)]
+    assert spent == [True, True, False]
+
+    for _ in range(20):
+        policy.record_call()
+    # 2 + 20 * 0.1 = 4 reintentos en total
+    assert [policy.try_spend_retry() for _ in range(3)] == [True, True, False]
+    assert policy.summary()["retries"] == 4
+    assert policy.summary()["retry_ratio"] == 0.2
+
+def test_trigger_transcription_retries_transient_failures(batch_processor, monkeypatch):
+    responses = [FakeResponse(503), FakeResponse(200, {"success": True})]
+    monkeypatch.setattr(batch_processor, 'post_json', lambda url, payload, read_timeout: responses.pop(0))
+    monkeypatch.setattr(batch_processor, 'get_circuit_breaker', lambda name: OpenBreaker())
+    monkeypatch.setattr(batch_processor.time, 'sleep', lambda seconds: None)
+    policy = batch_processor.RetryPolicy(max_attempts=3)
+
+    assert batch_processor.trigger_transcription('000123', 'a.wav', '123', retry_policy=policy)
+
+    summary = policy.summary()
+    assert summary["retries"] == 1
+    assert summary["outcomes"] == {"success": 1}
+
+def test_trigger_transcription_stops_when_budget_is_spent(batch_processor, monkeypatch):
+    calls = []
+    monkeypatch.setattr(batch_processor, 'post_json', lambda url, payload, read_timeout: calls.append(url) or FakeResponse(502))
+    monkeypatch.setattr(batch_processor, 'get_circuit_breaker', lambda name: OpenBreaker())
+    monkeypatch.setattr(batch_processor.time, 'sleep', lambda seconds: None)
+    policy = batch_processor.RetryPolicy(max_attempts=5, budget_ratio=0.0, min_budget=0)
+
+    assert not batch_processor.trigger_transcription('000123', 'a.wav', '123', retry_policy=policy)
+
+    assert len(calls) == 1
+    assert policy.summary()["outcomes"] == {"budget_exhausted": 1}
+    assert policy.summary()["failure_reasons"] == {"HTTP 502": 1}
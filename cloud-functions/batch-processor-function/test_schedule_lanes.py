@@ -0,0 +1,47 @@
+"""Tests de los carriles fresh/backfill del batch diario"""
+from datetime import datetime, timezone
+
+import pandas as pd
+
+def make_calls(fechas):
+    return pd.DataFrame({
+        "gsutil_url": [f"gs://buckets_llamadas/{n:03d}/a.wav" for n in range(len(fechas))],
+        "N_Doc": [str(n) for n in range(len(fechas))],
+        "Fecha_Llamada": fechas,
+    }).astype("string")
+
+def lanes_by_date(scheduled):
+    return dict(zip(scheduled['Fecha_Llamada'], scheduled['lane']))
+
+def test_registry_dates_are_read_day_first(batch_processor):
+    # 10 de mayo, 21:00 UTC (16:00 en Lima); ventana fresh de 48 h
+    now = datetime(2025, 5, 10, 21, 0, tzinfo=timezone.utc)
+    calls = make_calls(["09/05/2025", "10/04/2025", "01/05/2025 08:00:00", "fecha rota"])
+
+    scheduled = batch_processor.schedule_lanes(calls, fresh_window_hours=48, backfill_share=0.5, now=now)
+
+    lanes = lanes_by_date(scheduled)
+    assert lanes["09/05/2025"] == 'fresh'
+    assert lanes["10/04/2025"] == 'backfill'  # 10 de abril, no 4 de octubre
+    assert lanes["01/05/2025 08:00:00"] == 'backfill'
+    assert lanes["fecha rota"] == 'backfill'
+    # Las ilegibles van al final del backfill
+    assert scheduled['Fecha_Llamada'].iloc[-1] == "fecha rota"
+
+def test_fresh_window_compares_in_call_timezone(batch_processor):
+    # 23:30 en Lima del 10/05 son las 04:30 UTC del 11/05
+    now = datetime(2025, 5, 11, 4, 30, tzinfo=timezone.utc)
+    calls = make_calls(["10/05/2025 20:00:00", "10/05/2025 22:00:00"])
+
+    scheduled = batch_processor.schedule_lanes(calls, fresh_window_hours=3, backfill_share=0.0, now=now)
+
+    # Con hora UTC ingenua la llamada de las 22:00 locales (03:00 UTC) quedaría fuera por 5 h
+    assert lanes_by_date(scheduled) == {"10/05/2025 20:00:00": 'backfill', "10/05/2025 22:00:00": 'fresh'}
+
+def test_fresh_lane_is_fifo_and_shares_capacity(batch_processor):
+    now = datetime(2025, 5, 10, 12, 0, tzinfo=timezone.utc)
+    calls = make_calls(["10/05/2025 06:00:00", "09/05/2025 06:00:00", "01/01/2025", "02/01/2025"])
+
+    scheduled = batch_processor.schedule_lanes(calls, fresh_window_hours=48, backfill_share=0.5, now=now)
+
+    assert list(scheduled['Fecha_Llamada']) == ["09/05/2025 06:00:00", "02/01/2025", "10/05/2025 06:00:00", "01/01/2025"]
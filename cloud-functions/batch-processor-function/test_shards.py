@@ -0,0 +1,150 @@
+"""Tests del reparto en shards y del coordinador con la cola local"""
+import json
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from fakes import FakeStorageClient
+
+def make_calls(count):
+    return pd.DataFrame({
+        "gsutil_url": [f"gs://buckets_llamadas/{n:06d}/audio_{n}.wav" for n in range(count)],
+        "N_Doc": [str(n) for n in range(count)],
+        "Fecha_Llamada": [f"{1 + n % 28:02d}/0{1 + n % 9}/2025" for n in range(count)],
+    }).astype("string")
+
+def test_hash_shards_are_stable_and_cover_all_calls(batch_processor):
+    calls = make_calls(400)
+
+    first = batch_processor.assign_shards(calls, 4)
+    again = batch_processor.assign_shards(calls.iloc[::-1].reset_index(drop=True), 4)[::-1]
+
+    assert set(first) == {0, 1, 2, 3}
+    assert list(first) == list(again)  # depende solo de la URL, no del orden
+    assert min(pd.Series(first).value_counts()) > 60  # reparto razonablemente parejo
+
+def test_date_shards_are_contiguous_and_balanced(batch_processor):
+    calls = make_calls(100)
+
+    shards = batch_processor.assign_shards(calls, 4, shard_by='date')
+
+    assert list(pd.Series(shards).value_counts().sort_index()) == [25, 25, 25, 25]
+    # En orden cronológico (DD/MM/YYYY, no orden de texto) los shards son rangos contiguos
+    by_date = batch_processor.parse_call_dates(calls['Fecha_Llamada']).argsort(kind='stable').to_numpy()
+    assert list(shards[by_date]) == sorted(shards)
+
+@pytest.fixture
+def storage(batch_processor, monkeypatch):
+    client = FakeStorageClient()
+    monkeypatch.setattr(batch_processor, 'get_storage_client', lambda: client)
+    monkeypatch.setattr(batch_processor, 'write_pipeline_metrics', lambda *args, **kwargs: None)
+    return client
+
+def test_local_queue_dispatches_each_call_exactly_once(batch_processor, storage, monkeypatch):
+    calls = make_calls(60)
+    dispatched = []
+    lock = threading.Lock()
+
+    def record_dispatch(url, *args):
+        with lock:
+            dispatched.append(url)
+        return True
+
+    scan = {"mode": "full", "new_calls": len(calls), "checkpoint": {"generation": 1, "byte_offset": 0, "row_count": len(calls)}}
+    monkeypatch.setattr(batch_processor, 'collect_pending_calls', lambda options: {
+        "scan": scan, "pending": calls, "deferred": calls.iloc[0:0], "summary": {"new_calls": len(calls)}
+    })
+    monkeypatch.setattr(batch_processor, 'dispatch_call', record_dispatch)
+
+    response = batch_processor.coordinate_shards({"shards": 3, "task_queue": "local", "max_concurrency": 2})
+
+    assert response['task_queue'] == 'local'
+    assert sum(shard['calls'] for shard in response['shards']) == 60
+    assert sorted(dispatched) == sorted(calls['gsutil_url'])
+    assert response['summary']['processed'] == 60
+    assert response['summary']['shards_completed'] == len(response['shards'])
+    # Los cursores de los shards se consumieron
+    assert storage.list_blobs(batch_processor.CHECKPOINT_BUCKET, prefix=batch_processor.CURSOR_PREFIX) == []
+
+def test_unfinished_shards_stay_in_carry_over(batch_processor, storage, monkeypatch):
+    calls = make_calls(10)
+    scan = {"mode": "full", "new_calls": len(calls), "checkpoint": {"generation": 1, "byte_offset": 0, "row_count": len(calls)}}
+    monkeypatch.setattr(batch_processor, 'collect_pending_calls', lambda options: {
+        "scan": scan, "pending": calls, "deferred": calls.iloc[0:0], "summary": {}
+    })
+
+    class DroppingQueue:
+        """Cola que pierde los workers: nadie consume los cursores"""
+
+        def __init__(self, *args):
+            pass
+
+        def accepts_work(self):
+            return True
+
+        def enqueue(self, payload):
+            pass
+
+        def drain(self):
+            pass
+    monkeypatch.setattr(batch_processor, 'LocalTaskQueue', DroppingQueue)
+
+    batch_processor.coordinate_shards({"shards": 2, "task_queue": "local"})
+
+    checkpoint = json.loads(storage.bucket(batch_processor.CHECKPOINT_BUCKET).blob(batch_processor.CHECKPOINT_PATH).download_as_text())
+    assert {call['gsutil_url'] for call in checkpoint['carry_over']} == set(calls['gsutil_url'])
+
+def test_local_shards_share_the_coordinator_deadline(batch_processor, monkeypatch):
+    budgets = []
+    monkeypatch.setattr(batch_processor, 'process_daily_batch', lambda request: budgets.append(request.get_json()['time_budget_seconds']))
+
+    queue = batch_processor.LocalTaskQueue(2, deadline=time.monotonic() + 100)
+    queue.enqueue({"shard": 0, "time_budget_seconds": 480})
+    queue.enqueue({"shard": 1, "time_budget_seconds": 60})
+    queue.drain()
+
+    assert sorted(budgets)[0] == 60
+    assert 90 < sorted(budgets)[1] <= 100  # recortado al tiempo que le queda al coordinador
+
+def test_coordinator_stops_queuing_shards_without_time_left(batch_processor, storage, monkeypatch):
+    calls = make_calls(10)
+    scan = {"mode": "full", "new_calls": len(calls), "checkpoint": {"generation": 1, "byte_offset": 0, "row_count": len(calls)}}
+    monkeypatch.setattr(batch_processor, 'collect_pending_calls', lambda options: {
+        "scan": scan, "pending": calls, "deferred": calls.iloc[0:0], "summary": {}
+    })
+    monkeypatch.setattr(batch_processor, 'process_daily_batch', lambda request: pytest.fail("no debe ejecutar shards"))
+
+    started = time.monotonic() - batch_processor.TIME_BUDGET_SECONDS + batch_processor.MIN_ATTEMPT_SECONDS / 2
+    response = batch_processor.coordinate_shards({"shards": 2, "task_queue": "local"}, started)
+
+    assert response['shards'] == []
+    # Sin cursores: las llamadas siguen en el carry_over para la próxima ejecución
+    assert storage.list_blobs(batch_processor.CHECKPOINT_BUCKET, prefix=batch_processor.CURSOR_PREFIX) == []
+    checkpoint = json.loads(storage.bucket(batch_processor.CHECKPOINT_BUCKET).blob(batch_processor.CHECKPOINT_PATH).download_as_text())
+    assert {call['gsutil_url'] for call in checkpoint['carry_over']} == set(calls['gsutil_url'])
+
+def test_cloud_tasks_carry_an_oidc_token(batch_processor, monkeypatch):
+    created = []
+
+    class FakeTasksClient:
+        def create_task(self, request):
+            created.append(request)
+
+    monkeypatch.setattr(batch_processor, 'get_client', lambda name, factory: FakeTasksClient())
+    queue = batch_processor.CloudTasksQueue(
+        queue_path="projects/p/locations/l/queues/q",
+        target_url="https://example.test/process-daily-batch",
+        service_account="batch-invoker@p.iam.gserviceaccount.com"
+    )
+
+    queue.enqueue({"continuation_token": "a" * 32})
+
+    http_request = created[0]['task']['http_request']
+    assert http_request['oidc_token'] == {
+        "service_account_email": "batch-invoker@p.iam.gserviceaccount.com",
+        "audience": "https://example.test/process-daily-batch"
+    }
+    with pytest.raises(ValueError):
+        batch_processor.CloudTasksQueue(service_account='')
@@ -0,0 +1,82 @@
+"""Tests del presupuesto de tiempo y las continuaciones del batch diario"""
+import json
+
+import pytest
+
+from fakes import FakeStorageClient
+
+CALLS = [
+    ("05/05/2025", "gs://buckets_llamadas/001/a.wav", "1"),
+    ("04/05/2025", "gs://buckets_llamadas/002/b.wav", "2"),
+    ("03/05/2025", "gs://buckets_llamadas/003/c.wav", "3"),
+]
+
+@pytest.fixture
+def storage(batch_processor, monkeypatch):
+    client = FakeStorageClient()
+    client.put(batch_processor.CSV_BUCKET, batch_processor.CSV_BLOB_PATH,
+               "Fecha_Llamada,gsutil_url,N_Doc\n" + "".join(f"{fecha},{url},{dni}\n" for fecha, url, dni in CALLS))
+    monkeypatch.setattr(batch_processor, 'get_storage_client', lambda: client)
+    monkeypatch.setattr(batch_processor, 'get_processed_calls', lambda: set())
+    monkeypatch.setattr(batch_processor, 'write_pipeline_metrics', lambda *args, **kwargs: None)
+    return client
+
+def read_checkpoint(batch_processor, storage):
+    blob = storage.bucket(batch_processor.CHECKPOINT_BUCKET).blob(batch_processor.CHECKPOINT_PATH)
+    return json.loads(blob.download_as_text())
+
+def test_undispatched_calls_stay_in_checkpoint_carry_over(batch_processor, storage, monkeypatch):
+    dispatched = []
+    monkeypatch.setattr(batch_processor, 'dispatch_call', lambda url, *args: dispatched.append(url) or True)
+    options = {"pending_mode": "python", "dedup": False, "full_scan": True, "time_budget_seconds": 0.001}
+
+    response = batch_processor.process_daily_batch(batch_processor.LocalRequest(options))
+
+    # Siempre se despacha al menos una; el resto queda en el cursor y en el checkpoint
+    assert dispatched == ["gs://buckets_llamadas/001/a.wav"]
+    assert response['remaining_pending'] == 2
+    assert response['continuation_token']
+    carry_over = {call['gsutil_url'] for call in read_checkpoint(batch_processor, storage)['carry_over']}
+    assert carry_over == {"gs://buckets_llamadas/002/b.wav", "gs://buckets_llamadas/003/c.wav"}
+
+    # Sin consumir el token, la siguiente ejecución (CSV sin cambios) las retoma del carry_over
+    monkeypatch.setattr(batch_processor, 'get_processed_calls', lambda: {"gs://buckets_llamadas/001/a.wav"})
+    collected = batch_processor.collect_pending_calls({"pending_mode": "python", "dedup": False})
+    assert collected['summary']['scan_mode'] == 'unchanged'
+    assert set(collected['pending']['gsutil_url']) == carry_over
+
+def test_processed_carry_over_is_cleared(batch_processor, storage, monkeypatch):
+    monkeypatch.setattr(batch_processor, 'dispatch_call', lambda url, *args: True)
+    options = {"pending_mode": "python", "dedup": False, "full_scan": True, "time_budget_seconds": 0.001}
+    batch_processor.process_daily_batch(batch_processor.LocalRequest(options))
+
+    # Una continuación procesó el resto: la próxima ejecución no las vuelve a despachar
+    monkeypatch.setattr(batch_processor, 'get_processed_calls', lambda: {url for _, url, _ in CALLS})
+    response = batch_processor.process_daily_batch(batch_processor.LocalRequest({"pending_mode": "python", "dedup": False}))
+
+    assert response['pending_calls'] == 0
+    assert read_checkpoint(batch_processor, storage)['carry_over'] == []
+
+def test_read_timeout_is_capped_by_deadline(batch_processor, monkeypatch):
+    timeouts = []
+
+    class Response:
+        status_code = 200
+        headers = {}
+
+        def json(self):
+            return {"success": True}
+
+    monkeypatch.setattr(batch_processor.time, 'monotonic', lambda: 1000.0)
+    monkeypatch.setattr(batch_processor, 'post_json', lambda url, payload, read_timeout: timeouts.append(read_timeout) or Response())
+
+    assert batch_processor.trigger_transcription('001', 'a.wav', '1', deadline=1100.0)
+    assert timeouts == [100.0 - batch_processor.HTTP_CONNECT_TIMEOUT]
+
+def test_no_attempt_starts_without_time_left(batch_processor, monkeypatch):
+    monkeypatch.setattr(batch_processor.time, 'monotonic', lambda: 1000.0)
+    monkeypatch.setattr(batch_processor, 'post_json', lambda *args, **kwargs: pytest.fail("no debe llamar"))
+    policy = batch_processor.RetryPolicy()
+
+    assert not batch_processor.trigger_transcription('001', 'a.wav', '1', retry_policy=policy, deadline=1010.0)
+    assert policy.summary()['outcomes'] == {"deadline": 1}
@@ -0,0 +1,35 @@
+"""
+Fixtures compartidos por los tests de las Cloud Functions
+Cada función tiene su propio main.py, así que se importan con un nombre de módulo único
+
+Uso (con pytest y las dependencias de cada requirements.txt instaladas):
+    cd cloud-functions && python -m pytest -q
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+FUNCTIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Sin precarga de secretos en segundo plano al importar main.py
+os.environ.setdefault('SECRET_PREFETCH', 'false')
+
+def load_function(function_name):
+    """Importar <función>/main.py como <funcion>_main, con su carpeta en sys.path"""
+    module_name = function_name.replace('-', '_') + '_main'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    function_dir = os.path.join(FUNCTIONS_DIR, function_name)
+    if function_dir not in sys.path:
+        sys.path.insert(0, function_dir)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(function_dir, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture(scope='session')
+def batch_processor():
+    return load_function('batch-processor-function')
@@ -0,0 +1,121 @@
+"""
+Cloud Function - Índice de DNI para transcription-function
+Se ejecuta cuando se actualiza registro_llamadas.csv y publica un índice binario compacto
+gsutil_url -> (N_Doc, Fecha_Llamada) que se consulta con lecturas por rango, sin pandas
+"""
+import functions_framework
+import hashlib
+import numpy as np
+import pandas as pd
+import logging
+import struct
+from google.cloud import storage
+from registro_csv import CSV_COLUMNS, iter_csv_batches, parse_call_dates
+from clients import get_client
+
+PROJECT_ID = "peak-emitter-350713"
+CSV_BUCKET = "buckets_llamadas"
+CSV_BLOB_PATH = "0000000000000000/registro_llamadas.csv"
+
+# Formato del índice (mismo layout que lee transcription-function):
+#   cabecera | directorio uint32[2^bits + 1] | registros ordenados por hash
+#   registro = hash blake2b de 64 bits del gsutil_url, N_Doc (24 bytes), fecha epoch (int64, -1 si falta)
+DNI_INDEX_BUCKET = "maqui-pipeline-transcripciones"
+DNI_INDEX_PATH = "indices/registro_llamadas_dni.idx"
+DNI_INDEX_MAGIC = b'DNIX'
+DNI_INDEX_VERSION = 1
+DNI_INDEX_HEADER = struct.Struct('<4sHHQQ')  # magic, versión, bits, registros, generación del CSV
+DNI_INDEX_RECORD = np.dtype([('hash', '<u8'), ('dni', 'S24'), ('fecha', '<i8')])
+DNI_INDEX_BUCKET_TARGET = 64  # registros promedio por bucket del directorio (~2.5 KB por lectura)
+DNI_INDEX_MAX_BITS = 20
+DNI_INDEX_PUBLISH_ATTEMPTS = 3
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def get_storage_client():
+    """Cliente Cloud Storage compartido"""
+    return get_client('storage', lambda: storage.Client(project=PROJECT_ID))
+
+@functions_framework.cloud_event
+def build_dni_index(cloud_event):
+    """
+    Trigger de Cloud Storage (object.finalize en buckets_llamadas)
+    Solo reconstruye el índice cuando el objeto finalizado es registro_llamadas.csv
+    """
+    data = cloud_event.data
+    if data.get('name') != CSV_BLOB_PATH:
+        return
+
+    generation = int(data.get('generation', 0))
+    logger.info(f"🗂️ CSV actualizado (generación {generation}), reconstruyendo índice de DNI")
+    publish_dni_index(generation)
+
+def audio_url_hash(audio_url):
+    """Hash estable de 64 bits de un audio_url (mismo cálculo en transcription-function)"""
+    return int.from_bytes(hashlib.blake2b(audio_url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def build_index_bytes(calls_df, csv_generation):
+    """Serializar las llamadas al formato del índice; la última aparición de cada URL gana"""
+    calls_df = calls_df.drop_duplicates(subset=['gsutil_url'], keep='last')
+    count = len(calls_df)
+
+    records = np.empty(count, dtype=DNI_INDEX_RECORD)
+    records['hash'] = np.fromiter((audio_url_hash(url) for url in calls_df['gsutil_url']), dtype='<u8', count=count)
+    records['dni'] = calls_df['N_Doc'].str.slice(0, 24).str.encode('utf-8').to_numpy(dtype='S24')
+    # DD/MM/YYYY en hora local de la central; se guarda la hora local (transcription-function la lee sin zona)
+    fechas = parse_call_dates(calls_df['Fecha_Llamada']).dt.tz_localize(None)
+    records['fecha'] = np.where(fechas.isna(), -1, fechas.to_numpy(dtype='datetime64[s]').astype('<i8'))
+    records.sort(order='hash', kind='stable')
+
+    # Directorio por los bits altos del hash: cada lookup lee solo su bucket
+    bits = 0
+    while bits < DNI_INDEX_MAX_BITS and count > DNI_INDEX_BUCKET_TARGET * (1 << bits):
+        bits += 1
+    bucket_ids = records['hash'] >> np.uint64(64 - bits) if bits else np.zeros(count, dtype='<u8')
+    directory = np.searchsorted(bucket_ids, np.arange((1 << bits) + 1, dtype='<u8')).astype('<u4')
+
+    header = DNI_INDEX_HEADER.pack(DNI_INDEX_MAGIC, DNI_INDEX_VERSION, bits, count, csv_generation)
+    return header + directory.tobytes() + records.tobytes(), bits, count
+
+def publish_dni_index(csv_generation=None):
+    """Leer el CSV (fijado a su generación) y publicar el índice con sus parámetros en los metadatos"""
+    storage_client = get_storage_client()
+    csv_blob = storage_client.bucket(CSV_BUCKET).get_blob(CSV_BLOB_PATH, generation=csv_generation)
+    if csv_blob is None:
+        logger.error(f"❌ CSV no encontrado: gs://{CSV_BUCKET}/{CSV_BLOB_PATH} (generación {csv_generation})")
+        return None
+
+    frames = list(iter_csv_batches(csv_blob))
+    calls_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=list(CSV_COLUMNS)).astype(CSV_COLUMNS)
+    payload, bits, count = build_index_bytes(calls_df, csv_blob.generation)
+
+    index_bucket = storage_client.bucket(DNI_INDEX_BUCKET)
+    for attempt in range(DNI_INDEX_PUBLISH_ATTEMPTS):
+        # Un evento tardío de una generación anterior del CSV no pisa un índice más nuevo
+        current = index_bucket.get_blob(DNI_INDEX_PATH)
+        current_csv_generation = int(((current.metadata if current else None) or {}).get('csv_generation', 0))
+        if current_csv_generation > csv_blob.generation:
+            logger.info(f"⏭️ El índice ya es de la generación {current_csv_generation}, se descarta la {csv_blob.generation}")
+            return None
+
+        index_blob = index_bucket.blob(DNI_INDEX_PATH)
+        # transcription-function valida que el índice corresponda a la generación vigente del CSV
+        index_blob.metadata = {
+            "csv_generation": str(csv_blob.generation),
+            "bucket_bits": str(bits),
+            "record_count": str(count),
+            "format_version": str(DNI_INDEX_VERSION)
+        }
+        try:
+            # Solo si nadie publicó entre la lectura y la escritura (0: el índice aún no existe)
+            index_blob.upload_from_string(payload, content_type='application/octet-stream',
+                                          if_generation_match=current.generation if current else 0)
+            break
+        except Exception as e:
+            logger.warning(f"⚠️ Índice modificado en paralelo (intento {attempt + 1}), se vuelve a comparar: {str(e)}")
+    else:
+        logger.error(f"❌ No se pudo publicar el índice de la generación {csv_blob.generation}")
+        return None
+    logger.info(f"✅ Índice de DNI publicado: {count} llamadas, {len(payload) / 1024 / 1024:.1f} MB, {1 << bits} buckets")
+    return {"csv_generation": csv_blob.generation, "records": count, "bucket_bits": bits, "bytes": len(payload)}
@@ -0,0 +1,67 @@
+"""Tests del índice de DNI publicado para transcription-function"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import load_function
+
+@pytest.fixture(scope='module')
+def dni_index_builder():
+    return load_function('dni-index-builder')
+
+def read_records(module, payload, bits):
+    offset = module.DNI_INDEX_HEADER.size + 4 * ((1 << bits) + 1)
+    return np.frombuffer(payload[offset:], dtype=module.DNI_INDEX_RECORD)
+
+def test_call_dates_are_read_day_first_as_local_time(dni_index_builder):
+    calls = pd.DataFrame({
+        "gsutil_url": ["gs://buckets_llamadas/001/a.wav", "gs://buckets_llamadas/002/b.wav"],
+        "N_Doc": ["1", "2"],
+        "Fecha_Llamada": ["10/04/2025 09:30:00", "fecha rota"],
+    }).astype("string")
+
+    payload, bits, count = dni_index_builder.build_index_bytes(calls, 7)
+
+    fechas = sorted(int(fecha) for fecha in read_records(dni_index_builder, payload, bits)['fecha'])
+    assert count == 2
+    assert fechas[0] == -1
+    assert datetime.utcfromtimestamp(fechas[1]) == datetime(2025, 4, 10, 9, 30)  # 10 de abril, hora de la central
+
+def test_other_objects_in_the_bucket_are_ignored(dni_index_builder, monkeypatch):
+    monkeypatch.setattr(dni_index_builder, 'publish_dni_index', lambda generation: pytest.fail("no debe reconstruir"))
+    event = type('CloudEvent', (), {"data": {"name": "001/audio.wav", "generation": "3"}})()
+
+    assert dni_index_builder.build_dni_index(event) is None
+
+@pytest.fixture
+def storage(dni_index_builder, monkeypatch):
+    from fakes import FakeStorageClient
+    client = FakeStorageClient()
+    monkeypatch.setattr(dni_index_builder, 'get_storage_client', lambda: client)
+    return client
+
+def publish_csv(module, storage, dni):
+    storage.put(module.CSV_BUCKET, module.CSV_BLOB_PATH, f"Fecha_Llamada,gsutil_url,N_Doc\n10/04/2025,gs://buckets_llamadas/001/a.wav,{dni}\n")
+    return storage.bucket(module.CSV_BUCKET).get_blob(module.CSV_BLOB_PATH).generation
+
+def index_generation(module, storage):
+    return int(storage.bucket(module.DNI_INDEX_BUCKET).get_blob(module.DNI_INDEX_PATH).metadata['csv_generation'])
+
+def test_newer_generation_replaces_the_index(dni_index_builder, storage):
+    first = publish_csv(dni_index_builder, storage, "1")
+    dni_index_builder.publish_dni_index(first)
+    second = publish_csv(dni_index_builder, storage, "2")
+
+    assert dni_index_builder.publish_dni_index(second)['csv_generation'] == second
+    assert index_generation(dni_index_builder, storage) == second
+
+def test_late_event_for_an_older_generation_keeps_the_newer_index(dni_index_builder, storage):
+    generation = publish_csv(dni_index_builder, storage, "1")
+    index = storage.bucket(dni_index_builder.DNI_INDEX_BUCKET).blob(dni_index_builder.DNI_INDEX_PATH)
+    index.metadata = {"csv_generation": str(generation + 100)}
+    index.upload_from_string(b'indice-nuevo')
+
+    assert dni_index_builder.publish_dni_index(generation) is None
+    assert storage.bucket(dni_index_builder.DNI_INDEX_BUCKET).blob(dni_index_builder.DNI_INDEX_PATH).download_as_bytes() == b'indice-nuevo'
@@ -0,0 +1,271 @@
+"""
+Dobles en memoria de Cloud Storage y BigQuery, y un Deepgram local, para los tests de las Cloud Functions
+Implementan solo la parte de la API que usan las funciones
+"""
+import contextlib
+import io
+import itertools
+import json
+import threading
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+_generations = itertools.count(1000)
+
+class FakeBlob:
+    """Vista de un objeto del FakeStorageClient; lee y escribe el estado compartido"""
+    content_type = None
+
+    def __init__(self, bucket, name, generation=None):
+        self.bucket = bucket
+        self.name = name
+        self.pinned_generation = generation
+        self.pending_metadata = None
+
+    @property
+    def metadata(self):
+        if self.pending_metadata is not None:
+            return self.pending_metadata
+        entry = self._entry
+        return entry.get('metadata') if entry else None
+
+    @metadata.setter
+    def metadata(self, value):
+        self.pending_metadata = value
+
+    @property
+    def _entry(self):
+        return self.bucket.objects.get(self.name)
+
+    @property
+    def generation(self):
+        if self.pinned_generation is not None:
+            return self.pinned_generation
+        entry = self._entry
+        return entry['generation'] if entry else None
+
+    @property
+    def size(self):
+        entry = self._entry
+        return len(entry['data']) if entry else None
+
+    def _data(self, if_generation_match=None):
+        entry = self._entry
+        if entry is None:
+            raise NotFound(f"{self.bucket.name}/{self.name}")
+        if self.pinned_generation is not None and entry['generation'] != self.pinned_generation:
+            raise NotFound(f"{self.bucket.name}/{self.name}#{self.pinned_generation}")
+        if if_generation_match is not None and entry['generation'] != if_generation_match:
+            raise PreconditionFailed(f"{self.bucket.name}/{self.name}")
+        self.bucket.client.reads.append(self.name)
+        return entry['data']
+
+    def exists(self):
+        return self._entry is not None
+
+    def reload(self):
+        if self._entry is None:
+            raise NotFound(f"{self.bucket.name}/{self.name}")
+
+    def open(self, mode='rb', chunk_size=None):
+        assert mode == 'rb'
+        return io.BytesIO(self._data())
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None):
+        data = self._data(if_generation_match)
+        start = start or 0
+        return data[start:] if end is None else data[start:end + 1]
+
+    def download_as_text(self, if_generation_match=None):
+        return self.download_as_bytes(if_generation_match=if_generation_match).decode('utf-8')
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):
+        with self.bucket.client.lock:
+            entry = self._entry
+            current = entry['generation'] if entry else 0
+            if if_generation_match is not None and current != if_generation_match:
+                raise PreconditionFailed(f"{self.bucket.name}/{self.name}")
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            self.bucket.objects[self.name] = {"data": bytes(data), "generation": next(_generations),
+                                              "metadata": self.pending_metadata}
+
+    def delete(self, if_generation_match=None):
+        with self.bucket.client.lock:
+            entry = self._entry
+            if entry is None:
+                raise NotFound(f"{self.bucket.name}/{self.name}")
+            if if_generation_match is not None and entry['generation'] != if_generation_match:
+                raise PreconditionFailed(f"{self.bucket.name}/{self.name}")
+            del self.bucket.objects[self.name]
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.objects = {}
+
+    def blob(self, name, generation=None):
+        return FakeBlob(self, name, generation)
+
+    def get_blob(self, name, generation=None):
+        if name not in self.objects:
+            return None
+        if generation is not None and self.objects[name]['generation'] != generation:
+            return None
+        return FakeBlob(self, name, generation)
+
+class FakeStorageClient:
+    """Buckets en memoria con generaciones y precondiciones como en GCS"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.reads = []
+        self.lock = threading.RLock()
+
+    def bucket(self, name):
+        with self.lock:
+            if name not in self.buckets:
+                self.buckets[name] = FakeBucket(self, name)
+            return self.buckets[name]
+
+    def put(self, bucket_name, blob_name, data):
+        self.bucket(bucket_name).blob(blob_name).upload_from_string(data)
+
+    def list_blobs(self, bucket_name, prefix=''):
+        bucket = self.bucket(bucket_name)
+        return [FakeBlob(bucket, name) for name in sorted(bucket.objects) if name.startswith(prefix)]
+
+    @contextlib.contextmanager
+    def batch(self):
+        yield
+
+class FakeQueryJob:
+    def __init__(self, frame):
+        self.frame = frame
+
+    def result(self):
+        return self
+
+    def __iter__(self):
+        return iter([] if self.frame is None else self.frame.to_dict('records'))
+
+    def to_dataframe(self):
+        return self.frame
+
+class FakeBigQueryClient:
+    """Registra queries, load jobs e inserts; las respuestas de query las decide el test"""
+
+    def __init__(self, query_results=None):
+        self.query_results = query_results or (lambda sql: None)
+        self.queries = []
+        self.loads = []
+        self.deleted = []
+        self.inserted = []
+        self.lock = threading.Lock()
+
+    def query(self, sql, job_config=None):
+        with self.lock:
+            self.queries.append(sql)
+        return FakeQueryJob(self.query_results(sql))
+
+    def load_table_from_dataframe(self, frame, table_id, job_config=None):
+        with self.lock:
+            self.loads.append((table_id, frame.copy(), job_config))
+        return FakeQueryJob(None)
+
+    def get_table(self, table_id):
+        return type('Table', (), {"table_id": table_id, "expires": None})()
+
+    def update_table(self, table, fields):
+        return table
+
+    def delete_table(self, table_id, not_found_ok=False):
+        with self.lock:
+            self.deleted.append(table_id)
+
+    def insert_rows_json(self, table, rows, **kwargs):
+        with self.lock:
+            self.inserted.append((table, list(rows)))
+        return []
+
+class FakeDeepgramServer:
+    """
+    Servidor HTTP local que imita el endpoint /v1/listen de Deepgram en modo callback
+    Acepta la subida del audio (chunked), responde el request_id y luego hace POST del
+    resultado (callback_payload) a la URL de callback, deliveries veces y en orden
+    """
+
+    def __init__(self, callback_payload=None, deliveries=1):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.callback_payload = callback_payload
+        self.deliveries = deliveries
+        self.rewrite_callback = lambda url: url
+        self.uploads = []
+        self.callbacks = []  # (status_code, cuerpo JSON) de cada entrega
+        self.done = threading.Event()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                from urllib.parse import parse_qs, urlparse
+                params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                audio = read_chunked(self.rfile) if self.headers.get('Transfer-Encoding') == 'chunked' \
+                    else self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                request_id = f"req-{len(server.uploads) + 1}"
+                server.uploads.append({"params": params, "audio": audio, "headers": dict(self.headers)})
+                body = json.dumps({"request_id": request_id}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                if params.get('callback'):
+                    threading.Thread(target=server._deliver, args=(params['callback'], request_id), daemon=True).start()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1/listen"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def _deliver(self, callback_url, request_id):
+        import requests
+        payload = dict(self.callback_payload or transcript_payload())
+        payload.setdefault('metadata', {})
+        payload['metadata'] = {**payload['metadata'], "request_id": request_id}
+        try:
+            for _ in range(self.deliveries):
+                response = requests.post(self.rewrite_callback(callback_url), json=payload, timeout=10)
+                self.callbacks.append((response.status_code, response.json()))
+        finally:
+            self.done.set()
+
+    def wait(self, timeout=10):
+        """Esperar a que terminen las entregas del callback"""
+        assert self.done.wait(timeout), "Deepgram no entregó el callback"
+        return self.callbacks
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def read_chunked(stream):
+    """Cuerpo de un request con Transfer-Encoding: chunked"""
+    data = bytearray()
+    while True:
+        size = int(stream.readline().split(b';')[0].strip(), 16)
+        if size == 0:
+            stream.readline()
+            return bytes(data)
+        data += stream.read(size)
+        stream.readline()
+
+def transcript_payload(text="buenos días, le habla su asesor", duration=42.0):
+    """Resultado de Deepgram con una transcripción"""
+    return {
+        "metadata": {"duration": duration},
+        "results": {"channels": [{"alternatives": [{"transcript": text, "confidence": 0.93}]}]}
+    }
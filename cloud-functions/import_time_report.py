@@ -0,0 +1,137 @@
+"""
+Reporte de tiempo de import (cold start) de las Cloud Functions
+Ejecuta `python -X importtime -c "import main"` en cada función, en un proceso nuevo,
+y compara el costo acumulado contra un presupuesto por función.
+
+Uso (con las dependencias de cada requirements.txt instaladas):
+    python cloud-functions/import_time_report.py [--runs 5] [--only transcription-function]
+
+Sale con código 1 si alguna función excede su presupuesto o carga un módulo que debe ser
+diferido, y con código 2 si alguna función no se puede importar.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+FUNCTIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Presupuesto en ms del import de main.py de cada función (runtime python311)
+IMPORT_BUDGETS_MS = {
+    "transcription-function": 900,
+    "quality-analysis-function": 800,
+    "batch-processor-function": 1500,
+    "batch-analysis-trigger": 800,
+    "dni-index-builder": 1200,
+}
+
+# Módulos que no deben cargarse al importar main.py (se importan dentro de la función que los usa)
+DEFERRED_MODULES = {
+    "transcription-function": ["pandas", "deepgram", "google.cloud.secretmanager", "google.cloud.pubsub_v1"],
+    "quality-analysis-function": ["deepgram", "openai", "google.cloud.secretmanager", "google.cloud.storage"],
+    "batch-processor-function": ["google.cloud.tasks_v2"],
+    "batch-analysis-trigger": [],
+    "dni-index-builder": [],
+}
+
+TOP_IMPORTS = 5
+
+def parse_importtime(stderr):
+    """
+    Parsear la salida de -X importtime a filas (módulo, profundidad, self_us, cumulative_us)
+    La profundidad sale de la indentación del nombre del módulo
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # Cabecera "self [us] | cumulative | imported package"
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(parts[0]), int(parts[1])))
+    return rows
+
+def measure(function_name):
+    """Importar main.py de una función en un proceso nuevo y retornar (filas, error)"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=os.path.join(FUNCTIONS_DIR, function_name),
+        capture_output=True,
+        text=True,
+        # Sin la precarga de secretos: su hilo importa Secret Manager en paralelo al import de main
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1", "SECRET_PREFETCH": "false"}
+    )
+    if result.returncode != 0:
+        last_line = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}"
+        return None, last_line
+    return parse_importtime(result.stderr), None
+
+def summarize(rows):
+    """Total del import de main, imports directos más pesados y módulos cargados"""
+    main_index = next((index for index, row in enumerate(rows) if row[0] == 'main' and row[1] == 0), None)
+    if main_index is None:
+        total_us = sum(row[3] for row in rows if row[1] == 0)
+        subtree = rows
+    else:
+        total_us = rows[main_index][3]
+        # El subárbol de main son las filas anidadas inmediatamente anteriores a main
+        start = main_index
+        while start > 0 and rows[start - 1][1] > 0:
+            start -= 1
+        subtree = rows[start:main_index]
+    direct = sorted((row for row in subtree if row[1] == 1), key=lambda row: row[3], reverse=True)
+    return {
+        "total_ms": total_us / 1000.0,
+        "top": [(name, cumulative / 1000.0) for name, _, _, cumulative in direct[:TOP_IMPORTS]],
+        "modules": {row[0] for row in rows}
+    }
+
+def report(function_names, runs):
+    """Imprimir la tabla del reporte y retornar el código de salida"""
+    exit_code = 0
+    print(f"| función | import (ms, mediana de {runs}) | presupuesto (ms) | estado | imports más pesados |")
+    print("|---|---:|---:|---|---|")
+
+    for function_name in function_names:
+        budget = IMPORT_BUDGETS_MS[function_name]
+        samples = []
+        error = None
+        summary = None
+        for _ in range(runs):
+            rows, error = measure(function_name)
+            if error:
+                break
+            summary = summarize(rows)
+            samples.append(summary['total_ms'])
+
+        if error:
+            print(f"| {function_name} | - | {budget} | ERROR: {error} | |")
+            exit_code = max(exit_code, 2)
+            continue
+
+        total_ms = statistics.median(samples)
+        eager = [module for module in DEFERRED_MODULES[function_name] if module in summary['modules']]
+        status = "OK"
+        if total_ms > budget:
+            status = "EXCEDE PRESUPUESTO"
+            exit_code = max(exit_code, 1)
+        if eager:
+            status = f"{status}; carga al inicio: {', '.join(eager)}" if status != "OK" else f"carga al inicio: {', '.join(eager)}"
+            exit_code = max(exit_code, 1)
+        top = ", ".join(f"{name} {ms:.0f}" for name, ms in summary['top'])
+        print(f"| {function_name} | {total_ms:.0f} | {budget} | {status} | {top} |")
+
+    return exit_code
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de import de las Cloud Functions contra su presupuesto")
+    parser.add_argument('--runs', type=int, default=5, help="importaciones por función (se reporta la mediana)")
+    parser.add_argument('--only', action='append', choices=sorted(IMPORT_BUDGETS_MS), help="medir solo esta función")
+    args = parser.parse_args()
+    sys.exit(report(args.only or sorted(IMPORT_BUDGETS_MS), max(1, args.runs)))
+
+if __name__ == '__main__':
+    main()
@@ -3,21 +3,34 @@ Cloud Function de Prueba - Procesamiento de Calidad de Llamadas
 Procesa un audio específico usando Deepgram + OpenAI y guarda en BigQuery
 """
 import functions_framework
+import base64
 import os
+import gzip
 import json
 import logging
-from google.cloud import bigquery, storage, secretmanager
-from deepgram import DeepgramClient, PrerecordedOptions
-from openai import OpenAI
-from datetime import datetime, timedelta
-import requests
+import threading
+import time
+import uuid
+from google.cloud import bigquery
+from datetime import datetime
+from clients import get_client
+from secret_cache import SecretCache
+from url_signer import UrlSigner
+from pipeline_metrics import PipelineMetrics, write_pipeline_metrics
 
 # Configuración
 PROJECT_ID = "peak-emitter-350713"
 DATASET_ID = "Calidad_Llamadas"
+METRICS_TABLE = f"{PROJECT_ID}.{DATASET_ID}.metricas_pipeline"
 BUCKET_PIPELINE = "maqui-pipeline-transcripciones"
 BUCKET_AUDIOS = "buckets_llamadas"
 
+# Consumidor de la cola de análisis: métricas acumuladas por instancia y ventana horaria
+QUEUE_METRICS_FLUSH_SECONDS = float(os.environ.get('QUEUE_METRICS_FLUSH_SECONDS', 60))
+INSTANCE_ID = uuid.uuid4().hex[:8]
+_queue_metrics = {"run_id": None, "metrics": None, "flushed_at": 0.0}
+_queue_metrics_lock = threading.Lock()
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,16 +41,44 @@ def json_datetime_handler(obj):
         return obj.isoformat()
     return str(obj)
 
-def get_secret_value(secret_id, project_id=PROJECT_ID):
-    """Obtener secreto desde Google Cloud Secret Manager"""
-    try:
-        client = secretmanager.SecretManagerServiceClient()
-        name = f"projects/{project_id}/secrets/{secret_id}/versions/latest"
-        response = client.access_secret_version(request={"name": name})
-        return response.payload.data.decode("UTF-8").strip()
-    except Exception as e:
-        logger.error(f"Error obteniendo secreto {secret_id}: {e}")
+def get_bigquery_client():
+    """Cliente BigQuery compartido"""
+    return get_client('bigquery', lambda: bigquery.Client(project=PROJECT_ID))
+
+def get_storage_client():
+    """Cliente Cloud Storage compartido (import diferido)"""
+    def create():
+        from google.cloud import storage
+        return storage.Client(project=PROJECT_ID)
+    return get_client('storage', create)
+
+def get_deepgram_client(api_key):
+    """Cliente Deepgram compartido por API key (una key rotada crea un cliente nuevo)"""
+    def create():
+        from deepgram import DeepgramClient
+        return DeepgramClient(api_key)
+    return get_client(('deepgram', api_key), create)
+
+def get_openai_client(api_key):
+    """Cliente OpenAI compartido por API key (una key rotada crea un cliente nuevo)"""
+    def create():
+        from openai import OpenAI
+        return OpenAI(api_key=api_key)
+    return get_client(('openai', api_key), create)
+
+def get_request_json(request):
+    """Leer el JSON del request, aceptando cuerpos comprimidos con gzip"""
+    if request is None:
         return None
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        return json.loads(gzip.decompress(request.get_data()))
+    return request.get_json(silent=True)
+
+_secret_cache = SecretCache(PROJECT_ID)
+
+def get_secret_value(secret_id):
+    """Obtener secreto desde la caché de la instancia (Secret Manager solo al vencer el TTL)"""
+    return _secret_cache.get(secret_id)
 
 @functions_framework.http
 def analyze_quality(request):
@@ -46,10 +87,10 @@ def analyze_quality(request):
     Puede recibir parámetros específicos o procesar transcripciones pendientes
     """
     try:
-        bigquery_client = bigquery.Client(project=PROJECT_ID)
+        bigquery_client = get_bigquery_client()
 
         # Verificar si se recibieron parámetros específicos
-        request_json = request.get_json() if request else None
+        request_json = get_request_json(request)
 
         if request_json and all(key in request_json for key in ['dni', 'transcription']):
             # Modo específico: analizar transcripción específica
@@ -83,6 +124,8 @@ def analyze_quality(request):
                     "categoria": analysis_result.get('categoria'),
                     "puntuacion_total": analysis_result.get('puntuacion_total'),
                     "conformidad": analysis_result.get('conformidad'),
+                    "cost_usd": analysis_result.get('cost_usd', 0.0),
+                    "processing_seconds": analysis_result.get('processing_seconds'),
                     "message": f"Análisis completado para {dni}"
                 }
             else:
@@ -95,6 +138,7 @@ def analyze_quality(request):
             logger.info(f"📊 Analizando {len(pending_transcriptions)} transcripciones pendientes")
 
             processed_count = 0
+            metrics = PipelineMetrics('quality-analysis')
             for transcription in pending_transcriptions:
                 try:
                     # Obtener datos de validación
@@ -122,14 +166,20 @@ def analyze_quality(request):
                             transcription.get('transcripcion_id', None)
                         )
                         processed_count += 1
+                        metrics.record_analysis(True, analysis_result.get('processing_seconds'), analysis_result.get('cost_usd', 0.0))
                         logger.info(f"✅ Análisis completado: {transcription['dni']} - {analysis_result.get('categoria', 'N/A')}")
                     else:
+                        metrics.record_analysis(False)
                         logger.error(f"❌ Error analizando {transcription['dni']}: {analysis_result.get('error', 'Unknown')}")
 
                 except Exception as e:
+                    metrics.record_analysis(False)
                     logger.error(f"❌ Error procesando transcripción {transcription.get('dni', 'unknown')}: {str(e)}")
                     continue
 
+            # Un único MERGE con los agregados de esta ejecución
+            write_pipeline_metrics(get_bigquery_client, METRICS_TABLE, metrics, f"analysis-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}")
+
             return {
                 "success": True,
                 "processed": processed_count,
@@ -141,6 +191,71 @@ def analyze_quality(request):
         logger.error(f"❌ Error en análisis de calidad: {str(e)}")
         return {"error": str(e)}, 500
 
+@functions_framework.cloud_event
+def consume_analysis_request(cloud_event):
+    """
+    Consumidor de la cola de análisis (trigger Pub/Sub publicado por transcribe-audio)
+    Mensaje: {"dni", "transcription", "transcripcion_id", "fecha_llamada"}
+    Los fallos del análisis se relanzan para que Pub/Sub reintente; los mensajes inválidos o duplicados se confirman
+    """
+    message = (cloud_event.data or {}).get('message', {})
+    message_id = message.get('messageId') or message.get('message_id')
+    try:
+        payload = json.loads(base64.b64decode(message.get('data', '')).decode('utf-8'))
+    except Exception as e:
+        logger.error(f"❌ Mensaje de análisis inválido {message_id}: {str(e)}")
+        return
+
+    dni = payload.get('dni')
+    transcription_text = payload.get('transcription')
+    transcripcion_id = payload.get('transcripcion_id')
+    if not dni or not transcription_text:
+        logger.error(f"❌ Mensaje de análisis {message_id} sin dni o transcription")
+        return
+
+    bigquery_client = get_bigquery_client()
+
+    # Pub/Sub entrega al menos una vez: no repetir un análisis ya guardado
+    if transcripcion_id and analysis_exists(bigquery_client, transcripcion_id):
+        logger.info(f"⏭️ Análisis de {transcripcion_id} ya registrado, mensaje {message_id} duplicado")
+        return
+
+    logger.info(f"📊 Analizando transcripción encolada para DNI: {dni} (mensaje {message_id})")
+    fecha_llamada = payload.get('fecha_llamada') or get_fecha_from_transcription(bigquery_client, dni, transcripcion_id)
+    validation_data = get_validation_data(bigquery_client, dni, fecha_llamada)
+    analysis_result = analyze_quality_with_openai(transcription_text, dni, fecha_llamada, validation_data)
+
+    if not analysis_result['success']:
+        record_queue_analysis(False)
+        raise RuntimeError(f"Error analyzing {dni}: {analysis_result.get('error')}")
+
+    if not save_analysis_to_bigquery(bigquery_client, analysis_result, dni, fecha_llamada, transcripcion_id):
+        # Sin relanzar, Pub/Sub confirmaría el mensaje y el análisis se perdería
+        record_queue_analysis(False)
+        raise RuntimeError(f"Error saving analysis for {dni}")
+    record_queue_analysis(True, analysis_result.get('processing_seconds'), analysis_result.get('cost_usd', 0.0))
+    logger.info(f"✅ Análisis encolado completado: {dni} - {analysis_result.get('categoria', 'N/A')}")
+
+def analysis_exists(client, transcripcion_id):
+    """
+    Si ya hay un análisis guardado para la transcripción
+    Los errores de BigQuery se relanzan: Pub/Sub reentrega el mensaje en vez de repetir el análisis con OpenAI
+    """
+    query = f"""
+    SELECT 1
+    FROM `{PROJECT_ID}.{DATASET_ID}.analisis_calidad`
+    WHERE transcripcion_id = @transcripcion_id
+    LIMIT 1
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("transcripcion_id", "STRING", str(transcripcion_id))
+    ])
+    try:
+        return bool(list(client.query(query, job_config=job_config).result()))
+    except Exception as e:
+        logger.error(f"❌ No se pudo verificar análisis previo de {transcripcion_id}: {str(e)}")
+        raise
+
 def get_fecha_from_transcription(client, dni, transcripcion_id=None):
     """Obtener fecha de llamada desde la transcripción"""
     try:
@@ -223,6 +338,9 @@ def get_pending_transcriptions(client):
 def transcribe_with_deepgram(audio_path, dni, fecha_llamada):
     """Transcribir audio usando Deepgram"""
     try:
+        # El análisis no transcribe en el camino normal: el SDK solo se carga aquí
+        from deepgram import PrerecordedOptions
+
         # Intentar obtener desde variables de entorno o Secret Manager
         deepgram_api_key = os.environ.get('DEEPGRAM_API_KEY')
         if not deepgram_api_key:
@@ -233,7 +351,7 @@ def transcribe_with_deepgram(audio_path, dni, fecha_llamada):
             return {"success": False, "error": "DEEPGRAM_API_KEY not configured"}
             
         # Configurar cliente Deepgram
-        deepgram = DeepgramClient(deepgram_api_key)
+        deepgram = get_deepgram_client(deepgram_api_key)
         
         # Opciones de transcripción optimizadas para español
         options = PrerecordedOptions(
@@ -295,85 +413,18 @@ def transcribe_with_deepgram(audio_path, dni, fecha_llamada):
         logger.error(f"❌ Error Deepgram transcription: {str(e)}")
         return {"success": False, "error": str(e)}
 
+_url_signer = UrlSigner(lambda: get_secret_value('deepgram-signer-credentials'), get_storage_client)
+
 def generate_signed_url(gs_path):
-    """Generar URL firmada para acceso público temporal usando cuenta de servicio específica"""
+    """
+    URL firmada V4 del audio (firma local cacheada)
+    None si no se pudo firmar: nunca se entrega una URL pública sin firmar ni la ruta gs://
+    """
     try:
-        # Extraer bucket y blob del path gs://
-        parts = gs_path.replace('gs://', '').split('/')
-        bucket_name = parts[0]
-        blob_path = '/'.join(parts[1:])
-        
-        # Intentar obtener credenciales de cuenta de servicio desde Secret Manager
-        try:
-            import json
-            from google.oauth2 import service_account
-            
-            # Obtener credenciales desde Secret Manager
-            credentials_json = get_secret_value('deepgram-signer-credentials')
-            if credentials_json:
-                logger.info("🔑 Usando cuenta de servicio específica para firmar URLs")
-                credentials_info = json.loads(credentials_json)
-                credentials = service_account.Credentials.from_service_account_info(credentials_info)
-                
-                # Crear cliente de storage con las credenciales específicas
-                storage_client = storage.Client(project=PROJECT_ID, credentials=credentials)
-                bucket = storage_client.bucket(bucket_name)
-                blob = bucket.blob(blob_path)
-                
-                # Generar URL firmada
-                signed_url = blob.generate_signed_url(
-                    version='v4',
-                    expiration=datetime.utcnow() + timedelta(hours=2),
-                    method='GET'
-                )
-                logger.info("✅ URL firmada generada exitosamente con cuenta de servicio")
-                return signed_url
-                
-        except Exception as credentials_error:
-            logger.warning(f"⚠️ Error usando cuenta de servicio específica: {str(credentials_error)}")
-        
-        # Fallback: usar cliente de storage por defecto
-        logger.info("🔄 Intentando con cliente de storage por defecto...")
-        storage_client = storage.Client(project=PROJECT_ID)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_path)
-        
-        # Intentar generar URL firmada con diferentes métodos
-        try:
-            # Método 1: URL firmada estándar (requiere clave privada)
-            signed_url = blob.generate_signed_url(
-                version='v4',
-                expiration=datetime.utcnow() + timedelta(hours=2),
-                method='GET'
-            )
-            logger.info("✅ URL firmada generada exitosamente (método estándar)")
-            return signed_url
-            
-        except Exception as signing_error:
-            logger.warning(f"⚠️ No se pudo generar URL firmada: {str(signing_error)}")
-            
-            # Método 2: Verificar si el blob es públicamente accesible
-            try:
-                # Construir URL pública directa
-                public_url = f"https://storage.googleapis.com/{bucket_name}/{blob_path}"
-                
-                # Verificar si el archivo es accesible públicamente
-                import requests
-                response = requests.head(public_url, timeout=10)
-                
-                if response.status_code == 200:
-                    logger.info("✅ URL pública directa disponible")
-                    return public_url
-                else:
-                    logger.warning(f"⚠️ Archivo no es público: HTTP {response.status_code}")
-                    
-            except Exception as public_error:
-                logger.warning(f"⚠️ Error verificando acceso público: {str(public_error)}")
-            
-            # Método 3: Fallback - usar URL gs:// directamente (Deepgram podría soportarlo)
-            logger.info("🔄 Usando URL gs:// como fallback")
-            return gs_path
-        
+        signed_url = _url_signer.sign(gs_path)
+        if not signed_url:
+            logger.error(f"❌ No se pudo firmar la URL de {gs_path}")
+        return signed_url
     except Exception as e:
         logger.error(f"❌ Error crítico generando URL: {str(e)}")
         return None
@@ -466,6 +517,7 @@ def clean_transcript(text):
 
 def analyze_quality_with_openai(transcript_text, dni, fecha_llamada, validation_data=None):
     """Analizar calidad de llamada con OpenAI"""
+    started = time.monotonic()
     try:
         # Limpiar transcripción antes del análisis
         cleaned_transcript = clean_transcript(transcript_text)
@@ -595,7 +647,7 @@ def analyze_quality_with_openai(transcript_text, dni, fecha_llamada, validation_
         logger.info(f"🤖 Iniciando análisis PREMIUM GPT-4 Turbo para DNI: {dni}")
         logger.info(f"📊 Longitud de transcripción: {len(transcript_text)} caracteres")
         
-        client = OpenAI(api_key=openai_api_key)
+        client = get_openai_client(openai_api_key)
         
         response = client.chat.completions.create(
             model="gpt-4-turbo",  # 🎯 MODELO MÁS CONSISTENTE PARA ANÁLISIS
@@ -745,6 +797,7 @@ def analyze_quality_with_openai(transcript_text, dni, fecha_llamada, validation_
             "cost_usd": cost_usd,
             "tokens_prompt": prompt_tokens,
             "tokens_completion": completion_tokens,
+            "processing_seconds": round(time.monotonic() - started, 3),
             **analysis_data
         }
         
@@ -872,6 +925,7 @@ def save_analysis_to_bigquery(client, analysis_result, dni, fecha_llamada, trans
             "tokens_prompt": int(analysis_result.get('tokens_prompt', 0)),
             "tokens_completion": int(analysis_result.get('tokens_completion', 0)),
             "costo_openai_usd": float(analysis_result.get('cost_usd', 0.0)),
+            "tiempo_procesamiento_segundos": analysis_result.get('processing_seconds'),
             "estado": "completado",
             "created_at": datetime.utcnow().isoformat(),
             "updated_at": datetime.utcnow().isoformat()
@@ -880,20 +934,39 @@ def save_analysis_to_bigquery(client, analysis_result, dni, fecha_llamada, trans
         errors = client.insert_rows_json(table_id, rows_to_insert)
         if errors:
             logger.error(f"Error inserting analysis: {errors}")
+            return False
         else:
             logger.info(f"✅ Análisis guardado en BigQuery: {dni}")
+            return True
             
     except Exception as e:
         logger.error(f"❌ Error saving analysis to BigQuery: {str(e)}")
+        return False
 
-def update_pipeline_metrics(client, transcription_result, analysis_result):
-    """Actualizar métricas del pipeline"""
-    try:
-        # Aquí actualizaríamos las métricas diarias
-        # Por simplicidad, solo logueamos por ahora
-        logger.info(f"📊 Métricas actualizadas - Deepgram: ${transcription_result.get('cost_usd', 0):.4f}, OpenAI: ${analysis_result.get('cost_usd', 0):.4f}")
-    except Exception as e:
-        logger.error(f"❌ Error updating metrics: {str(e)}")
+def record_queue_analysis(success, seconds=None, cost_usd=0.0):
+    """
+    Acumular un análisis de la cola en las métricas de la instancia
+    Cada ventana horaria es una ejecución (run_id) y el MERGE se reescribe como máximo cada QUEUE_METRICS_FLUSH_SECONDS
+    """
+    run_id = f"analysis-queue-{datetime.utcnow().strftime('%Y%m%dT%H')}-{INSTANCE_ID}"
+    pending = []
+    with _queue_metrics_lock:
+        if _queue_metrics["run_id"] != run_id:
+            # Cerrar la ventana anterior con su último estado
+            if _queue_metrics["metrics"] is not None:
+                pending.append((_queue_metrics["metrics"], _queue_metrics["run_id"]))
+            _queue_metrics.update(run_id=run_id, metrics=PipelineMetrics('quality-analysis-queue'), flushed_at=0.0)
+        metrics = _queue_metrics["metrics"]
+        metrics.record_analysis(success, seconds, cost_usd)
+        now = time.monotonic()
+        if now - _queue_metrics["flushed_at"] >= QUEUE_METRICS_FLUSH_SECONDS:
+            _queue_metrics["flushed_at"] = now
+            pending.append((metrics, run_id))
+    for window_metrics, window_run_id in pending:
+        write_pipeline_metrics(get_bigquery_client, METRICS_TABLE, window_metrics, window_run_id)
+
+# Precarga de secretos al iniciar la instancia
+_secret_cache.start_prefetch([None if os.environ.get('OPENAI_API_KEY') else 'openai-api-key'])
 
 # Alias for Cloud Functions entry point  
 main = analyze_quality
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""Tests de la cola de análisis: transcribe-audio publica y consume_analysis_request consume"""
+import base64
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from conftest import load_function
+from fakes import FakeBigQueryClient
+
+@pytest.fixture
+def quality(monkeypatch):
+    module = load_function('quality-analysis-function')
+    analyzed = []
+    saved = set()
+
+    def analyze(text, dni, fecha_llamada, validation_data=None):
+        analyzed.append(dni)
+        return {"success": True, "categoria": "BUENA", "cost_usd": 0.01, "processing_seconds": 1.0}
+
+    def query_results(sql):
+        return pd.DataFrame({"x": [1]}) if saved else pd.DataFrame({"x": []})
+
+    monkeypatch.setattr(module, 'get_bigquery_client', lambda: FakeBigQueryClient(query_results))
+    monkeypatch.setattr(module, 'get_validation_data', lambda *args: None)
+    monkeypatch.setattr(module, 'analyze_quality_with_openai', analyze)
+    def save(client, result, dni, fecha, transcripcion_id):
+        saved.add(transcripcion_id)
+        return True
+
+    monkeypatch.setattr(module, 'save_analysis_to_bigquery', save)
+    monkeypatch.setattr(module, 'record_queue_analysis', lambda *args: None)
+    module.analyzed = analyzed
+    return module
+
+@pytest.fixture
+def publisher(monkeypatch):
+    transcription = load_function('transcription-function')
+    monkeypatch.setattr(transcription, 'ANALYSIS_PUBLISHER', 'memory')
+    publisher = transcription.get_publisher_client()
+    topic = publisher.topic_path(transcription.PROJECT_ID, transcription.ANALYSIS_TOPIC)
+    publisher.pull(topic)
+
+    def publish(*args):
+        assert transcription.publish_analysis_request(*args)
+        return publisher.pull(topic)
+    return publish
+
+def event(message):
+    return SimpleNamespace(data={"message": message})
+
+def test_published_request_is_analyzed_once(quality, publisher):
+    messages = publisher("12345678-abc", "12345678", "hola, buenos días", "2025-05-10")
+
+    assert len(messages) == 1
+    assert messages[0]['attributes'] == {"dni": "12345678", "transcripcion_id": "12345678-abc"}
+    quality.consume_analysis_request(event(messages[0]))
+    # Pub/Sub entrega al menos una vez: la reentrega se confirma sin analizar de nuevo
+    quality.consume_analysis_request(event(messages[0]))
+
+    assert quality.analyzed == ["12345678"]
+
+@pytest.mark.parametrize("data", [
+    "no es base64 ni json",
+    base64.b64encode(b'{"transcription": "sin dni"}').decode('ascii'),
+])
+def test_malformed_messages_are_acknowledged(quality, data):
+    assert quality.consume_analysis_request(event({"data": data, "messageId": "1"})) is None
+    assert quality.analyzed == []
+
+def test_failed_analysis_is_raised_for_redelivery(quality, publisher, monkeypatch):
+    messages = publisher("12345678-abc", "12345678", "hola", "2025-05-10")
+    monkeypatch.setattr(quality, 'analyze_quality_with_openai', lambda *args: {"success": False, "error": "timeout"})
+
+    with pytest.raises(RuntimeError):
+        quality.consume_analysis_request(event(messages[0]))
+
+def test_duplicate_check_errors_are_raised_instead_of_reanalyzing(quality, publisher, monkeypatch):
+    messages = publisher("12345678-abc", "12345678", "hola", "2025-05-10")
+
+    def unavailable(sql):
+        raise ConnectionError("BigQuery no disponible")
+    monkeypatch.setattr(quality, 'get_bigquery_client', lambda: FakeBigQueryClient(unavailable))
+
+    with pytest.raises(ConnectionError):
+        quality.consume_analysis_request(event(messages[0]))
+    assert quality.analyzed == []
+
+def test_failed_save_is_raised_for_redelivery(quality, publisher, monkeypatch):
+    messages = publisher("12345678-abc", "12345678", "hola", "2025-05-10")
+    monkeypatch.setattr(quality, 'save_analysis_to_bigquery', lambda *args: False)
+
+    with pytest.raises(RuntimeError):
+        quality.consume_analysis_request(event(messages[0]))
+
+def test_save_reports_insert_errors():
+    client = FakeBigQueryClient()
+    client.insert_rows_json = lambda table, rows: [{"index": 0, "errors": ["invalid"]}]
+    result = {"success": True, "categoria": "BUENA", "puntuacion_total": 4}
+
+    assert load_function('quality-analysis-function').save_analysis_to_bigquery(client, result, "1", "2025-05-10", "1-abc") is False
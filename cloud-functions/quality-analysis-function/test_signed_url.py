@@ -0,0 +1,25 @@
+"""Tests de generate_signed_url en analyze-quality"""
+import pytest
+
+from conftest import load_function
+
+@pytest.fixture
+def quality():
+    return load_function('quality-analysis-function')
+
+def test_signing_failure_returns_none(quality, monkeypatch):
+    monkeypatch.setattr(quality._url_signer, 'sign', lambda gs_path: None)
+
+    assert quality.generate_signed_url("gs://buckets_llamadas/a.wav") is None
+
+def test_signing_error_returns_none(quality, monkeypatch):
+    def broken(gs_path):
+        raise RuntimeError("sin credenciales")
+    monkeypatch.setattr(quality._url_signer, 'sign', broken)
+
+    assert quality.generate_signed_url("gs://buckets_llamadas/a.wav") is None
+
+def test_signed_url_is_returned_as_is(quality, monkeypatch):
+    monkeypatch.setattr(quality._url_signer, 'sign', lambda gs_path: "https://storage.googleapis.com/b/a.wav?X-Goog-Signature=x")
+
+    assert quality.generate_signed_url("gs://b/a.wav").endswith("X-Goog-Signature=x")
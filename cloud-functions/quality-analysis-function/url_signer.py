@@ -0,0 +1,107 @@
+"""
+Firma local de URLs V4 de Cloud Storage con caché, compartida por las Cloud Functions
+Fuente: cloud-functions/shared/url_signer.py. Cada función despliega una copia
+vendorizada en su carpeta; actualizarlas con `python cloud-functions/sync_shared.py`
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+# Firma local de URLs V4 para Deepgram
+SIGNED_URL_EXPIRATION_SECONDS = 2 * 3600
+SIGNED_URL_MIN_REMAINING_SECONDS = 30 * 60  # margen para que Deepgram descargue el audio
+SIGNED_URL_CACHE_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+class UrlSigner:
+    """
+    Firmador local de URLs V4 para los audios
+    - Carga las credenciales de deepgram-signer-credentials una vez (y de nuevo solo si el secreto rota)
+    - Firma con la clave privada en memoria, sin llamadas de red
+    - Cachea cada URL mientras le quede al menos SIGNED_URL_MIN_REMAINING_SECONDS de validez
+    get_credentials_json() retorna el JSON de la cuenta firmante (o None) y get_storage_client() el cliente GCS
+    """
+
+    def __init__(self, get_credentials_json, get_storage_client, expiration=SIGNED_URL_EXPIRATION_SECONDS,
+                 min_remaining=SIGNED_URL_MIN_REMAINING_SECONDS, max_cached=SIGNED_URL_CACHE_SIZE):
+        self.get_credentials_json = get_credentials_json
+        self.get_storage_client = get_storage_client
+        self.expiration = expiration
+        self.min_remaining = min_remaining
+        self.max_cached = max_cached
+        self.credentials = None
+        self.credentials_source = None
+        self.cache = OrderedDict()  # gs_path -> (url, vence_en)
+        self.stats = {"signed": 0, "cache_hits": 0, "errors": 0}
+        self.lock = threading.Lock()
+
+    def get_credentials(self):
+        """Credenciales de la cuenta firmante; None usa las credenciales por defecto del cliente"""
+        credentials_json = self.get_credentials_json()
+        if not credentials_json:
+            return None
+        with self.lock:
+            if credentials_json != self.credentials_source:
+                try:
+                    from google.oauth2 import service_account
+                    self.credentials = service_account.Credentials.from_service_account_info(json.loads(credentials_json))
+                    logger.info("🔑 Credenciales de firma cargadas")
+                except Exception as e:
+                    logger.warning(f"⚠️ Error usando cuenta de servicio específica: {str(e)}")
+                    self.credentials = None
+                self.credentials_source = credentials_json
+            return self.credentials
+
+    def sign(self, gs_path):
+        """URL firmada de un gs:// o None si no se pudo firmar"""
+        return self.sign_many([gs_path]).get(gs_path)
+
+    def sign_many(self, gs_paths):
+        """Firmar varios gs:// de una vez; retorna {gs_path: url} con los que se pudieron firmar"""
+        now = time.monotonic()
+        signed = {}
+        missing = []
+        with self.lock:
+            for gs_path in dict.fromkeys(gs_paths):
+                entry = self.cache.get(gs_path)
+                if entry is not None and entry[1] - now >= self.min_remaining:
+                    self.cache.move_to_end(gs_path)
+                    self.stats["cache_hits"] += 1
+                    signed[gs_path] = entry[0]
+                else:
+                    missing.append(gs_path)
+        if not missing:
+            return signed
+
+        credentials = self.get_credentials()
+        storage_client = self.get_storage_client()
+        for gs_path in missing:
+            bucket_name, _, blob_path = gs_path.replace('gs://', '', 1).partition('/')
+            try:
+                url = storage_client.bucket(bucket_name).blob(blob_path).generate_signed_url(
+                    version='v4',
+                    expiration=timedelta(seconds=self.expiration),
+                    method='GET',
+                    credentials=credentials
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo firmar {gs_path}: {str(e)}")
+                with self.lock:
+                    self.stats["errors"] += 1
+                continue
+            signed[gs_path] = url
+            with self.lock:
+                self.stats["signed"] += 1
+                self.cache[gs_path] = (url, now + self.expiration)
+                self.cache.move_to_end(gs_path)
+                while len(self.cache) > self.max_cached:
+                    self.cache.popitem(last=False)
+        return signed
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, "cached": len(self.cache)}
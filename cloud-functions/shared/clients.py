@@ -0,0 +1,94 @@
+"""
+Clientes y sesiones HTTP compartidos por la instancia, comunes a las Cloud Functions
+Fuente: cloud-functions/shared/clients.py. Cada función despliega una copia
+vendorizada en su carpeta; actualizarlas con `python cloud-functions/sync_shared.py`
+"""
+import gzip
+import json
+import os
+import threading
+
+# Cliente HTTP compartido para llamadas entre funciones
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 4))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_GZIP_REQUESTS = os.environ.get('HTTP_GZIP_REQUESTS', 'false').lower() == 'true'
+
+# Clientes de Google Cloud, SDKs y sesiones HTTP compartidos por la instancia
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(name, factory):
+    """
+    Cliente compartido por la instancia, creado una sola vez y reutilizado entre invocaciones
+    Thread-safe: con concurrencia > 1 todos los hilos reciben el mismo cliente
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+def new_http_session(pool_maxsize):
+    """Sesión requests con keep-alive y un pool acotado de pool_maxsize conexiones por host"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=pool_maxsize,
+        pool_block=True,  # Esperar una conexión libre en vez de abrir conexiones descartables
+        max_retries=0
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_http_session(name='default', pool_maxsize=None):
+    """
+    Sesión HTTP compartida por la instancia (keep-alive y pool de conexiones), una por nombre
+    El tamaño del pool se fija al crearla; sin pool_maxsize se usa HTTP_POOL_MAXSIZE
+    """
+    return get_client(f"http:{name}", lambda: new_http_session(pool_maxsize or HTTP_POOL_MAXSIZE))
+
+def post_json(url, payload, read_timeout, gzip_body=HTTP_GZIP_REQUESTS, session=None):
+    """POST JSON por la sesión compartida, con timeouts de conexión/lectura y gzip opcional"""
+    body = json.dumps(payload, default=str).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if gzip_body:
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    session = session or get_http_session()
+    return session.post(url, data=body, headers=headers, timeout=(HTTP_CONNECT_TIMEOUT, read_timeout))
+
+def http_pool_stats(name='default'):
+    """Peticiones enviadas y conexiones nuevas abiertas por la sesión compartida"""
+    stats = {"requests": 0, "new_connections": 0}
+    session = _clients.get(f"http:{name}")
+    if session is None:
+        return stats
+    for adapter in set(session.adapters.values()):
+        pool_manager = getattr(adapter, 'poolmanager', None)
+        if pool_manager is None:
+            continue
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            stats["requests"] += pool.num_requests
+            stats["new_connections"] += pool.num_connections
+    return stats
+
+def http_pool_delta(before, after):
+    """Diferencia entre dos lecturas de http_pool_stats con la tasa de reutilización"""
+    sent = after["requests"] - before["requests"]
+    opened = after["new_connections"] - before["new_connections"]
+    return {
+        "requests": sent,
+        "new_connections": opened,
+        "connection_reuse_ratio": round(1 - opened / sent, 3) if sent else None
+    }
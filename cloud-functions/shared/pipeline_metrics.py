@@ -0,0 +1,118 @@
+"""
+Métricas agregadas por ejecución (metricas_pipeline), compartidas por las Cloud Functions
+Fuente: cloud-functions/shared/pipeline_metrics.py. Cada función despliega una copia
+vendorizada en su carpeta; actualizarlas con `python cloud-functions/sync_shared.py`
+"""
+import logging
+import threading
+from datetime import datetime
+
+from google.cloud import bigquery
+
+logger = logging.getLogger(__name__)
+
+def percentile(values, q):
+    """Percentil por rango más cercano (None si no hay muestras)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = -(-len(ordered) * q // 100)  # ceil(q% de n)
+    index = max(0, min(len(ordered), rank) - 1)
+    return round(float(ordered[index]), 3)
+
+class PipelineMetrics:
+    """Agregados de una ejecución para metricas_pipeline (thread-safe)"""
+
+    def __init__(self, origen):
+        self.origen = origen
+        self.audios = 0
+        self.transcription_ok = 0
+        self.transcription_errors = 0
+        self.analysis_ok = 0
+        self.analysis_errors = 0
+        self.transcription_seconds = []
+        self.analysis_seconds = []
+        self.deepgram_cost = 0.0
+        self.openai_cost = 0.0
+        self.lock = threading.Lock()
+
+    def record_transcription(self, success, seconds=None, cost_usd=0.0):
+        with self.lock:
+            self.audios += 1
+            if success:
+                self.transcription_ok += 1
+                self.deepgram_cost += float(cost_usd or 0.0)
+                if seconds is not None:
+                    self.transcription_seconds.append(float(seconds))
+            else:
+                self.transcription_errors += 1
+
+    def record_analysis(self, success, seconds=None, cost_usd=0.0):
+        with self.lock:
+            if success:
+                self.analysis_ok += 1
+                self.openai_cost += float(cost_usd or 0.0)
+                if seconds is not None:
+                    self.analysis_seconds.append(float(seconds))
+            else:
+                self.analysis_errors += 1
+
+    def to_row(self):
+        """Fila de metricas_pipeline con promedios y percentiles p50/p95"""
+        with self.lock:
+            transcription = list(self.transcription_seconds)
+            analysis = list(self.analysis_seconds)
+            return {
+                "audios_procesados": self.audios,
+                "transcripciones_exitosas": self.transcription_ok,
+                "analisis_completados": self.analysis_ok,
+                "tiempo_promedio_transcripcion": round(sum(transcription) / len(transcription), 3) if transcription else None,
+                "tiempo_p50_transcripcion": percentile(transcription, 50),
+                "tiempo_p95_transcripcion": percentile(transcription, 95),
+                "tiempo_promedio_analisis": round(sum(analysis) / len(analysis), 3) if analysis else None,
+                "tiempo_p50_analisis": percentile(analysis, 50),
+                "tiempo_p95_analisis": percentile(analysis, 95),
+                "costo_total_deepgram": round(self.deepgram_cost, 6),
+                "costo_total_openai": round(self.openai_cost, 6),
+                "errores_transcripcion": self.transcription_errors,
+                "errores_analisis": self.analysis_errors
+            }
+
+def write_pipeline_metrics(get_bigquery_client, table_id, metrics, run_id, fecha=None):
+    """
+    Registrar los agregados de una ejecución en metricas_pipeline (table_id) con un único MERGE
+    La clave (fecha, run_id) hace el MERGE idempotente si se reintenta la escritura.
+    El cliente se pide dentro del try: un fallo al registrar métricas no interrumpe la ejecución
+    """
+    row = metrics.to_row()
+    if not row["audios_procesados"] and not row["analisis_completados"] and not row["errores_analisis"]:
+        return None
+    try:
+        client = get_bigquery_client()
+        params = [
+            bigquery.ScalarQueryParameter("fecha", "DATE", fecha or datetime.utcnow().date()),
+            bigquery.ScalarQueryParameter("run_id", "STRING", run_id),
+            bigquery.ScalarQueryParameter("origen", "STRING", metrics.origen)
+        ]
+        for column, value in row.items():
+            kind = "FLOAT64" if column.startswith(("tiempo_", "costo_")) else "INT64"
+            params.append(bigquery.ScalarQueryParameter(column, kind, value))
+
+        columns = ["fecha", "run_id", "origen"] + list(row)
+        query = f"""
+        MERGE `{table_id}` T
+        USING (SELECT {', '.join(f'@{column} AS {column}' for column in columns)}) S
+        ON T.fecha = S.fecha AND T.run_id = S.run_id
+        WHEN MATCHED THEN
+          UPDATE SET {', '.join(f'{column} = S.{column}' for column in row)}, updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+          INSERT ({', '.join(columns)}, created_at, updated_at)
+          VALUES ({', '.join(f'S.{column}' for column in columns)}, CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP())
+        """
+        client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params)).result()
+        logger.info(f"📊 Métricas de la ejecución {run_id} registradas: {row['audios_procesados']} audios, "
+                    f"Deepgram ${row['costo_total_deepgram']:.4f}, OpenAI ${row['costo_total_openai']:.4f}")
+        return row
+    except Exception as e:
+        logger.error(f"❌ Error registrando métricas del pipeline: {str(e)}")
+        return None
@@ -0,0 +1,66 @@
+"""
+Copiar los módulos de cloud-functions/shared/ a las funciones que los usan
+Cada Cloud Function se despliega solo con su carpeta, así que no puede importar de una
+carpeta hermana: el código común vive en shared/ y cada función lleva una copia vendorizada.
+
+Uso:
+    python cloud-functions/sync_shared.py          # actualizar las copias
+    python cloud-functions/sync_shared.py --check  # solo verificar (sale con 1 si alguna difiere)
+"""
+import argparse
+import os
+import sys
+
+FUNCTIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARED_DIR = os.path.join(FUNCTIONS_DIR, "shared")
+
+# Módulo compartido -> funciones que despliegan una copia
+SHARED_MODULES = {
+    "registro_csv.py": ["batch-processor-function", "transcription-function", "dni-index-builder"],
+    "clients.py": ["batch-processor-function", "batch-analysis-trigger", "transcription-function",
+                   "dni-index-builder", "quality-analysis-function"],
+    "circuit_breaker.py": ["batch-processor-function", "transcription-function"],
+    "pipeline_metrics.py": ["batch-processor-function", "quality-analysis-function"],
+    "secret_cache.py": ["quality-analysis-function", "transcription-function"],
+    "url_signer.py": ["quality-analysis-function", "transcription-function"],
+}
+
+def read_bytes(path):
+    try:
+        with open(path, 'rb') as source:
+            return source.read()
+    except FileNotFoundError:
+        return None
+
+def stale_copies():
+    """Copias vendorizadas que no coinciden con su fuente en shared/: [(módulo, función)]"""
+    stale = []
+    for module_name, function_names in SHARED_MODULES.items():
+        source = read_bytes(os.path.join(SHARED_DIR, module_name))
+        for function_name in function_names:
+            if read_bytes(os.path.join(FUNCTIONS_DIR, function_name, module_name)) != source:
+                stale.append((module_name, function_name))
+    return stale
+
+def sync():
+    """Escribir las copias desactualizadas y retornar cuántas se actualizaron"""
+    stale = stale_copies()
+    for module_name, function_name in stale:
+        with open(os.path.join(FUNCTIONS_DIR, function_name, module_name), 'wb') as target:
+            target.write(read_bytes(os.path.join(SHARED_DIR, module_name)))
+        print(f"actualizado {function_name}/{module_name}")
+    return len(stale)
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincronizar los módulos compartidos de las Cloud Functions")
+    parser.add_argument('--check', action='store_true', help="no escribir, solo reportar copias desactualizadas")
+    args = parser.parse_args()
+    if args.check:
+        stale = stale_copies()
+        for module_name, function_name in stale:
+            print(f"desactualizado {function_name}/{module_name}")
+        sys.exit(1 if stale else 0)
+    sync()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""Tests del parser y el resumen de import_time_report.py"""
+import import_time_report
+
+IMPORTTIME_STDERR = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        300 | encodings
+import time:       200 |        200 |     numpy.core
+import time:      1000 |       1200 |   pandas
+import time:       500 |        500 |   functions_framework
+import time:        50 |         50 |     google.cloud.storage.blob
+import time:       250 |        300 |   google.cloud.storage
+import time:       100 |       2100 | main
+Traceback irrelevante
+"""
+
+def test_parse_importtime_reads_depth_and_times():
+    rows = import_time_report.parse_importtime(IMPORTTIME_STDERR)
+
+    assert rows[0] == ("_io", 1, 120, 120)
+    assert rows[2] == ("numpy.core", 2, 200, 200)
+    assert rows[-1] == ("main", 0, 100, 2100)
+    assert len(rows) == 8  # sin la cabecera ni líneas ajenas
+
+def test_summarize_reports_main_subtree_and_heaviest_direct_imports():
+    summary = import_time_report.summarize(import_time_report.parse_importtime(IMPORTTIME_STDERR))
+
+    assert summary['total_ms'] == 2.1
+    # Solo los imports directos de main, del más pesado al más liviano (_io pertenece a encodings)
+    assert summary['top'] == [("pandas", 1.2), ("functions_framework", 0.5), ("google.cloud.storage", 0.3)]
+    assert {"pandas", "numpy.core", "main"} <= summary['modules']
@@ -0,0 +1,5 @@
+"""Las copias vendorizadas de shared/ deben coincidir con su fuente"""
+import sync_shared
+
+def test_vendored_copies_match_shared_sources():
+    assert sync_shared.stale_copies() == []
@@ -0,0 +1,154 @@
+"""
+Circuit breaker por endpoint, compartido por las Cloud Functions
+Fuente: cloud-functions/shared/circuit_breaker.py. Cada función despliega una copia
+vendorizada en su carpeta; actualizarlas con `python cloud-functions/sync_shared.py`
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_ERROR_RATE = float(os.environ.get('BREAKER_ERROR_RATE', 0.5))
+BREAKER_WINDOW = 20
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', 30))
+BREAKER_HALF_OPEN_PROBES = 3
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+class CircuitPermit:
+    """
+    Permiso de una llamada aceptada por allow(); se devuelve con su resultado
+    probe_epoch identifica el semiabierto en que se reservó un slot de prueba (None si no es prueba)
+    """
+    __slots__ = ('probe_epoch',)
+
+    def __init__(self, probe_epoch=None):
+        self.probe_epoch = probe_epoch
+
+class CircuitBreaker:
+    """
+    Circuit breaker por endpoint (closed / open / half-open)
+    - Se abre con failure_threshold fallos consecutivos o con una tasa de error alta en la ventana
+    - Abierto: falla rápido durante open_seconds
+    - Semiabierto: deja pasar half_open_probes pruebas; si todas salen bien se cierra
+    Solo los resultados de llamadas con permiso de prueba del semiabierto actual deciden la transición
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, error_rate=BREAKER_ERROR_RATE,
+                 window=BREAKER_WINDOW, open_seconds=BREAKER_OPEN_SECONDS, half_open_probes=BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.results = deque(maxlen=window)
+        self.opened_at = 0.0
+        self.half_open_epoch = 0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.rejected = 0
+        self.transitions = {}
+        self.lock = threading.Lock()
+
+    def _transition(self, new_state, reason):
+        key = f"{self.state}->{new_state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        logger.warning(f"🔌 Circuit breaker {self.name}: {self.state} -> {new_state} ({reason})")
+        self.state = new_state
+        if new_state == 'open':
+            self.opened_at = time.monotonic()
+        elif new_state == 'half_open':
+            self.half_open_epoch += 1
+            self.probes_in_flight = 0
+            self.probe_successes = 0
+        elif new_state == 'closed':
+            self.consecutive_failures = 0
+            self.results.clear()
+
+    def _is_current_probe(self, permit):
+        return (self.state == 'half_open' and permit is not None
+                and permit.probe_epoch == self.half_open_epoch)
+
+    def ready(self):
+        """True si una llamada sería aceptada ahora (sin reservar un slot de prueba)"""
+        with self.lock:
+            if self.state == 'open':
+                return time.monotonic() - self.opened_at >= self.open_seconds
+            if self.state == 'half_open':
+                return self.probes_in_flight < self.half_open_probes
+            return True
+
+    def allow(self):
+        """
+        Decidir si se permite la llamada: None si se rechaza, o un CircuitPermit
+        En semiabierto el permiso reserva un slot de prueba
+        """
+        with self.lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return None
+                self._transition('half_open', f"{self.open_seconds:g}s abierto")
+            if self.state == 'half_open':
+                if self.probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    return None
+                self.probes_in_flight += 1
+                return CircuitPermit(self.half_open_epoch)
+            return CircuitPermit()
+
+    def record_success(self, permit=None):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.results.append(True)
+            if self._is_current_probe(permit):
+                self.probes_in_flight -= 1
+                self.probe_successes += 1
+                if self.probe_successes >= self.half_open_probes:
+                    self._transition('closed', f"{self.probe_successes} pruebas exitosas")
+
+    def record_failure(self, reason='', permit=None):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.results.append(False)
+            if self._is_current_probe(permit):
+                self.probes_in_flight -= 1
+                self._transition('open', f"falló una prueba: {reason}")
+                return
+            # Resultados tardíos de llamadas previas no deciden el semiabierto ni reabren el circuito
+            if self.state != 'closed':
+                return
+            failures = self.results.count(False)
+            if self.consecutive_failures >= self.failure_threshold:
+                self._transition('open', f"{self.consecutive_failures} fallos consecutivos: {reason}")
+            elif len(self.results) >= self.window // 2 and failures / len(self.results) >= self.error_rate:
+                self._transition('open', f"tasa de error {failures}/{len(self.results)}: {reason}")
+
+    def release(self, permit):
+        """Devolver un permiso que no llegó a usarse; libera su slot de prueba sin contar un resultado"""
+        with self.lock:
+            if self._is_current_probe(permit):
+                self.probes_in_flight -= 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "rejected": self.rejected,
+                "transitions": dict(self.transitions)
+            }
+
+def get_circuit_breaker(name):
+    """Breaker compartido por la instancia para un endpoint (persiste entre invocaciones)"""
+    with _circuit_breakers_lock:
+        if name not in _circuit_breakers:
+            _circuit_breakers[name] = CircuitBreaker(name)
+        return _circuit_breakers[name]
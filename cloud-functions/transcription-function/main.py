@@ -3,59 +3,186 @@ Cloud Function - Transcripción con Deepgram
 Transcribe audios usando Deepgram y guarda en BigQuery
 """
 import functions_framework
+import base64
 import os
+import gzip
 import json
 import logging
-from google.cloud import bigquery, storage, secretmanager
-from deepgram import DeepgramClient, PrerecordedOptions
-from datetime import datetime, timedelta
+import threading
+import struct
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from google.cloud import storage
+from datetime import datetime
+from urllib.parse import urlencode
 import hashlib
+import hmac
 import requests
-import pandas as pd
-from io import StringIO
+from registro_csv import iter_csv_batches
+from clients import HTTP_CONNECT_TIMEOUT, get_client, get_http_session, http_pool_stats, post_json
+from secret_cache import SecretCache
+from url_signer import UrlSigner
+from circuit_breaker import get_circuit_breaker
 
 PROJECT_ID = "peak-emitter-350713"
 DATASET_ID = "Calidad_Llamadas"
 ANALYSIS_URL = "https://us-central1-peak-emitter-350713.cloudfunctions.net/analyze-quality"
 
+# Handoff a análisis: 'pubsub' encola el análisis y retorna; 'http' espera la respuesta de analyze-quality
+ANALYSIS_HANDOFF = os.environ.get('ANALYSIS_HANDOFF', 'pubsub')
+ANALYSIS_TOPIC = os.environ.get('ANALYSIS_TOPIC', 'analysis-requests')
+ANALYSIS_PUBLISH_TIMEOUT = float(os.environ.get('ANALYSIS_PUBLISH_TIMEOUT', 30))
+ANALYSIS_PUBLISHER = os.environ.get('ANALYSIS_PUBLISHER', 'pubsub')  # 'pubsub' o 'memory' (pruebas locales)
+
+# Modo callback de Deepgram: se envía el trabajo y el resultado llega a receive_deepgram_callback
+TRANSCRIPTION_MODE = os.environ.get('TRANSCRIPTION_MODE', 'sync')  # 'sync' o 'callback'
+DEEPGRAM_CALLBACK_URL = os.environ.get(
+    'DEEPGRAM_CALLBACK_URL', "https://us-central1-peak-emitter-350713.cloudfunctions.net/deepgram-callback"
+)
+DEEPGRAM_CALLBACK_MAX_AGE_SECONDS = float(os.environ.get('DEEPGRAM_CALLBACK_MAX_AGE_SECONDS', 6 * 3600))
+
+# Transcripción de varios audios por invocación (transcribe_batch)
+BATCH_TRANSCRIPTION_CONCURRENCY = int(os.environ.get('BATCH_TRANSCRIPTION_CONCURRENCY', 8))
+BATCH_TRANSCRIPTION_MAX_FILES = int(os.environ.get('BATCH_TRANSCRIPTION_MAX_FILES', 200))
+BQ_INSERT_MAX_BYTES = 9 * 1024 * 1024  # límite de 10 MB por request de streaming insert
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.m4a')
+
+# Origen del audio para Deepgram: 'url' (URL firmada) o 'stream' (subida del objeto por chunks)
+TRANSCRIPTION_SOURCE = os.environ.get('TRANSCRIPTION_SOURCE', 'url')
+DEEPGRAM_LISTEN_URL = "https://api.deepgram.com/v1/listen"
+DEEPGRAM_STREAM_CHUNK_BYTES = 1024 * 1024
+DEEPGRAM_STREAM_READ_TIMEOUT = float(os.environ.get('DEEPGRAM_STREAM_READ_TIMEOUT', 600))
+# Cada subida ocupa una conexión durante toda la transcripción: un pool propio, del tamaño de la concurrencia del lote
+DEEPGRAM_POOL_MAXSIZE = int(os.environ.get('DEEPGRAM_POOL_MAXSIZE', BATCH_TRANSCRIPTION_CONCURRENCY))
+AUDIO_CONTENT_TYPES = {'.wav': 'audio/wav', '.mp3': 'audio/mpeg', '.flac': 'audio/flac', '.m4a': 'audio/mp4'}
+
+# Opciones de transcripción optimizadas (SDK y API REST)
+DEEPGRAM_OPTIONS = {
+    "model": "nova-2",
+    "language": "es",
+    "smart_format": True,
+    "punctuate": True,
+    "diarize": True,
+    "multichannel": False,
+    "alternatives": 1,
+    "profanity_filter": False,
+    "redact": False
+}
+CSV_BUCKET = "buckets_llamadas"
+CSV_BLOB_PATH = "0000000000000000/registro_llamadas.csv"
+
+# Mapeo gsutil_url -> N_Doc cacheado en la instancia, revalidado por generación del blob
+CSV_MAPPING_REVALIDATE_SECONDS = float(os.environ.get('CSV_MAPPING_REVALIDATE_SECONDS', 30))
+_csv_mapping = None
+_csv_mapping_generation = None
+_csv_mapping_checked_at = 0.0
+_csv_mapping_lock = threading.Lock()
+
+# Índice binario de DNI publicado por dni-index-builder (lecturas por rango, sin pandas)
+DNI_INDEX_BUCKET = "maqui-pipeline-transcripciones"
+DNI_INDEX_PATH = "indices/registro_llamadas_dni.idx"
+DNI_INDEX_MAGIC = b'DNIX'
+DNI_INDEX_VERSION = 1
+DNI_INDEX_HEADER = struct.Struct('<4sHHQQ')  # magic, versión, bits, registros, generación del CSV
+DNI_INDEX_RECORD = struct.Struct('<Q24sq')  # hash del gsutil_url, N_Doc, fecha epoch (-1 si falta)
+_dni_index = None
+_dni_index_checked_at = 0.0
+_dni_index_lock = threading.Lock()
+
+# Manifiesto de audios procesados (lo compacta batch-processor-function)
+MANIFEST_BUCKET = "maqui-pipeline-transcripciones"
+MANIFEST_DELTA_PREFIX = "manifest/deltas/"
+# Transcripciones fallidas en modo callback; batch-processor-function las vuelve a encolar
+FAILED_TRANSCRIPTION_PREFIX = "manifest/failed/"
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_secret_value(secret_id, project_id=PROJECT_ID):
-    """Obtener secreto desde Google Cloud Secret Manager"""
-    try:
-        client = secretmanager.SecretManagerServiceClient()
-        name = f"projects/{project_id}/secrets/{secret_id}/versions/latest"
-        response = client.access_secret_version(request={"name": name})
-        return response.payload.data.decode("UTF-8").strip()
-    except Exception as e:
-        logger.error(f"Error obteniendo secreto {secret_id}: {e}")
-        return None
+_secret_cache = SecretCache(PROJECT_ID)
 
-def read_csv_mapping():
-    """Leer CSV y crear mapeo gsutil_url -> N_Doc"""
-    try:
-        storage_client = storage.Client(project=PROJECT_ID)
-        bucket_name = "buckets_llamadas"
-        blob_path = "0000000000000000/registro_llamadas.csv"
+def get_secret_value(secret_id):
+    """Obtener secreto desde la caché de la instancia (Secret Manager solo al vencer el TTL)"""
+    return _secret_cache.get(secret_id)
 
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_path)
+def get_bigquery_client():
+    """Cliente BigQuery compartido (import diferido: google.cloud.bigquery carga pandas)"""
+    def create():
+        from google.cloud import bigquery
+        return bigquery.Client(project=PROJECT_ID)
+    return get_client('bigquery', create)
 
-        # Leer CSV directamente en pandas
-        csv_content = blob.download_as_text()
-        df = pd.read_csv(StringIO(csv_content))
+def get_storage_client():
+    """Cliente Cloud Storage compartido"""
+    return get_client('storage', lambda: storage.Client(project=PROJECT_ID))
+
+def get_deepgram_client(api_key):
+    """Cliente Deepgram compartido por API key (una key rotada crea un cliente nuevo)"""
+    def create():
+        from deepgram import DeepgramClient
+        return DeepgramClient(api_key)
+    return get_client(('deepgram', api_key), create)
+
+class InMemoryPublisher:
+    """
+    Publicador Pub/Sub en memoria (pruebas y entornos sin Pub/Sub)
+    Guarda los mensajes por tópico con la misma forma que entrega el trigger de Pub/Sub
+    """
 
-        # Limpiar y validar datos
-        df = df.dropna(subset=['gsutil_url', 'N_Doc'])
-        df['N_Doc'] = df['N_Doc'].astype(str)
+    def __init__(self):
+        self.messages = {}  # topic_path -> [mensaje]
+        self.lock = threading.Lock()
 
-        # Crear mapeo gsutil_url -> N_Doc
+    def topic_path(self, project, topic):
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic, data, **attrs):
+        with self.lock:
+            messages = self.messages.setdefault(topic, [])
+            message_id = str(sum(len(topic_messages) for topic_messages in self.messages.values()) + 1)
+            messages.append({
+                "data": base64.b64encode(data).decode('ascii'),
+                "attributes": attrs,
+                "messageId": message_id
+            })
+        future = Future()
+        future.set_result(message_id)
+        return future
+
+    def pull(self, topic):
+        """Retirar los mensajes publicados en el tópico, en orden de publicación"""
+        with self.lock:
+            return self.messages.pop(topic, [])
+
+def get_publisher_client():
+    """
+    Cliente Pub/Sub compartido (usa el emulador si PUBSUB_EMULATOR_HOST está definido)
+    Con ANALYSIS_PUBLISHER='memory' usa un InMemoryPublisher
+    """
+    if ANALYSIS_PUBLISHER == 'memory':
+        return get_client('pubsub-memory', InMemoryPublisher)
+
+    def factory():
+        from google.cloud import pubsub_v1  # Import diferido del SDK
+        return pubsub_v1.PublisherClient()
+    return get_client('pubsub', factory)
+
+def get_request_json(request):
+    """Leer el JSON del request, aceptando cuerpos comprimidos con gzip"""
+    if request is None:
+        return None
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        return json.loads(gzip.decompress(request.get_data()))
+    return request.get_json(silent=True)
+
+def read_csv_mapping(blob=None):
+    """Leer CSV en streaming y crear mapeo gsutil_url -> N_Doc"""
+    try:
+        if blob is None:
+            blob = get_storage_client().bucket(CSV_BUCKET).blob(CSV_BLOB_PATH)
         mapping = {}
-        for _, row in df.iterrows():
-            gsutil_url = row['gsutil_url']
-            n_doc = row['N_Doc']
-            mapping[gsutil_url] = n_doc
+        for batch in iter_csv_batches(blob):
+            # Crear mapeo gsutil_url -> N_Doc por lote (la última aparición gana, como antes)
+            mapping.update(zip(batch['gsutil_url'], batch['N_Doc']))
 
         logger.info(f"📋 CSV mapping cargado: {len(mapping)} registros")
         return mapping
@@ -64,14 +191,135 @@ def read_csv_mapping():
         logger.error(f"❌ Error leyendo CSV: {str(e)}")
         return None
 
+def get_csv_mapping():
+    """
+    Mapeo gsutil_url -> N_Doc cacheado en la instancia
+    Cada CSV_MAPPING_REVALIDATE_SECONDS se compara la generación del blob (solo metadatos)
+    y el CSV se vuelve a leer únicamente si cambió
+    """
+    global _csv_mapping, _csv_mapping_generation, _csv_mapping_checked_at
+
+    if _csv_mapping is not None and time.monotonic() - _csv_mapping_checked_at < CSV_MAPPING_REVALIDATE_SECONDS:
+        return _csv_mapping
+
+    with _csv_mapping_lock:
+        # Otro hilo pudo revalidar mientras se esperaba el lock
+        if _csv_mapping is not None and time.monotonic() - _csv_mapping_checked_at < CSV_MAPPING_REVALIDATE_SECONDS:
+            return _csv_mapping
+
+        storage_client = get_storage_client()
+        try:
+            blob = storage_client.bucket(CSV_BUCKET).get_blob(CSV_BLOB_PATH)
+        except Exception as e:
+            if _csv_mapping is not None:
+                logger.warning(f"⚠️ No se pudo revalidar el CSV, se usa el mapeo cacheado: {str(e)}")
+                return _csv_mapping
+            raise
+        if blob is None:
+            logger.error(f"❌ CSV no encontrado: gs://{CSV_BUCKET}/{CSV_BLOB_PATH}")
+            return _csv_mapping
+
+        if _csv_mapping is None or blob.generation != _csv_mapping_generation:
+            # Leer exactamente la generación validada aunque el CSV se reemplace durante la lectura
+            pinned = storage_client.bucket(CSV_BUCKET).blob(CSV_BLOB_PATH, generation=blob.generation)
+            mapping = read_csv_mapping(pinned)
+            if not mapping:
+                return _csv_mapping
+            logger.info(f"🗂️ Mapeo CSV cacheado para la generación {blob.generation}")
+            _csv_mapping, _csv_mapping_generation = mapping, blob.generation
+
+        _csv_mapping_checked_at = time.monotonic()
+        return _csv_mapping
+
+def get_dni_index():
+    """
+    Índice de DNI publicado por dni-index-builder, validado contra la generación vigente del CSV
+    Cachea el directorio del índice en la instancia; None si no existe o está desactualizado
+    """
+    global _dni_index, _dni_index_checked_at
+
+    if _dni_index is not None and time.monotonic() - _dni_index_checked_at < CSV_MAPPING_REVALIDATE_SECONDS:
+        return _dni_index
+
+    with _dni_index_lock:
+        if _dni_index is not None and time.monotonic() - _dni_index_checked_at < CSV_MAPPING_REVALIDATE_SECONDS:
+            return _dni_index
+
+        storage_client = get_storage_client()
+        csv_blob = storage_client.bucket(CSV_BUCKET).get_blob(CSV_BLOB_PATH)
+        index_blob = storage_client.bucket(DNI_INDEX_BUCKET).get_blob(DNI_INDEX_PATH)
+        metadata = (index_blob.metadata or {}) if index_blob is not None else {}
+        if csv_blob is None or metadata.get('csv_generation') != str(csv_blob.generation):
+            logger.warning("⚠️ Índice de DNI ausente o desactualizado, se usa el CSV")
+            _dni_index = None
+            return None
+
+        if _dni_index is None or _dni_index['generation'] != index_blob.generation:
+            bits = int(metadata['bucket_bits'])
+            pinned = storage_client.bucket(DNI_INDEX_BUCKET).blob(DNI_INDEX_PATH, generation=index_blob.generation)
+            header_and_directory = pinned.download_as_bytes(start=0, end=DNI_INDEX_HEADER.size + 4 * ((1 << bits) + 1) - 1)
+            magic, version, header_bits, count, _ = DNI_INDEX_HEADER.unpack_from(header_and_directory)
+            if magic != DNI_INDEX_MAGIC or version != DNI_INDEX_VERSION or header_bits != bits:
+                logger.error(f"❌ Índice de DNI con formato inesperado: {magic!r} v{version}")
+                return None
+            _dni_index = {
+                "generation": index_blob.generation,
+                "blob": pinned,
+                "bits": bits,
+                "count": count,
+                "directory": header_and_directory[DNI_INDEX_HEADER.size:],
+                "records_offset": DNI_INDEX_HEADER.size + 4 * ((1 << bits) + 1)
+            }
+            logger.info(f"🗂️ Índice de DNI cargado: {count} llamadas, {1 << bits} buckets")
+
+        _dni_index_checked_at = time.monotonic()
+        return _dni_index
+
+def lookup_dni_index(index, gsutil_url):
+    """
+    Buscar una URL en el índice con una sola lectura por rango de su bucket
+    Retorna {"dni", "fecha_llamada"} o {} si la URL no está en el CSV
+    """
+    url_hash = audio_url_hash(gsutil_url)
+    bucket_id = url_hash >> (64 - index['bits']) if index['bits'] else 0
+    start, end = struct.unpack_from('<II', index['directory'], 4 * bucket_id)
+    if start == end:
+        return {}
+
+    offset = index['records_offset']
+    records = index['blob'].download_as_bytes(start=offset + start * DNI_INDEX_RECORD.size,
+                                              end=offset + end * DNI_INDEX_RECORD.size - 1)
+    for position in range(0, len(records), DNI_INDEX_RECORD.size):
+        record_hash, dni, fecha = DNI_INDEX_RECORD.unpack_from(records, position)
+        if record_hash == url_hash:
+            return {
+                "dni": dni.rstrip(b'\0').decode('utf-8'),
+                "fecha_llamada": datetime.utcfromtimestamp(fecha).isoformat() if fecha >= 0 else None
+            }
+    return {}
+
 def get_dni_from_csv(bucket_name, file_name):
     """Obtener DNI real (N_Doc) desde CSV usando gsutil_url"""
     try:
         # Construir gsutil_url completa
         gsutil_url = f"gs://{bucket_name}/{file_name}"
 
-        # Leer mapeo CSV
-        mapping = read_csv_mapping()
+        # Índice precompilado: lectura por rango, sin descargar ni parsear el CSV
+        try:
+            index = get_dni_index()
+            entry = lookup_dni_index(index, gsutil_url) if index is not None else None
+        except Exception as e:
+            logger.warning(f"⚠️ Error leyendo el índice de DNI, se usa el CSV: {str(e)}")
+            entry = None
+        if entry is not None:
+            if entry:
+                logger.info(f"✅ DNI encontrado en índice: {entry['dni']} para {gsutil_url}")
+                return entry['dni']
+            logger.warning(f"⚠️ DNI no encontrado en el índice para: {gsutil_url}")
+            return None
+
+        # Mapeo CSV cacheado en la instancia
+        mapping = get_csv_mapping()
         if not mapping:
             logger.error("❌ No se pudo cargar mapping CSV")
             return None
@@ -93,10 +341,10 @@ def get_dni_from_csv(bucket_name, file_name):
 def transcribe_audio(request):
     """
     HTTP Cloud Function para transcribir audio
-    Payload: {"bucketName": "bucket", "fileName": "file.wav"}
+    Payload: {"bucketName": "bucket", "fileName": "file.wav", "mode": "sync" | "callback", "source": "url" | "stream"}
     """
     try:
-        request_json = request.get_json()
+        request_json = get_request_json(request)
         if not request_json:
             return {"error": "No JSON payload provided"}, 400
             
@@ -107,7 +355,7 @@ def transcribe_audio(request):
             return {"error": "Missing required fields: bucketName, fileName"}, 400
             
         # Solo procesar archivos de audio
-        if not file_name.lower().endswith(('.wav', '.mp3', '.flac', '.m4a')):
+        if not file_name.lower().endswith(AUDIO_EXTENSIONS):
             return {"message": f"Skipping non-audio file: {file_name}"}, 200
 
         # Obtener DNI real (N_Doc) desde CSV
@@ -116,81 +364,115 @@ def transcribe_audio(request):
             return {"error": f"Could not find DNI in CSV for file: {file_name}"}, 400
 
         audio_path = f"gs://{bucket_name}/{file_name}"
-        
+        content_key = get_audio_content_key(bucket_name, file_name)
+
+        # Modo callback: Deepgram envía el resultado al webhook y la instancia queda libre
+        if request_json.get('mode', TRANSCRIPTION_MODE) == 'callback':
+            submit_result = submit_deepgram_callback(
+                audio_path, bucket_name, file_name, dni, content_key, source=request_json.get('source')
+            )
+            if not submit_result['success']:
+                return {"error": f"Transcription submit failed: {submit_result['error']}"}, 500
+            return {
+                "success": True,
+                "status": "submitted",
+                "dni": dni,
+                "deepgram_request_id": submit_result['request_id']
+            }
+
         logger.info(f"🎤 Transcribiendo audio: {audio_path} - DNI: {dni}")
         
         # Transcribir con Deepgram
-        transcription_result = transcribe_with_deepgram(audio_path)
+        transcription_started = time.monotonic()
+        transcription_result = transcribe_with_deepgram(audio_path, source=request_json.get('source'))
+        transcription_seconds = time.monotonic() - transcription_started
         
         if not transcription_result['success']:
             return {"error": f"Transcription failed: {transcription_result['error']}"}, 500
-        
-        # Guardar en BigQuery
-        bigquery_client = bigquery.Client(project=PROJECT_ID)
-        transcripcion_id = save_transcription_to_bigquery(
-            bigquery_client, transcription_result, dni, audio_path, file_name
-        )
-        
-        if not transcripcion_id:
+
+        response = complete_transcription(transcription_result, dni, bucket_name, file_name, content_key)
+        if not response:
             return {"error": "Failed to save transcription"}, 500
-        
-        logger.info(f"✅ Transcripción completada: {dni}")
-        
-        # Llamar automáticamente a análisis de calidad
-        analysis_result = trigger_quality_analysis(transcripcion_id, dni, transcription_result['text'])
-        if analysis_result:
-            logger.info(f"✅ Análisis de calidad iniciado para {dni}")
-        else:
-            logger.warning(f"⚠️ Error iniciando análisis para {dni}")
-        
-        return {
-            "success": True,
-            "dni": dni,
-            "transcripcion_id": transcripcion_id,
-            "duration": transcription_result.get('duration', 0),
-            "confidence": transcription_result.get('confidence', 0),
-            "cost_usd": transcription_result.get('cost_usd', 0),
-            "analysis_triggered": analysis_result
-        }
+        response["transcription_seconds"] = round(transcription_seconds, 3)
+        return response
         
     except Exception as e:
         logger.error(f"❌ Error: {str(e)}")
         return {"error": str(e)}, 500
 
-def transcribe_with_deepgram(audio_path):
-    """Transcribir audio usando Deepgram"""
+def complete_transcription(transcription_result, dni, bucket_name, file_name, content_key=None):
+    """
+    Guardar la transcripción, registrarla en el manifiesto y encolar su análisis
+    Compartido por el modo síncrono y el webhook de Deepgram; retorna la respuesta o None si no se guardó
+    """
+    audio_path = f"gs://{bucket_name}/{file_name}"
+
+    # Guardar en BigQuery (con el hash de contenido para la dedup del batch)
+    bigquery_client = get_bigquery_client()
+    transcripcion_id = save_transcription_to_bigquery(
+        bigquery_client, transcription_result, dni, audio_path, file_name, content_key=content_key
+    )
+    if not transcripcion_id:
+        return None
+        
+    logger.info(f"✅ Transcripción completada: {dni}")
+
+    # Registrar el audio en el manifiesto de procesados
+    record_processed_audio(audio_path)
+
+    analysis_result, analysis_message_id, analysis_seconds = handoff_analysis(
+        transcripcion_id, dni, transcription_result['text'], file_name
+    )
+
+    return {
+        "success": True,
+        "dni": dni,
+        "transcripcion_id": transcripcion_id,
+        "duration": transcription_result.get('duration', 0),
+        "confidence": transcription_result.get('confidence', 0),
+        "cost_usd": transcription_result.get('cost_usd', 0),
+        "analysis_triggered": bool(analysis_result or analysis_message_id),
+        "analysis_queued": bool(analysis_message_id),
+        "analysis_message_id": analysis_message_id,
+        # Latencias y costo de análisis para metricas_pipeline del batch
+        "analysis_seconds": round(analysis_seconds, 3) if analysis_result else None,
+        "analysis_cost_usd": analysis_result.get('cost_usd', 0.0) if analysis_result else 0.0
+    }
+
+def get_deepgram_api_key():
+    """API key de Deepgram (variable de entorno o Secret Manager)"""
+    return os.environ.get('DEEPGRAM_API_KEY') or get_secret_value('deepgram-api-key')
+
+def get_prerecorded_options():
+    """Opciones de transcripción optimizadas"""
+    from deepgram import PrerecordedOptions  # Import diferido del SDK
+    return PrerecordedOptions(**DEEPGRAM_OPTIONS)
+
+def transcribe_with_deepgram(audio_path, signed_url=None, source=None):
+    """
+    Transcribir audio usando Deepgram
+    source 'stream' sube el objeto por chunks; con 'url' se usa la URL firmada y, si no se puede firmar, también streaming
+    """
+    if (source or TRANSCRIPTION_SOURCE) == 'stream':
+        return stream_to_deepgram(audio_path)
     try:
         # Obtener API key
-        deepgram_api_key = os.environ.get('DEEPGRAM_API_KEY')
-        if not deepgram_api_key:
-            deepgram_api_key = get_secret_value('deepgram-api-key')
-            
+        deepgram_api_key = get_deepgram_api_key()
         if not deepgram_api_key:
             return {"success": False, "error": "DEEPGRAM_API_KEY not configured"}
             
+        # Generar URL firmada (sin firma, el audio se sube directamente)
+        signed_url = signed_url or _url_signer.sign(audio_path)
+        if not signed_url:
+            logger.warning(f"⚠️ No se pudo firmar {audio_path}, se sube por streaming")
+            return stream_to_deepgram(audio_path)
+
         # Configurar cliente Deepgram
-        deepgram = DeepgramClient(deepgram_api_key)
-        
-        # Opciones de transcripción optimizadas
-        options = PrerecordedOptions(
-            model="nova-2",
-            language="es",
-            smart_format=True,
-            punctuate=True,
-            diarize=True,
-            multichannel=False,
-            alternatives=1,
-            profanity_filter=False,
-            redact=False
-        )
+        deepgram = get_deepgram_client(deepgram_api_key)
+        options = get_prerecorded_options()
         
         logger.info(f"🎙️ Iniciando transcripción Deepgram: {audio_path}")
         
-        # Generar URL firmada
-        signed_url = generate_signed_url(audio_path)
-        if not signed_url:
-            return {"success": False, "error": "Could not generate signed URL for audio"}
-        
         # Transcribir
         response = deepgram.listen.prerecorded.v("1").transcribe_url({
             "url": signed_url
@@ -226,75 +508,347 @@ def transcribe_with_deepgram(audio_path):
         logger.error(f"❌ Error Deepgram: {str(e)}")
         return {"success": False, "error": str(e)}
 
-def generate_signed_url(gs_path):
-    """Generar URL firmada para acceso público temporal"""
+def iter_blob_chunks(blob, chunk_size=DEEPGRAM_STREAM_CHUNK_BYTES):
+    """Leer el objeto de GCS por rangos de chunk_size; solo un chunk en memoria a la vez"""
+    with blob.open('rb', chunk_size=chunk_size) as reader:
+        while True:
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def stream_to_deepgram(audio_path, callback_url=None):
+    """
+    Transcribir subiendo el audio desde GCS al endpoint de archivos de Deepgram (chunked transfer)
+    No depende de URLs firmadas ni de ACL públicas; con callback_url retorna el request_id sin esperar
+    """
     try:
-        # Extraer bucket y blob del path gs://
-        parts = gs_path.replace('gs://', '').split('/')
-        bucket_name = parts[0]
-        blob_path = '/'.join(parts[1:])
-        
-        # Intentar con cuenta de servicio específica
-        try:
-            credentials_json = get_secret_value('deepgram-signer-credentials')
-            if credentials_json:
-                from google.oauth2 import service_account
-                credentials_info = json.loads(credentials_json)
-                credentials = service_account.Credentials.from_service_account_info(credentials_info)
-                
-                storage_client = storage.Client(project=PROJECT_ID, credentials=credentials)
-                bucket = storage_client.bucket(bucket_name)
-                blob = bucket.blob(blob_path)
-                
-                signed_url = blob.generate_signed_url(
-                    version='v4',
-                    expiration=datetime.utcnow() + timedelta(hours=2),
-                    method='GET'
-                )
-                logger.info("✅ URL firmada generada exitosamente")
-                return signed_url
-                
-        except Exception as credentials_error:
-            logger.warning(f"⚠️ Error con cuenta específica: {str(credentials_error)}")
-        
-        # Fallback: cliente por defecto
-        logger.info("🔄 Intentando con cliente por defecto...")
-        storage_client = storage.Client(project=PROJECT_ID)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_path)
-        
-        try:
-            signed_url = blob.generate_signed_url(
-                version='v4',
-                expiration=datetime.utcnow() + timedelta(hours=2),
-                method='GET'
-            )
-            logger.info("✅ URL firmada generada (método estándar)")
-            return signed_url
-            
-        except Exception as signing_error:
-            logger.warning(f"⚠️ No se pudo generar URL firmada: {str(signing_error)}")
-            
-            # Verificar si es público
-            try:
-                public_url = f"https://storage.googleapis.com/{bucket_name}/{blob_path}"
-                response = requests.head(public_url, timeout=10)
-                
-                if response.status_code == 200:
-                    logger.info("✅ URL pública disponible")
-                    return public_url
-                else:
-                    logger.warning(f"⚠️ No es público: HTTP {response.status_code}")
-                    
-            except Exception as public_error:
-                logger.warning(f"⚠️ Error verificando acceso público: {str(public_error)}")
-            
-            # Último recurso
-            return gs_path
-        
+        deepgram_api_key = get_deepgram_api_key()
+        if not deepgram_api_key:
+            return {"success": False, "error": "DEEPGRAM_API_KEY not configured"}
+
+        bucket_name, _, blob_path = audio_path.replace('gs://', '', 1).partition('/')
+        blob = get_storage_client().bucket(bucket_name).get_blob(blob_path)
+        if blob is None:
+            return {"success": False, "error": f"Audio not found: {audio_path}"}
+
+        params = {key: str(value).lower() if isinstance(value, bool) else value for key, value in DEEPGRAM_OPTIONS.items()}
+        if callback_url:
+            params["callback"] = callback_url
+        content_type = blob.content_type or AUDIO_CONTENT_TYPES.get(os.path.splitext(blob_path)[1].lower(), 'application/octet-stream')
+
+        logger.info(f"🎙️ Subiendo audio a Deepgram por streaming: {audio_path} ({blob.size} bytes)")
+        response = get_http_session('deepgram', pool_maxsize=DEEPGRAM_POOL_MAXSIZE).post(
+            DEEPGRAM_LISTEN_URL,
+            params=params,
+            data=iter_blob_chunks(blob),
+            headers={'Authorization': f"Token {deepgram_api_key}", 'Content-Type': content_type},
+            timeout=(HTTP_CONNECT_TIMEOUT, DEEPGRAM_STREAM_READ_TIMEOUT)
+        )
+        if response.status_code != 200:
+            return {"success": False, "error": f"Deepgram HTTP {response.status_code}: {response.text[:200]}"}
+
+        payload = response.json()
+        if callback_url:
+            return {"success": True, "request_id": payload.get('request_id')}
+
+        result = parse_deepgram_result(payload)
+        if result['success']:
+            logger.info(f"✅ Transcripción exitosa: {len(result['text'])} chars, {result['duration']}s")
+        return result
+
     except Exception as e:
-        logger.error(f"❌ Error generando URL: {str(e)}")
+        logger.error(f"❌ Error Deepgram (streaming): {str(e)}")
+        return {"success": False, "error": str(e)}
+
+def get_callback_secret():
+    """Clave HMAC que firma el contexto del callback de Deepgram"""
+    return os.environ.get('DEEPGRAM_CALLBACK_SECRET') or get_secret_value('deepgram-callback-secret')
+
+def sign_callback_context(context, secret):
+    """Firma HMAC-SHA256 de los campos del contexto en orden fijo"""
+    message = "\n".join(str(context.get(field, '')) for field in ('bucket', 'file', 'dni', 'key', 'ts'))
+    return hmac.new(secret.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def build_callback_url(bucket_name, file_name, dni, content_key=None):
+    """
+    URL del webhook con el contexto de la transcripción firmado en la query
+    Así el webhook no necesita estado compartido para saber a qué audio corresponde el resultado
+    """
+    secret = get_callback_secret()
+    if not secret:
         return None
+    context = {"bucket": bucket_name, "file": file_name, "dni": dni, "key": content_key or '', "ts": int(time.time())}
+    context["sig"] = sign_callback_context(context, secret)
+    return f"{DEEPGRAM_CALLBACK_URL}?{urlencode(context)}"
+
+def verify_callback_context(args):
+    """Contexto del callback si la firma es válida y no expiró, None en caso contrario"""
+    secret = get_callback_secret()
+    context = {field: args.get(field) for field in ('bucket', 'file', 'dni', 'key', 'ts', 'sig')}
+    if not secret or not all(context[field] for field in ('bucket', 'file', 'dni', 'ts', 'sig')):
+        return None
+    if not hmac.compare_digest(sign_callback_context(context, secret), context['sig']):
+        return None
+    try:
+        age = time.time() - int(context['ts'])
+    except ValueError:
+        return None
+    if age > DEEPGRAM_CALLBACK_MAX_AGE_SECONDS:
+        return None
+    return context
+
+def submit_deepgram_callback(audio_path, bucket_name, file_name, dni, content_key=None, source=None):
+    """Enviar el audio a Deepgram en modo callback; retorna el request_id sin esperar la transcripción"""
+    try:
+        deepgram_api_key = get_deepgram_api_key()
+        if not deepgram_api_key:
+            return {"success": False, "error": "DEEPGRAM_API_KEY not configured"}
+
+        callback_url = build_callback_url(bucket_name, file_name, dni, content_key)
+        if not callback_url:
+            return {"success": False, "error": "DEEPGRAM_CALLBACK_SECRET not configured"}
+
+        signed_url = None if (source or TRANSCRIPTION_SOURCE) == 'stream' else _url_signer.sign(audio_path)
+        if not signed_url:
+            return stream_to_deepgram(audio_path, callback_url=callback_url)
+
+        deepgram = get_deepgram_client(deepgram_api_key)
+        response = deepgram.listen.prerecorded.v("1").transcribe_url_callback(
+            {"url": signed_url}, callback_url, get_prerecorded_options()
+        )
+        request_id = getattr(response, 'request_id', None)
+        logger.info(f"📤 Transcripción enviada a Deepgram en modo callback: {audio_path} - request {request_id}")
+        return {"success": True, "request_id": request_id}
+
+    except Exception as e:
+        logger.error(f"❌ Error enviando a Deepgram: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+def parse_deepgram_result(payload):
+    """Resultado de transcripción a partir del JSON de Deepgram (callback o subida directa)"""
+    channels = (payload.get('results') or {}).get('channels') or []
+    alternatives = channels[0].get('alternatives') or [] if channels else []
+    if not alternatives:
+        return {"success": False, "error": "No transcript found in Deepgram response"}
+
+    duration = (payload.get('metadata') or {}).get('duration') or 0
+    return {
+        "success": True,
+        "text": alternatives[0].get('transcript', ''),
+        "confidence": alternatives[0].get('confidence', 0),
+        "duration": duration,
+        "cost_usd": duration / 60.0 * 0.005,  # $0.005 per minute
+        "full_response": payload
+    }
+
+def handoff_analysis(transcripcion_id, dni, transcription_text, file_name):
+    """
+    Encolar el análisis de calidad (o llamarlo directamente en modo http)
+    Retorna (respuesta del análisis http, message_id de Pub/Sub, segundos)
+    """
+    analysis_result = None
+    analysis_message_id = None
+    analysis_started = time.monotonic()
+    if ANALYSIS_HANDOFF == 'pubsub':
+        analysis_message_id = publish_analysis_request(
+            transcripcion_id, dni, transcription_text, extract_date_from_filename(file_name)[:10]
+        )
+    else:
+        analysis_result = trigger_quality_analysis(transcripcion_id, dni, transcription_text)
+    analysis_seconds = time.monotonic() - analysis_started
+    if analysis_result or analysis_message_id:
+        logger.info(f"✅ Análisis de calidad iniciado para {dni}")
+    else:
+        logger.warning(f"⚠️ Error iniciando análisis para {dni}")
+    return analysis_result, analysis_message_id, analysis_seconds
+
+@functions_framework.http
+def transcribe_batch(request):
+    """
+    HTTP Cloud Function para transcribir varios audios en una invocación
+    Payload: {"files": [{"bucketName": "bucket", "fileName": "file.wav", "dni": "opcional"}], "concurrency": n,
+              "source": "url" | "stream"}
+    Deepgram se llama en paralelo y todas las filas se guardan con un único insert; retorna el estado de cada audio
+    """
+    try:
+        request_json = get_request_json(request)
+        files = request_json.get('files') if request_json else None
+        if not files or not isinstance(files, list):
+            return {"error": "Missing required field: files"}, 400
+        if len(files) > BATCH_TRANSCRIPTION_MAX_FILES:
+            return {"error": f"Too many files: {len(files)} > {BATCH_TRANSCRIPTION_MAX_FILES}"}, 400
+        concurrency = max(1, min(int(request_json.get('concurrency', BATCH_TRANSCRIPTION_CONCURRENCY)),
+                                 BATCH_TRANSCRIPTION_CONCURRENCY))
+
+        # Validar cada audio y resolver su DNI (el del payload evita la búsqueda en el índice)
+        items = []
+        for entry in files:
+            if not isinstance(entry, dict):
+                items.append({"bucketName": None, "fileName": None, "status": "error",
+                              "error": f"Invalid file entry: {str(entry)[:100]}"})
+                continue
+            bucket_name = entry.get('bucketName')
+            file_name = entry.get('fileName')
+            item = {"bucketName": bucket_name, "fileName": file_name, "status": "pending"}
+            items.append(item)
+            if not isinstance(bucket_name, str) or not isinstance(file_name, str) or not bucket_name or not file_name:
+                item.update(status="error", error="Missing required fields: bucketName, fileName")
+            elif not file_name.lower().endswith(AUDIO_EXTENSIONS):
+                item.update(status="skipped", error=f"Skipping non-audio file: {file_name}")
+            else:
+                item["dni"] = str(entry['dni']) if entry.get('dni') else get_dni_from_csv(bucket_name, file_name)
+                if not item["dni"]:
+                    item.update(status="error", error=f"Could not find DNI in CSV for file: {file_name}")
+        pending = [item for item in items if item["status"] == "pending"]
+        logger.info(f"🎤 Lote de {len(files)} audios: {len(pending)} a transcribir con concurrencia {concurrency}")
+
+        # Firmar todas las URLs en una sola llamada (en modo stream no hace falta firmar)
+        source = request_json.get('source') or TRANSCRIPTION_SOURCE
+        signed_urls = {} if source == 'stream' else _url_signer.sign_many(
+            [f"gs://{item['bucketName']}/{item['fileName']}" for item in pending]
+        )
+
+        def transcribe_item(item):
+            audio_path = f"gs://{item['bucketName']}/{item['fileName']}"
+            started = time.monotonic()
+            result = transcribe_with_deepgram(audio_path, signed_url=signed_urls.get(audio_path), source=source)
+            result["transcription_seconds"] = round(time.monotonic() - started, 3)
+            result["content_key"] = get_audio_content_key(item['bucketName'], item['fileName'])
+            return result
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(transcribe_item, pending))
+
+        # Un único insert con todas las transcripciones exitosas
+        rows = []
+        saved = []
+        for item, result in zip(pending, results):
+            if not result['success']:
+                item.update(status="error", error=f"Transcription failed: {result['error']}")
+                continue
+            audio_path = f"gs://{item['bucketName']}/{item['fileName']}"
+            transcripcion_id, row = build_transcription_row(
+                result, item['dni'], audio_path, item['fileName'], content_key=result['content_key']
+            )
+            rows.append(row)
+            saved.append((item, result, transcripcion_id))
+        row_errors = insert_transcription_rows(get_bigquery_client(), rows)
+
+        def finish_item(entry):
+            item, result, transcripcion_id = entry
+            record_processed_audio(f"gs://{item['bucketName']}/{item['fileName']}")
+            analysis_result, analysis_message_id, _ = handoff_analysis(
+                transcripcion_id, item['dni'], result['text'], item['fileName']
+            )
+            item.update(
+                status="transcribed",
+                transcripcion_id=transcripcion_id,
+                duration=result.get('duration', 0),
+                confidence=result.get('confidence', 0),
+                cost_usd=result.get('cost_usd', 0),
+                transcription_seconds=result['transcription_seconds'],
+                analysis_triggered=bool(analysis_result or analysis_message_id),
+                analysis_queued=bool(analysis_message_id)
+            )
+
+        inserted = []
+        for index, entry in enumerate(saved):
+            if index in row_errors:
+                entry[0].update(status="error", error=f"Failed to save transcription: {row_errors[index]}")
+            else:
+                inserted.append(entry)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(finish_item, inserted))
+
+        summary = {status: sum(1 for item in items if item['status'] == status) for status in ('transcribed', 'skipped', 'error')}
+        logger.info(f"✅ Lote completado: {summary['transcribed']} transcritos, {summary['skipped']} omitidos, {summary['error']} errores")
+        return {
+            "success": True,
+            "total": len(items),
+            **summary,
+            "cost_usd": round(sum(item.get('cost_usd', 0) for item in items), 6),
+            "items": items
+        }
+
+    except Exception as e:
+        logger.error(f"❌ Error en lote de transcripción: {str(e)}")
+        return {"error": str(e)}, 500
+
+@functions_framework.http
+def receive_deepgram_callback(request):
+    """
+    Webhook que recibe el resultado de Deepgram en modo callback
+    Responde 2xx a todo lo que no deba reintentarse; 500 hace que Deepgram reenvíe el resultado
+    """
+    try:
+        context = verify_callback_context(request.args)
+        if not context:
+            logger.warning("⚠️ Callback de Deepgram con firma inválida o expirada")
+            return {"error": "Invalid callback signature"}, 403
+
+        payload = get_request_json(request)
+        if not payload:
+            return {"error": "No JSON payload provided"}, 400
+
+        dni = context['dni']
+        audio_path = f"gs://{context['bucket']}/{context['file']}"
+        request_id = (payload.get('metadata') or {}).get('request_id')
+        if payload.get('err_code') or payload.get('err_msg'):
+            error = payload.get('err_msg') or payload.get('err_code')
+            logger.error(f"❌ Deepgram no pudo transcribir {audio_path} (request {request_id}): {error}")
+            return failed_callback_response(audio_path, dni, error)
+
+        transcription_result = parse_deepgram_result(payload)
+        if not transcription_result['success']:
+            logger.error(f"❌ Callback sin transcripción para {audio_path} (request {request_id})")
+            return failed_callback_response(audio_path, dni, transcription_result['error'])
+
+        # Deepgram puede entregar el mismo resultado más de una vez: no duplicar la fila
+        if transcription_exists(get_bigquery_client(), audio_path):
+            logger.info(f"⏭️ {audio_path} ya tiene transcripción, callback {request_id} duplicado")
+            return {"success": True, "duplicate": True, "deepgram_request_id": request_id}
+
+        logger.info(f"📥 Resultado de Deepgram recibido: {audio_path} - DNI: {dni} - request {request_id}")
+        response = complete_transcription(
+            transcription_result, dni, context['bucket'], context['file'], context.get('key') or None
+        )
+        if not response:
+            return {"error": "Failed to save transcription"}, 500
+        response["deepgram_request_id"] = request_id
+        return response
+
+    except Exception as e:
+        logger.error(f"❌ Error en callback de Deepgram: {str(e)}")
+        return {"error": str(e)}, 500
+
+def failed_callback_response(audio_path, dni, error):
+    """
+    Registrar la transcripción fallida para que el batch la reintente y responder al callback
+    Si no se pudo registrar responde 500 para que Deepgram reenvíe el resultado
+    """
+    if not record_failed_transcription(audio_path, dni, error):
+        return {"error": f"Failed to record transcription failure: {error}"}, 500
+    return {"success": False, "error": error, "retry_queued": True}, 200
+
+def transcription_exists(client, audio_path):
+    """
+    Si ya hay una transcripción guardada para el audio
+    Los errores de BigQuery se relanzan: el callback responde 500 y Deepgram lo reenvía
+    """
+    query = f"""
+    SELECT 1
+    FROM `{PROJECT_ID}.{DATASET_ID}.transcripciones`
+    WHERE audio_url = @audio_url
+    LIMIT 1
+    """
+    from google.cloud import bigquery  # Import diferido del SDK
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("audio_url", "STRING", audio_path)
+    ])
+    return bool(list(client.query(query, job_config=job_config).result()))
+
+_url_signer = UrlSigner(lambda: get_secret_value('deepgram-signer-credentials'), get_storage_client)
 
 def extract_date_from_filename(filename):
     """Extraer fecha del nombre del archivo formato DDMMYYYY y convertir a timestamp"""
@@ -307,7 +861,6 @@ def extract_date_from_filename(filename):
             day, month, year = date_match.groups()
             # Validar que sea una fecha válida y convertir a timestamp
             try:
-                from datetime import datetime
                 parsed_date = datetime.strptime(f"{day}/{month}/{year}", "%d/%m/%Y")
                 # Convertir a formato timestamp requerido por BigQuery
                 return parsed_date.strftime('%Y-%m-%d %H:%M:%S')
@@ -322,35 +875,75 @@ def extract_date_from_filename(filename):
         logger.error(f"Error extrayendo fecha: {str(e)}")
         return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
 
-def save_transcription_to_bigquery(client, transcription_result, dni, audio_path, file_name):
+def build_transcription_row(transcription_result, dni, audio_path, file_name, content_key=None):
+    """Retornar (transcripcion_id, fila de transcripciones)"""
+    # Generar ID único (el audio evita colisiones entre audios del mismo DNI en un lote)
+    timestamp_str = datetime.utcnow().isoformat()
+    id_string = f"{dni}-{audio_path}-{timestamp_str}"
+    transcripcion_id = hashlib.md5(id_string.encode()).hexdigest()
+
+    # Extraer fecha del nombre del archivo
+    fecha_llamada = extract_date_from_filename(file_name)
+
+    return transcripcion_id, {
+        "dni": dni,
+        "fecha_llamada": fecha_llamada,
+        "audio_url": audio_path,
+        "transcripcion_texto": transcription_result.get('text', ''),
+        "transcripcion_json": json.dumps(transcription_result.get('full_response', {})),
+        "duracion_segundos": int(transcription_result.get('duration', 0)),
+        "confianza_promedio": transcription_result.get('confidence', 0.0),
+        "proveedor": "deepgram",
+        "estado": "procesado",
+        "costo_deepgram_usd": transcription_result.get('cost_usd', 0.0),
+        "hash_contenido": content_key,
+        "created_at": datetime.utcnow().isoformat(),
+        "updated_at": datetime.utcnow().isoformat()
+    }
+
+def insert_transcription_rows(client, rows):
+    """
+    Insertar varias filas de transcripciones; normalmente es un único request de streaming insert
+    Solo se parte si el lote supera BQ_INSERT_MAX_BYTES. Retorna {índice de fila: error} de las que fallaron
+    """
+    if not rows:
+        return {}
+    table_id = f"{PROJECT_ID}.{DATASET_ID}.transcripciones"
+    failed = {}
+    chunks = []
+    chunk, chunk_bytes, start = [], 0, 0
+    for index, row in enumerate(rows):
+        row_bytes = len(json.dumps(row, default=str))
+        if chunk and chunk_bytes + row_bytes > BQ_INSERT_MAX_BYTES:
+            chunks.append((start, chunk))
+            chunk, chunk_bytes, start = [], 0, index
+        chunk.append(row)
+        chunk_bytes += row_bytes
+    if chunk:
+        chunks.append((start, chunk))
+
+    for start, chunk in chunks:
+        try:
+            errors = client.insert_rows_json(table_id, chunk)
+        except Exception as e:
+            logger.error(f"❌ Error guardando {len(chunk)} transcripciones en BigQuery: {str(e)}")
+            failed.update({start + offset: str(e) for offset in range(len(chunk))})
+            continue
+        for error in errors or []:
+            failed[start + error.get('index', 0)] = str(error.get('errors'))
+    if failed:
+        logger.error(f"Error inserting transcriptions: {len(failed)} de {len(rows)} filas")
+    logger.info(f"✅ {len(rows) - len(failed)} transcripciones guardadas en {len(chunks)} insert(s)")
+    return failed
+
+def save_transcription_to_bigquery(client, transcription_result, dni, audio_path, file_name, content_key=None):
     """Guardar transcripción en BigQuery"""
     try:
-        # Generar ID único
-        timestamp_str = datetime.utcnow().isoformat()
-        id_string = f"{dni}-{timestamp_str}"
-        transcripcion_id = hashlib.md5(id_string.encode()).hexdigest()
-        
+        transcripcion_id, row = build_transcription_row(
+            transcription_result, dni, audio_path, file_name, content_key=content_key
+        )
         table_id = f"{PROJECT_ID}.{DATASET_ID}.transcripciones"
-        
-        # Extraer fecha del nombre del archivo
-        fecha_llamada = extract_date_from_filename(file_name)
-        
-        rows_to_insert = [{
-            "dni": dni,
-            "fecha_llamada": fecha_llamada,
-            "audio_url": audio_path,
-            "transcripcion_texto": transcription_result.get('text', ''),
-            "transcripcion_json": json.dumps(transcription_result.get('full_response', {})),
-            "duracion_segundos": int(transcription_result.get('duration', 0)),
-            "confianza_promedio": transcription_result.get('confidence', 0.0),
-            "proveedor": "deepgram",
-            "estado": "procesado",
-            "costo_deepgram_usd": transcription_result.get('cost_usd', 0.0),
-            "created_at": datetime.utcnow().isoformat(),
-            "updated_at": datetime.utcnow().isoformat()
-        }]
-        
-        errors = client.insert_rows_json(table_id, rows_to_insert)
+        errors = client.insert_rows_json(table_id, [row])
         if errors:
             logger.error(f"Error inserting transcription: {errors}")
             return None
@@ -362,8 +955,91 @@ def save_transcription_to_bigquery(client, transcription_result, dni, audio_path
         logger.error(f"❌ Error guardando en BigQuery: {str(e)}")
         return None
 
+def get_audio_content_key(bucket_name, file_name):
+    """Clave de contenido del audio (md5, o crc32c + tamaño); mismo formato que batch-processor-function"""
+    try:
+        blob = get_storage_client().bucket(bucket_name).get_blob(file_name)
+        if blob is None:
+            return None
+        if blob.md5_hash:
+            return f"md5:{blob.md5_hash}"
+        if blob.crc32c:
+            return f"crc32c:{blob.crc32c}:{blob.size}"
+        return None
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo leer el hash de {file_name}: {str(e)}")
+        return None
+
+def audio_url_hash(audio_url):
+    """Hash estable de 64 bits de un audio_url (mismo cálculo en batch-processor-function)"""
+    return int.from_bytes(hashlib.blake2b(audio_url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def record_processed_audio(audio_url):
+    """
+    Registrar un audio procesado en el manifiesto como un objeto delta vacío
+    El nombre del objeto es el hash, así no hay escrituras concurrentes sobre un mismo archivo
+    """
+    try:
+        storage_client = get_storage_client()
+        delta_name = f"{MANIFEST_DELTA_PREFIX}{audio_url_hash(audio_url):016x}"
+        storage_client.bucket(MANIFEST_BUCKET).blob(delta_name).upload_from_string(b'')
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo registrar {audio_url} en el manifiesto: {str(e)}")
+        return False
+
+def record_failed_transcription(audio_url, dni, error):
+    """
+    Registrar una transcripción fallida como objeto en FAILED_TRANSCRIPTION_PREFIX (uno por audio)
+    batch-processor-function la vuelve a encolar en su próxima ejecución y borra el objeto
+    """
+    try:
+        storage_client = get_storage_client()
+        failed_name = f"{FAILED_TRANSCRIPTION_PREFIX}{audio_url_hash(audio_url):016x}.json"
+        storage_client.bucket(MANIFEST_BUCKET).blob(failed_name).upload_from_string(json.dumps({
+            "gsutil_url": audio_url,
+            "N_Doc": str(dni),
+            "error": str(error),
+            "failed_at": datetime.utcnow().isoformat()
+        }), content_type='application/json')
+        return True
+    except Exception as e:
+        logger.error(f"❌ No se pudo registrar la transcripción fallida de {audio_url}: {str(e)}")
+        return False
+
+def publish_analysis_request(transcripcion_id, dni, transcription_text, fecha_llamada=None):
+    """
+    Publicar el pedido de análisis en ANALYSIS_TOPIC; analyze-quality lo consume con su propia concurrencia
+    Retorna el message_id o None si no se pudo publicar (batch-analysis-trigger recoge las transcripciones sin análisis)
+    """
+    try:
+        publisher = get_publisher_client()
+        topic_path = publisher.topic_path(PROJECT_ID, ANALYSIS_TOPIC)
+        data = json.dumps({
+            "dni": dni,
+            "transcription": transcription_text,
+            "transcripcion_id": transcripcion_id,
+            "fecha_llamada": fecha_llamada
+        }, default=str).encode('utf-8')
+        future = publisher.publish(topic_path, data, dni=str(dni), transcripcion_id=str(transcripcion_id))
+        message_id = future.result(timeout=ANALYSIS_PUBLISH_TIMEOUT)
+        logger.info(f"📨 Análisis encolado para {dni}: mensaje {message_id}")
+        return message_id
+    except Exception as e:
+        logger.error(f"❌ Error publicando análisis {dni} en {ANALYSIS_TOPIC}: {str(e)}")
+        return None
+
 def trigger_quality_analysis(transcripcion_id, dni, transcription_text):
-    """Llamar a la función de análisis de calidad después de completar la transcripción"""
+    """
+    Llamar a la función de análisis de calidad después de completar la transcripción
+    Retorna la respuesta del análisis si fue exitoso, False en caso contrario
+    """
+    breaker = get_circuit_breaker('analyze-quality')
+    permit = breaker.allow()
+    if not permit:
+        logger.warning(f"⚡ Circuito abierto hacia analyze-quality, se omite el análisis de {dni}: {breaker.snapshot()}")
+        return False
+
     try:
         payload = {
             "dni": dni,
@@ -373,17 +1049,27 @@ def trigger_quality_analysis(transcripcion_id, dni, transcription_text):
         
         logger.info(f"📊 Iniciando análisis de calidad para {dni}")
         
-        response = requests.post(
-            ANALYSIS_URL,
-            json=payload,
-            timeout=300  # 5 minutos timeout
-        )
+        try:
+            response = post_json(ANALYSIS_URL, payload, read_timeout=300)  # 5 minutos timeout
+        except requests.exceptions.RequestException as e:
+            breaker.record_failure(type(e).__name__, permit)
+            raise
+        except Exception:
+            breaker.release(permit)  # no llegó a ser una llamada al endpoint
+            raise
+        # 429 y 5xx indican un endpoint degradado; el resto son respuestas del servicio
+        if response.status_code == 429 or response.status_code >= 500:
+            breaker.record_failure(f"HTTP {response.status_code}", permit)
+        else:
+            breaker.record_success(permit)
+        pool = http_pool_stats()
+        logger.info(f"🔌 Conexiones HTTP de la instancia: {pool['new_connections']} nuevas para {pool['requests']} peticiones")
         
         if response.status_code == 200:
             result = response.json()
             if result.get('success', False):
                 logger.info(f"✅ Análisis exitoso para {dni}")
-                return True
+                return result
             else:
                 logger.error(f"❌ Error en análisis {dni}: {result.get('error', 'Unknown')}")
                 return False
@@ -393,4 +1079,10 @@ def trigger_quality_analysis(transcripcion_id, dni, transcription_text):
             
     except Exception as e:
         logger.error(f"❌ Excepción llamando análisis {dni}: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+# Precarga de secretos al iniciar la instancia
+_secret_cache.start_prefetch([
+    None if os.environ.get('DEEPGRAM_API_KEY') else 'deepgram-api-key',
+    'deepgram-signer-credentials'
+])
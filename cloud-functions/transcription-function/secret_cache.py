@@ -0,0 +1,121 @@
+"""
+Caché de secretos de Secret Manager con TTL, compartida por las Cloud Functions
+Fuente: cloud-functions/shared/secret_cache.py. Cada función despliega una copia
+vendorizada en su carpeta; actualizarlas con `python cloud-functions/sync_shared.py`
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from clients import get_client
+
+# Caché de secretos con TTL (refresco en segundo plano y valores stale si Secret Manager falla)
+SECRET_TTL_SECONDS = float(os.environ.get('SECRET_TTL_SECONDS', 600))
+SECRET_REFRESH_AHEAD = 0.8  # fracción del TTL a partir de la cual se refresca en segundo plano
+SECRET_MAX_STALE_SECONDS = float(os.environ.get('SECRET_MAX_STALE_SECONDS', 3600))
+SECRET_PREFETCH = os.environ.get('SECRET_PREFETCH', 'true').lower() == 'true'
+
+logger = logging.getLogger(__name__)
+
+def get_secret_client():
+    """Cliente Secret Manager compartido (import diferido)"""
+    def create():
+        from google.cloud import secretmanager
+        return secretmanager.SecretManagerServiceClient()
+    return get_client('secretmanager', create)
+
+def fetch_secret_value(secret_id, project_id):
+    """Leer la última versión de un secreto desde Google Cloud Secret Manager"""
+    try:
+        client = get_secret_client()
+        name = f"projects/{project_id}/secrets/{secret_id}/versions/latest"
+        response = client.access_secret_version(request={"name": name})
+        return response.payload.data.decode("UTF-8").strip()
+    except Exception as e:
+        logger.error(f"Error obteniendo secreto {secret_id}: {e}")
+        return None
+
+class SecretCache:
+    """
+    Caché de secretos de la instancia con TTL
+    - Dentro del TTL responde desde memoria; pasado SECRET_REFRESH_AHEAD del TTL refresca en segundo plano
+    - Vencido, lo vuelve a leer; si Secret Manager falla sirve el valor anterior (stale) hasta SECRET_MAX_STALE_SECONDS
+    - Cuenta hits, misses, refrescos y valores stale servidos
+    fetch(secret_id, project_id) lee el secreto y retorna None si falla
+    """
+
+    def __init__(self, project_id, fetch=None, ttl=SECRET_TTL_SECONDS, max_stale=SECRET_MAX_STALE_SECONDS,
+                 refresh_ahead=SECRET_REFRESH_AHEAD):
+        self.project_id = project_id
+        self.fetch = fetch or fetch_secret_value
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.refresh_ahead = refresh_ahead
+        self.entries = {}  # secret_id -> (valor, leído_en)
+        self.refreshing = set()
+        self.stats = {"hits": 0, "misses": 0, "background_refreshes": 0, "stale_served": 0, "errors": 0}
+        self.lock = threading.Lock()
+
+    def get(self, secret_id):
+        project_id = self.project_id
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(secret_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                self.stats["hits"] += 1
+                if now - entry[1] >= self.ttl * self.refresh_ahead and secret_id not in self.refreshing:
+                    self.refreshing.add(secret_id)
+                    threading.Thread(target=self._refresh, args=(secret_id, project_id), daemon=True).start()
+                return entry[0]
+            self.stats["misses"] += 1
+
+        value = self.fetch(secret_id, project_id)
+        with self.lock:
+            if value is not None:
+                self.entries[secret_id] = (value, time.monotonic())
+                return value
+            self.stats["errors"] += 1
+            # Stale-while-revalidate: mejor una key de hace un rato que fallar la solicitud
+            if entry is not None and now - entry[1] < self.ttl + self.max_stale:
+                self.stats["stale_served"] += 1
+                logger.warning(f"⚠️ Secret Manager no respondió, se usa el valor cacheado de {secret_id}")
+                return entry[0]
+            return None
+
+    def _refresh(self, secret_id, project_id):
+        try:
+            value = self.fetch(secret_id, project_id)
+            with self.lock:
+                if value is not None:
+                    self.entries[secret_id] = (value, time.monotonic())
+                    self.stats["background_refreshes"] += 1
+                else:
+                    self.stats["errors"] += 1
+        finally:
+            with self.lock:
+                self.refreshing.discard(secret_id)
+
+    def prefetch(self, secret_ids):
+        """Leer varios secretos en paralelo (al iniciar la instancia, fuera del camino de la solicitud)"""
+        def load(secret_id):
+            value = self.fetch(secret_id, self.project_id)
+            if value is not None:
+                with self.lock:
+                    self.entries.setdefault(secret_id, (value, time.monotonic()))
+            return value is not None
+
+        with ThreadPoolExecutor(max_workers=max(1, len(secret_ids))) as executor:
+            loaded = sum(executor.map(load, secret_ids))
+        logger.info(f"🔑 Secretos precargados: {loaded}/{len(secret_ids)}")
+
+    def start_prefetch(self, secret_ids):
+        """Precargar en segundo plano los secretos del camino caliente sin demorar el import"""
+        secret_ids = [secret_id for secret_id in secret_ids if secret_id]
+        if SECRET_PREFETCH and secret_ids:
+            threading.Thread(target=self.prefetch, args=(secret_ids,), daemon=True).start()
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, "cached": len(self.entries)}
@@ -0,0 +1,52 @@
+"""Tests del mapeo gsutil_url -> N_Doc cacheado por generación del CSV"""
+import pytest
+
+from conftest import load_function
+from fakes import FakeStorageClient
+
+def registry(*calls):
+    return "Fecha_Llamada,gsutil_url,N_Doc\n" + "".join(f"10/05/2025,{url},{dni}\n" for url, dni in calls)
+
+@pytest.fixture
+def transcription(monkeypatch):
+    module = load_function('transcription-function')
+    storage = FakeStorageClient()
+    storage.put(module.CSV_BUCKET, module.CSV_BLOB_PATH, registry(("gs://buckets_llamadas/001/a.wav", "111")))
+    monkeypatch.setattr(module, 'get_storage_client', lambda: storage)
+    monkeypatch.setattr(module, '_csv_mapping', None)
+    monkeypatch.setattr(module, '_csv_mapping_generation', None)
+    monkeypatch.setattr(module, '_csv_mapping_checked_at', 0.0)
+    module.fake_storage = storage
+    return module
+
+def csv_reads(transcription):
+    return transcription.fake_storage.reads.count(transcription.CSV_BLOB_PATH)
+
+def test_warm_cache_is_served_without_touching_storage(transcription, monkeypatch):
+    first = transcription.get_csv_mapping()
+    monkeypatch.setattr(transcription, 'get_storage_client', lambda: pytest.fail("no debe revalidar"))
+
+    assert transcription.get_csv_mapping() is first
+    assert first == {"gs://buckets_llamadas/001/a.wav": "111"}
+
+def test_unchanged_generation_is_not_read_again(transcription, monkeypatch):
+    monkeypatch.setattr(transcription, 'CSV_MAPPING_REVALIDATE_SECONDS', 0)
+    first = transcription.get_csv_mapping()
+    reads = csv_reads(transcription)
+    assert reads
+
+    assert transcription.get_csv_mapping() is first
+    assert transcription.get_csv_mapping() is first
+    assert csv_reads(transcription) == reads
+
+def test_new_generation_rebuilds_the_mapping(transcription, monkeypatch):
+    monkeypatch.setattr(transcription, 'CSV_MAPPING_REVALIDATE_SECONDS', 0)
+    transcription.get_csv_mapping()
+    reads = csv_reads(transcription)
+
+    transcription.fake_storage.put(transcription.CSV_BUCKET, transcription.CSV_BLOB_PATH, registry(
+        ("gs://buckets_llamadas/001/a.wav", "111"), ("gs://buckets_llamadas/002/b.wav", "222")))
+
+    assert transcription.get_csv_mapping()["gs://buckets_llamadas/002/b.wav"] == "222"
+    assert csv_reads(transcription) > reads
+    assert transcription._csv_mapping_generation == transcription.fake_storage.bucket(transcription.CSV_BUCKET).get_blob(transcription.CSV_BLOB_PATH).generation
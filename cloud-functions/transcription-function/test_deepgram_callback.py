@@ -0,0 +1,117 @@
+"""Tests del modo callback de Deepgram contra un Deepgram local (FakeDeepgramServer)"""
+import threading
+
+import pandas as pd
+import pytest
+from werkzeug.serving import make_server
+
+from conftest import load_function
+from fakes import FakeBigQueryClient, FakeDeepgramServer, FakeStorageClient
+
+AUDIO_BUCKET = "buckets_llamadas"
+AUDIO_FILE = "10052025/12345678_llamada.wav"
+AUDIO_PATH = f"gs://{AUDIO_BUCKET}/{AUDIO_FILE}"
+
+@pytest.fixture
+def transcription(monkeypatch):
+    module = load_function('transcription-function')
+    storage = FakeStorageClient()
+    storage.put(AUDIO_BUCKET, AUDIO_FILE, b'RIFF' + bytes(3 * 1024 * 1024))
+    bigquery = FakeBigQueryClient()
+    # transcription_exists ve las filas que ya se insertaron
+    bigquery.query_results = lambda sql: pd.DataFrame({"x": [1] * len(bigquery.inserted)})
+    handoffs = []
+
+    def handoff(*args):
+        handoffs.append(args)
+        return None, "msg-1", 0.0
+
+    monkeypatch.setenv('DEEPGRAM_API_KEY', 'test-key')
+    monkeypatch.setenv('DEEPGRAM_CALLBACK_SECRET', 'test-secret')
+    monkeypatch.setattr(module, 'get_storage_client', lambda: storage)
+    monkeypatch.setattr(module, 'get_bigquery_client', lambda: bigquery)
+    monkeypatch.setattr(module, 'handoff_analysis', handoff)
+    module.fake_storage, module.fake_bigquery, module.handoffs = storage, bigquery, handoffs
+    return module
+
+@pytest.fixture
+def callback_url(transcription, monkeypatch):
+    """receive_deepgram_callback servido por HTTP en un puerto local"""
+    from flask import Flask, request
+
+    app = Flask(__name__)
+    app.add_url_rule('/deepgram-callback', 'callback', lambda: transcription.receive_deepgram_callback(request), methods=['POST'])
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/deepgram-callback"
+    monkeypatch.setattr(transcription, 'DEEPGRAM_CALLBACK_URL', url)
+    yield url
+    server.shutdown()
+
+@pytest.fixture
+def deepgram(transcription, callback_url, monkeypatch):
+    server = FakeDeepgramServer()
+    monkeypatch.setattr(transcription, 'DEEPGRAM_LISTEN_URL', server.url)
+    yield server
+    server.close()
+
+def submit(transcription):
+    return transcription.submit_deepgram_callback(AUDIO_PATH, AUDIO_BUCKET, AUDIO_FILE, "12345678",
+                                                  content_key="md5:abc", source='stream')
+
+def inserted_rows(transcription):
+    return [row for _, rows in transcription.fake_bigquery.inserted for row in rows]
+
+def failed_markers(transcription):
+    return transcription.fake_storage.list_blobs(transcription.MANIFEST_BUCKET, prefix=transcription.FAILED_TRANSCRIPTION_PREFIX)
+
+def test_valid_callback_saves_the_transcription(transcription, deepgram):
+    assert submit(transcription) == {"success": True, "request_id": "req-1"}
+
+    [(status, body)] = deepgram.wait()
+
+    assert status == 200 and body['success'] and body['deepgram_request_id'] == "req-1"
+    assert len(deepgram.uploads[0]['audio']) == 4 + 3 * 1024 * 1024
+    [row] = inserted_rows(transcription)
+    assert row['audio_url'] == AUDIO_PATH and row['dni'] == "12345678" and row['hash_contenido'] == "md5:abc"
+    assert len(transcription.handoffs) == 1
+
+def test_forged_context_is_rejected(transcription, deepgram):
+    deepgram.rewrite_callback = lambda url: url.replace("dni=12345678", "dni=87654321")
+    submit(transcription)
+
+    assert deepgram.wait() == [(403, {"error": "Invalid callback signature"})]
+    assert inserted_rows(transcription) == []
+
+def test_expired_callback_is_rejected(transcription, deepgram, monkeypatch):
+    monkeypatch.setattr(transcription, 'DEEPGRAM_CALLBACK_MAX_AGE_SECONDS', -1)
+    submit(transcription)
+
+    assert deepgram.wait()[0][0] == 403
+    assert inserted_rows(transcription) == []
+
+def test_err_code_is_recorded_for_the_batch(transcription, deepgram, batch_processor, monkeypatch):
+    deepgram.callback_payload = {"err_code": "INVALID_AUDIO", "err_msg": "corrupt file"}
+    submit(transcription)
+
+    [(status, body)] = deepgram.wait()
+
+    assert status == 200 and body['retry_queued']
+    assert inserted_rows(transcription) == []
+    # El batch lo vuelve a encolar en su próxima ejecución
+    monkeypatch.setattr(batch_processor, 'get_storage_client', lambda: transcription.fake_storage)
+    calls, markers = batch_processor.load_failed_transcriptions()
+    assert list(calls['gsutil_url']) == [AUDIO_PATH] and list(calls['N_Doc']) == ["12345678"]
+    batch_processor.delete_failed_transcriptions(markers)
+    assert failed_markers(transcription) == []
+
+def test_repeated_delivery_saves_one_row(transcription, deepgram):
+    deepgram.deliveries = 2
+    submit(transcription)
+
+    first, second = deepgram.wait()
+
+    assert first[0] == second[0] == 200
+    assert second[1]['duplicate']
+    assert len(inserted_rows(transcription)) == 1
+    assert len(transcription.handoffs) == 1
@@ -0,0 +1,81 @@
+"""Tests de la caché de secretos con TTL (shared/secret_cache.py)"""
+import time
+
+import pytest
+
+import secret_cache
+
+class FakeSecretManager:
+    """fetch(secret_id, project_id) con valores versionados y fallas a pedido"""
+
+    def __init__(self):
+        self.version = 1
+        self.failing = False
+        self.calls = []
+
+    def fetch(self, secret_id, project_id):
+        self.calls.append((secret_id, project_id))
+        return None if self.failing else f"{secret_id}-v{self.version}"
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(secret_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+def make_cache(manager):
+    return secret_cache.SecretCache('proyecto', fetch=manager.fetch, ttl=100, max_stale=50, refresh_ahead=0.8)
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timeout esperando el refresco en segundo plano"
+        time.sleep(0.01)
+
+def test_values_are_served_from_memory_within_the_ttl(clock):
+    manager = FakeSecretManager()
+    cache = make_cache(manager)
+
+    assert cache.get('api-key') == 'api-key-v1'
+    clock[0] += 50
+    assert cache.get('api-key') == 'api-key-v1'
+
+    assert manager.calls == [('api-key', 'proyecto')]
+    assert cache.snapshot()['hits'] == 1
+
+def test_expired_values_are_read_again(clock):
+    manager = FakeSecretManager()
+    cache = make_cache(manager)
+    cache.get('api-key')
+
+    manager.version = 2
+    clock[0] += 100
+
+    assert cache.get('api-key') == 'api-key-v2'
+    assert cache.snapshot()['misses'] == 2
+
+def test_refresh_ahead_updates_in_the_background(clock):
+    manager = FakeSecretManager()
+    cache = make_cache(manager)
+    cache.get('api-key')
+
+    manager.version = 2
+    clock[0] += 85  # pasado el 80% del TTL
+
+    assert cache.get('api-key') == 'api-key-v1'  # responde sin esperar
+    wait_for(lambda: cache.snapshot()['background_refreshes'] == 1)
+    assert cache.get('api-key') == 'api-key-v2'
+
+def test_stale_value_is_served_only_within_the_window(clock):
+    manager = FakeSecretManager()
+    cache = make_cache(manager)
+    cache.get('api-key')
+    manager.failing = True
+
+    clock[0] += 120  # vencido, dentro de ttl + max_stale
+    assert cache.get('api-key') == 'api-key-v1'
+    clock[0] += 40  # 160 > ttl + max_stale
+    assert cache.get('api-key') is None
+
+    assert cache.snapshot()['stale_served'] == 1
+    assert cache.snapshot()['errors'] == 2
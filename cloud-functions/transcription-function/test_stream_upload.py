@@ -0,0 +1,84 @@
+"""Tests de la subida por streaming a Deepgram: memoria constante y pool propio"""
+import tracemalloc
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import load_function
+
+AUDIO_BYTES = 64 * 1024 * 1024
+
+class GeneratedAudioReader:
+    """Lector de un audio de size bytes que genera cada chunk al leerlo (nada queda en memoria)"""
+
+    def __init__(self, size):
+        self.remaining = size
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        self.remaining -= size
+        return bytes(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class GeneratedAudioBlob:
+    content_type = 'audio/wav'
+
+    def __init__(self, size):
+        self.size = size
+
+    def open(self, mode='rb', chunk_size=None):
+        return GeneratedAudioReader(self.size)
+
+class ConsumingSession:
+    """Sesión que consume el cuerpo como lo haría requests con transfer chunked"""
+
+    def __init__(self):
+        self.received = 0
+
+    def post(self, url, params, data, headers, timeout):
+        for chunk in data:
+            self.received += len(chunk)
+        return SimpleNamespace(status_code=200, json=lambda: {"request_id": "req-1"})
+
+@pytest.fixture
+def transcription(monkeypatch):
+    module = load_function('transcription-function')
+    blob = GeneratedAudioBlob(AUDIO_BYTES)
+    session = ConsumingSession()
+    sessions = []
+
+    def get_http_session(name='default', pool_maxsize=None):
+        sessions.append((name, pool_maxsize))
+        return session
+
+    monkeypatch.setenv('DEEPGRAM_API_KEY', 'test-key')
+    monkeypatch.setattr(module, 'get_storage_client', lambda: SimpleNamespace(
+        bucket=lambda name: SimpleNamespace(get_blob=lambda path: blob)))
+    monkeypatch.setattr(module, 'get_http_session', get_http_session)
+    module.fake_blob, module.fake_session, module.sessions = blob, session, sessions
+    return module
+
+def test_streaming_upload_keeps_memory_flat(transcription):
+    tracemalloc.start()
+    try:
+        result = transcription.stream_to_deepgram("gs://buckets_llamadas/a.wav", callback_url="https://example.test/cb")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert result == {"success": True, "request_id": "req-1"}
+    assert transcription.fake_session.received == AUDIO_BYTES
+    # 64 MB subidos con a lo sumo un par de chunks de 1 MB vivos a la vez
+    assert peak < 4 * transcription.DEEPGRAM_STREAM_CHUNK_BYTES
+
+def test_uploads_use_a_deepgram_pool_sized_to_the_batch(transcription):
+    transcription.stream_to_deepgram("gs://buckets_llamadas/a.wav", callback_url="https://example.test/cb")
+
+    assert transcription.sessions == [('deepgram', transcription.DEEPGRAM_POOL_MAXSIZE)]
+    # Con pool_block, un pool menor que la concurrencia dejaría workers esperando una conexión
+    assert transcription.DEEPGRAM_POOL_MAXSIZE >= transcription.BATCH_TRANSCRIPTION_CONCURRENCY
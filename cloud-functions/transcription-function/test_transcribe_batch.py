@@ -0,0 +1,108 @@
+"""Tests de transcribe_batch: estado por audio, errores del insert y partición en chunks"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import load_function
+from fakes import FakeBigQueryClient
+
+class ScriptedBigQueryClient(FakeBigQueryClient):
+    """insert_rows_json responde lo que indique el test para cada request, en orden"""
+
+    def __init__(self, responses=()):
+        super().__init__()
+        self.responses = list(responses)
+
+    def insert_rows_json(self, table, rows, **kwargs):
+        super().insert_rows_json(table, rows)
+        response = self.responses.pop(0) if self.responses else []
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+@pytest.fixture
+def transcription(monkeypatch):
+    module = load_function('transcription-function')
+    module.handoffs = []
+
+    def transcribe(audio_path, signed_url=None, source=None):
+        if 'corrupto' in audio_path:
+            return {"success": False, "error": "Deepgram HTTP 400"}
+        return {"success": True, "text": f"texto de {audio_path}", "duration": 60, "confidence": 0.9, "cost_usd": 0.005}
+
+    def handoff(transcripcion_id, dni, text, file_name):
+        module.handoffs.append(file_name)
+        return None, "msg-1", 0.0
+
+    monkeypatch.setattr(module, 'transcribe_with_deepgram', transcribe)
+    monkeypatch.setattr(module, 'get_audio_content_key', lambda bucket, name: None)
+    monkeypatch.setattr(module, 'get_dni_from_csv', lambda bucket, name: None)
+    monkeypatch.setattr(module, 'record_processed_audio', lambda audio_url: True)
+    monkeypatch.setattr(module, 'handoff_analysis', handoff)
+    return module
+
+def run_batch(transcription, monkeypatch, files, bigquery=None):
+    bigquery = bigquery or ScriptedBigQueryClient()
+    monkeypatch.setattr(transcription, 'get_bigquery_client', lambda: bigquery)
+    request = SimpleNamespace(headers={}, get_json=lambda silent=False: {"files": files, "source": "stream"})
+    return transcription.transcribe_batch(request)
+
+def audio(name, dni="12345678"):
+    return {"bucketName": "buckets_llamadas", "fileName": name, "dni": dni}
+
+def test_each_file_gets_its_own_status(transcription, monkeypatch):
+    response = run_batch(transcription, monkeypatch, [
+        audio("a.wav"),
+        {"bucketName": "buckets_llamadas"},
+        audio("notas.txt"),
+        audio("sin_dni.wav", dni=None),
+        audio("corrupto.wav"),
+    ])
+
+    statuses = [(item.get('fileName'), item['status']) for item in response['items']]
+    assert statuses == [("a.wav", "transcribed"), (None, "error"), ("notas.txt", "skipped"),
+                        ("sin_dni.wav", "error"), ("corrupto.wav", "error")]
+    assert (response['transcribed'], response['skipped'], response['error']) == (1, 1, 3)
+    assert "Deepgram HTTP 400" in response['items'][4]['error']
+    assert transcription.handoffs == ["a.wav"]
+
+def test_malformed_entries_fail_only_their_item(transcription, monkeypatch):
+    response = run_batch(transcription, monkeypatch, [
+        "a.wav", 42, None, {"bucketName": "buckets_llamadas", "fileName": 7}, audio("b.wav")
+    ])
+
+    assert [item['status'] for item in response['items']] == ["error", "error", "error", "error", "transcribed"]
+    assert "Invalid file entry: a.wav" in response['items'][0]['error']
+    assert transcription.handoffs == ["b.wav"]
+
+def test_insert_errors_map_back_to_their_file(transcription, monkeypatch):
+    # Las filas solo incluyen las transcripciones exitosas: [a, c, d]; el índice 1 es c.wav
+    bigquery = ScriptedBigQueryClient([[{"index": 1, "errors": [{"reason": "invalid"}]}]])
+
+    response = run_batch(transcription, monkeypatch, [
+        audio("a.wav"), audio("corrupto.wav"), audio("c.wav"), audio("d.wav")
+    ], bigquery)
+
+    statuses = {item['fileName']: item['status'] for item in response['items']}
+    assert statuses == {"a.wav": "transcribed", "corrupto.wav": "error", "c.wav": "error", "d.wav": "transcribed"}
+    assert "invalid" in response['items'][2]['error']
+    assert len(bigquery.inserted) == 1  # un único insert para todo el lote
+    assert sorted(transcription.handoffs) == ["a.wav", "d.wav"]
+
+def test_large_batches_are_split_under_the_request_limit(transcription):
+    # Cinco filas de ~4 MB: no caben en un request de 10 MB, van de a dos
+    rows = [{"audio_url": f"gs://b/{n}.wav", "transcripcion_texto": "x" * (4 * 1024 * 1024)} for n in range(5)]
+    bigquery = ScriptedBigQueryClient([
+        [],
+        [{"index": 0, "errors": [{"reason": "invalid"}]}],
+        TimeoutError("insert timeout"),
+    ])
+
+    failed = transcription.insert_transcription_rows(bigquery, rows)
+
+    assert [len(chunk) for _, chunk in bigquery.inserted] == [2, 2, 1]
+    assert all(len(json.dumps(chunk)) <= transcription.BQ_INSERT_MAX_BYTES for _, chunk in bigquery.inserted)
+    # Los índices de cada chunk se traducen al índice de la fila en el lote
+    assert set(failed) == {2, 4}
+    assert "insert timeout" in failed[4]
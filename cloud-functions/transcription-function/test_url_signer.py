@@ -0,0 +1,66 @@
+"""Tests del firmador local de URLs V4 con caché (shared/url_signer.py)"""
+import pytest
+
+import url_signer
+
+class FakeSigningStorage:
+    """Cliente GCS mínimo: generate_signed_url numera cada firma"""
+
+    def __init__(self):
+        self.signed = []
+
+    def bucket(self, bucket_name):
+        storage = self
+
+        class Blob:
+            def __init__(self, name):
+                self.name = name
+
+            def generate_signed_url(self, version, expiration, method, credentials):
+                storage.signed.append((bucket_name, self.name, credentials))
+                return f"https://signed.test/{bucket_name}/{self.name}?n={len(storage.signed)}"
+
+        return type('Bucket', (), {"blob": lambda _, name: Blob(name)})()
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(url_signer.time, 'monotonic', lambda: now[0])
+    return now
+
+def make_signer(storage, **options):
+    return url_signer.UrlSigner(lambda: None, lambda: storage, **options)
+
+def test_signed_urls_are_reused_while_valid(clock):
+    storage = FakeSigningStorage()
+    signer = make_signer(storage, expiration=3600, min_remaining=600)
+
+    first = signer.sign("gs://buckets_llamadas/001/a.wav")
+    clock[0] += 2999  # quedan 601 s de validez
+    again = signer.sign("gs://buckets_llamadas/001/a.wav")
+
+    assert first == again
+    assert storage.signed == [("buckets_llamadas", "001/a.wav", None)]
+    assert signer.snapshot()['cache_hits'] == 1
+
+def test_urls_close_to_expiring_are_signed_again(clock):
+    storage = FakeSigningStorage()
+    signer = make_signer(storage, expiration=3600, min_remaining=600)
+
+    first = signer.sign("gs://buckets_llamadas/001/a.wav")
+    clock[0] += 3001
+
+    assert signer.sign("gs://buckets_llamadas/001/a.wav") != first
+    assert len(storage.signed) == 2
+
+def test_sign_many_signs_only_missing_paths_and_evicts_lru(clock):
+    storage = FakeSigningStorage()
+    signer = make_signer(storage, max_cached=2)
+    signer.sign("gs://buckets_llamadas/001/a.wav")
+
+    signed = signer.sign_many(["gs://buckets_llamadas/001/a.wav", "gs://buckets_llamadas/002/b.wav",
+                               "gs://buckets_llamadas/003/c.wav", "gs://buckets_llamadas/002/b.wav"])
+
+    assert len(signed) == 3
+    assert len(storage.signed) == 3
+    assert list(signer.cache) == ["gs://buckets_llamadas/002/b.wav", "gs://buckets_llamadas/003/c.wav"]
@@ -12,10 +12,17 @@ CREATE TABLE `peak-emitter-350713.Calidad_Llamadas.transcripciones` (
   error_mensaje STRING,
   tokens_deepgram INTEGER,
   costo_deepgram_usd FLOAT64,
+  hash_contenido STRING, -- md5 (o crc32c + tamaño) del objeto GCS, para dedup por contenido
+  reutilizada_de STRING, -- audio_url original cuando la transcripción se copió de un duplicado
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
   updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
 );
 
+-- Migración para tablas transcripciones ya creadas sin dedup por contenido
+ALTER TABLE `peak-emitter-350713.Calidad_Llamadas.transcripciones`
+  ADD COLUMN IF NOT EXISTS hash_contenido STRING,
+  ADD COLUMN IF NOT EXISTS reutilizada_de STRING;
+
 -- Tabla para almacenar análisis de calidad de OpenAI
 CREATE TABLE `peak-emitter-350713.Calidad_Llamadas.analisis_calidad` (
   dni STRING NOT NULL,
@@ -43,22 +50,42 @@ CREATE TABLE `peak-emitter-350713.Calidad_Llamadas.analisis_calidad` (
 );
 
 -- Tabla para métricas y monitoreo del pipeline
+-- Una fila por ejecución (fecha, run_id), escrita con un MERGE al final de cada batch
 CREATE TABLE `peak-emitter-350713.Calidad_Llamadas.metricas_pipeline` (
   fecha DATE NOT NULL,
+  run_id STRING, -- id de la ejecución que escribió la fila
+  origen STRING, -- batch-processor, quality-analysis
   audios_procesados INTEGER DEFAULT 0,
   transcripciones_exitosas INTEGER DEFAULT 0,
   analisis_completados INTEGER DEFAULT 0,
   tiempo_promedio_transcripcion FLOAT64,
+  tiempo_p50_transcripcion FLOAT64,
+  tiempo_p95_transcripcion FLOAT64,
   tiempo_promedio_analisis FLOAT64,
+  tiempo_p50_analisis FLOAT64,
+  tiempo_p95_analisis FLOAT64,
   costo_total_deepgram FLOAT64 DEFAULT 0.0,
   costo_total_openai FLOAT64 DEFAULT 0.0,
   errores_transcripcion INTEGER DEFAULT 0,
   errores_analisis INTEGER DEFAULT 0,
-  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
-);
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
+)
+PARTITION BY fecha;
+
+-- Migración para tablas metricas_pipeline ya creadas sin las columnas por ejecución
+ALTER TABLE `peak-emitter-350713.Calidad_Llamadas.metricas_pipeline`
+  ADD COLUMN IF NOT EXISTS run_id STRING,
+  ADD COLUMN IF NOT EXISTS origen STRING,
+  ADD COLUMN IF NOT EXISTS tiempo_p50_transcripcion FLOAT64,
+  ADD COLUMN IF NOT EXISTS tiempo_p95_transcripcion FLOAT64,
+  ADD COLUMN IF NOT EXISTS tiempo_p50_analisis FLOAT64,
+  ADD COLUMN IF NOT EXISTS tiempo_p95_analisis FLOAT64,
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
 
 -- Índices para optimizar consultas
 CREATE INDEX idx_transcripciones_dni_fecha ON `peak-emitter-350713.Calidad_Llamadas.transcripciones`(dni, fecha_llamada);
 CREATE INDEX idx_analisis_dni_fecha ON `peak-emitter-350713.Calidad_Llamadas.analisis_calidad`(dni, fecha_llamada);
 CREATE INDEX idx_transcripciones_estado ON `peak-emitter-350713.Calidad_Llamadas.transcripciones`(estado);
+CREATE INDEX idx_transcripciones_hash ON `peak-emitter-350713.Calidad_Llamadas.transcripciones`(hash_contenido);
 CREATE INDEX idx_analisis_estado ON `peak-emitter-350713.Calidad_Llamadas.analisis_calidad`(estado);
\ No newline at end of file